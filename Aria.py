@@ -21,7 +21,6 @@
 
 import ConfigParser
 import atexit
-import inspect
 import logging
 import logging.config
 import os
@@ -32,6 +31,9 @@ import threading
 import pydevd
 from pydispatch import dispatcher
 
+from core import bus
+from core import loader
+
 
 @atexit.register
 ## @fn def clean_exit():
@@ -84,8 +86,6 @@ def aria_start():
         exit(-1)
     _logger.debug('Logger started')
     # Loading modules
-    # Storing loaded modules
-    active_modules = list()
     try:
         # Search all files in plugin folder
         plugin_dir = _config.get('Modules', 'Path').strip()
@@ -105,54 +105,31 @@ def aria_start():
         exit(-1)
     _logger.info('Disabled modules : %s' % disable_modules)
     _logger.info('Disabled classes : %s' % disable_classes)
+    try:
+        # Modules loaded on first signal
+        lazy_modules = _config.get('Modules', 'Lazy').strip().split(',')
+    except ConfigParser.Error:
+        lazy_modules = []
+    _logger.info('Lazy modules : %s' % lazy_modules)
+
+    try:
+        # Loader settings
+        loader_workers = _config.getint('Loader', 'workers')
+        ready_timeout = _config.getfloat('Loader', 'ready_timeout')
+    except (ConfigParser.Error, ValueError):
+        _logger.info('Loader settings not found using default')
+        loader_workers = 4
+        ready_timeout = 10.0
 
     if not os.path.exists(plugin_dir):
         _logger.critical('Plugins folder not exist')
         exit(-1)
-    # Searching .py files in folder 'plugins'
-    for fname in os.listdir(plugin_dir):
-        # Look only for py files
-        if (fname.endswith('.py')) and ('plugin' in fname.lower()):
-            # Cut .py from path
-            module_name = fname[: -3]
-            # Skip base,__init__  and disabled files
-            if module_name != 'base' and module_name != '__init__' and not (module_name in disable_modules):
-                _logger.info('Found module %s' % module_name)
-                # Load module and add it to list of loaded modules
-                package_obj = __import__(plugin_dir + '.' + module_name)
-                active_modules.append(module_name)
-            else:
-                _logger.info('Skipping %s' % fname)
-
-    # Retrieving modules
-    _loaded_modules = []
-    for modulename in active_modules:
-        module_obj = getattr(package_obj, modulename)
-        # Looking for classes in file
-        for elem in dir(module_obj):
-            obj = getattr(module_obj, elem)
-            # If this a class ?
-            if inspect.isclass(obj):
-                if elem in disable_classes:
-                    _logger.info('Skipping %s' % obj)
-                    continue
-                # Creating object
-                try:
-                    _logger.info('Loading module %s from %s' % (elem, modulename))
-                    try:
-                        _module = obj()
-                    except (ImportError, TypeError) as e:
-                        # Some error while creating module instance
-                        _logger.fatal('Incorrect module. Error %s' % e)
-                except ImportWarning:
-                    _logger.warning('Failed to load %s from %s' % (elem, modulename))
-                    del _module
-                    pass
-                else:
-                    # Store module instance
-                    _loaded_modules.append(_module)
-                    _logger.info('Module %s (version: %s) loaded' % (elem, _module.version))
-    sleep(5)  # Init time
+    # Load plugins in dependency order and wait until all of them ready
+    plugin_loader = loader.PluginLoader(plugin_dir, disable_modules, disable_classes,
+                                        workers=loader_workers, ready_timeout=ready_timeout,
+                                        lazy_modules=lazy_modules)
+    plugin_loader.discover()
+    _loaded_modules = plugin_loader.start()
     _logger.info('All modules loaded')
     # Create event for shutdown of main thread
     dispatcher.connect(emergency_shutdown, signal='EmergencyShutdown')
@@ -167,6 +144,7 @@ def aria_start():
         _logger.warning("Keyboard Interrupt received")
     except SystemExit:
         _logger.warning("System shutdown")
+    bus.report(_logger)
 
     for _module in _loaded_modules:
         try:
@@ -0,0 +1,7 @@
+## @file
+## @brief Core services package
+## @par
+# Shared infrastructure used by Aria main file and plugins (plugin loader, event bus, helpers).
+# Modules in this package are not plugins - loader never search classes here.
+#
+## @see https://docs.python.org/2/tutorial/modules.html#packages
@@ -0,0 +1,207 @@
+## @file
+## @brief Audio device arbiter
+## @details Grant audio device to one job at time. Jobs waiting in priority queue, same priority jobs served
+# in request order. Low priority job (hot-word recognizer) preempted when higher priority job requested.
+# Job handoff done with condition variable - no polling.
+#
+import logging
+import threading
+from time import time
+
+## @brief Job priorities - lower value served first
+PRIORITY = dict(play=1, record=1, listen=2)
+
+
+## @class AudioTicket
+## @brief Audio device request
+## @details Created by AudioArbiter.submit, passed to wait and release
+class AudioTicket(object):
+    ## @brief Create ticket
+    ## @param kind Job kind - play, record or listen
+    ## @param sequence Request order number
+    ## @param preempt Callback called when higher priority job waiting. None - job can't be preempted
+    def __init__(self, kind, sequence, preempt=None):
+        ## @brief Job kind
+        self.kind = kind
+        ## @brief Job priority
+        self.priority = PRIORITY[kind]
+        ## @brief Request order number
+        self.sequence = sequence
+        ## @brief Preempt callback
+        self.preempt = preempt
+        ## @brief Request time
+        self.submitted = time()
+        ## @brief Grant time
+        self.granted = None
+        ## @brief True if preemption requested
+        self.preempted = False
+        ## @brief Kind of job that requested preemption
+        self.preempted_by = None
+        ## @brief True when device released or request canceled
+        self.released = False
+        ## @brief Time spent in queue - valid after grant
+        self.queue_wait = None
+        ## @brief Time from previous job release (or preemption request) to grant - valid after grant
+        self.switch_time = None
+
+    ## @brief Sort key
+    @property
+    def order(self):
+        return self.priority, self.sequence
+
+
+## @class AudioArbiter
+## @brief Audio device arbiter
+## @details Priority queue of audio jobs with fair (first come first served) handling of same priority jobs
+class AudioArbiter(object):
+    ## @brief Create arbiter
+    ## @param logger Logger instance
+    def __init__(self, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('Audio')
+        ## @brief Synchronization object - device state changed
+        self._device_change = threading.Condition()
+        ## @brief Waiting tickets
+        self._waiting = []
+        ## @brief Device owner
+        self._owner = None
+        ## @brief Request counter
+        self._sequence = 0
+        ## @brief Last release time
+        self._released_time = None
+        ## @brief Preemption request time
+        self._preempt_time = None
+        ## @brief Statistics - name - [count, total, maximum]
+        self._statistics = dict()
+
+    ## @brief Request audio device
+    ## @details Ticket put in queue immediately, request order kept even if wait called later from other thread
+    ## @param kind Job kind - play, record or listen
+    ## @param preempt Callback called when higher priority job waiting. None - job can't be preempted
+    ## @return AudioTicket instance
+    def submit(self, kind, preempt=None):
+        with self._device_change:
+            self._sequence += 1
+            ticket = AudioTicket(kind, self._sequence, preempt)
+            self._waiting.append(ticket)
+            self._waiting.sort(key=lambda item: item.order)
+            self._dispatch()
+            preempt_callback = self._check_preemption()
+        if preempt_callback is not None:
+            preempt_callback()
+        return ticket
+
+    ## @brief Wait until device granted
+    ## @param ticket AudioTicket instance
+    ## @param timeout Maximum wait time in seconds. Default - wait forever
+    ## @return True if device granted
+    def wait(self, ticket, timeout=None):
+        deadline = None if timeout is None else time() + timeout
+        with self._device_change:
+            while self._owner is not ticket and not ticket.released:
+                if deadline is None:
+                    self._device_change.wait()
+                else:
+                    remain = deadline - time()
+                    if remain <= 0:
+                        return False
+                    self._device_change.wait(remain)
+            return self._owner is ticket
+
+    ## @brief Request audio device and wait until granted
+    ## @param kind Job kind - play, record or listen
+    ## @param preempt Callback called when higher priority job waiting. None - job can't be preempted
+    ## @return AudioTicket instance
+    def acquire(self, kind, preempt=None):
+        ticket = self.submit(kind, preempt)
+        self.wait(ticket)
+        return ticket
+
+    ## @brief Release device or cancel waiting request
+    ## @param ticket AudioTicket instance
+    def release(self, ticket):
+        with self._device_change:
+            if ticket.released:
+                return
+            ticket.released = True
+            if self._owner is ticket:
+                self._owner = None
+                self._released_time = time()
+                self._logger.debug('Audio device released by %s after %.3f sec' %
+                                   (ticket.kind, self._released_time - ticket.granted))
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._dispatch()
+            preempt_callback = self._check_preemption()
+            self._device_change.notify_all()
+        if preempt_callback is not None:
+            preempt_callback()
+
+    ## @brief Number of waiting jobs
+    ## @param kind Job kind. Default - all kinds
+    ## @return Number of waiting tickets
+    def waiting(self, kind=None):
+        with self._device_change:
+            return len([ticket for ticket in self._waiting if kind is None or ticket.kind == kind])
+
+    ## @brief Next served job kind
+    ## @return Kind of first waiting ticket or None if queue empty
+    def next_kind(self):
+        with self._device_change:
+            return self._waiting[0].kind if self._waiting else None
+
+    ## @brief Current device owner kind
+    ## @return Job kind or None if device free
+    def owner(self):
+        with self._device_change:
+            return self._owner.kind if self._owner is not None else None
+
+    ## @brief Latency statistics
+    ## @return Dictionary of name - dictionary (count, average, maximum) for queue wait per kind and device switch
+    def statistics(self):
+        with self._device_change:
+            return dict((name, dict(count=item[0], average=item[1] / item[0] if item[0] else 0.0, maximum=item[2]))
+                        for name, item in self._statistics.items())
+
+    ## @brief Grant device to next waiting ticket
+    ## @warning Should be called with device lock held
+    def _dispatch(self):
+        if self._owner is not None or not self._waiting:
+            return
+        ticket = self._waiting.pop(0)
+        ticket.granted = time()
+        ticket.queue_wait = ticket.granted - ticket.submitted
+        switch_start = self._preempt_time or self._released_time
+        ticket.switch_time = ticket.granted - switch_start if switch_start and switch_start > ticket.submitted \
+            else 0.0
+        self._preempt_time = None
+        self._owner = ticket
+        self._store('wait_%s' % ticket.kind, ticket.queue_wait)
+        if ticket.switch_time:
+            self._store('switch', ticket.switch_time)
+        self._logger.debug('Audio device granted to %s. Queue wait %.3f sec, switch %.3f sec' %
+                           (ticket.kind, ticket.queue_wait, ticket.switch_time))
+        self._device_change.notify_all()
+
+    ## @brief Request preemption of device owner if higher priority job waiting
+    ## @warning Should be called with device lock held
+    ## @return Preempt callback to be called after lock released or None
+    def _check_preemption(self):
+        owner = self._owner
+        if owner is None or owner.preempt is None or owner.preempted or not self._waiting:
+            return None
+        if self._waiting[0].priority >= owner.priority:
+            return None
+        owner.preempted = True
+        owner.preempted_by = self._waiting[0].kind
+        self._preempt_time = time()
+        self._logger.debug('Preempting %s for %s' % (owner.kind, self._waiting[0].kind))
+        return owner.preempt
+
+    ## @brief Store statistic value
+    ## @warning Should be called with device lock held
+    def _store(self, name, value):
+        item = self._statistics.setdefault(name, [0, 0.0, 0.0])
+        item[0] += 1
+        item[1] += value
+        item[2] = max(item[2], value)
@@ -0,0 +1,128 @@
+## @file
+## @brief Decoded audio asset cache
+## @details Wave assets (sound effects) decoded once into shared in-memory clips. Optional conversion to
+# output format done at load time, so played clips never force output stream restart.
+# Cache limited by memory budget, least recently used assets evicted first.
+#
+import audioop
+import logging
+import os
+import threading
+import wave
+from collections import OrderedDict
+
+from core import playback
+
+
+## @class AssetCache
+## @brief LRU cache of decoded wave assets
+class AssetCache(object):
+    ## @brief Create cache
+    ## @param budget Maximum total size of decoded assets in bytes
+    ## @param output_format Tuple (rate, channels, width) assets converted to. None - keep asset format
+    ## @param logger Logger instance
+    def __init__(self, budget, output_format=None, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('Audio')
+        ## @brief Memory budget
+        self._budget = budget
+        ## @brief Output format
+        self._output_format = output_format
+        ## @brief Path - (modification time, clip) in LRU order (oldest first)
+        self._assets = OrderedDict()
+        ## @brief Total size of decoded assets
+        self._bytes = 0
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Counters
+        self._counters = dict(hits=0, misses=0, evictions=0)
+
+    ## @brief Get asset clip
+    ## @details Asset decoded on first use and reloaded when file changed
+    ## @param filename Path to wave file
+    ## @return playback.Clip instance
+    ## @exception IOError Fail to read file
+    ## @exception wave.Error Broken wave file
+    def get(self, filename):
+        path = os.path.abspath(filename)
+        modified = os.path.getmtime(path)
+        with self._lock:
+            entry = self._assets.pop(path, None)
+            if entry is not None and entry[0] == modified:
+                self._assets[path] = entry
+                self._counters['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                self._bytes -= entry[1].size
+            self._counters['misses'] += 1
+        clip = self._decode(path)
+        with self._lock:
+            if path not in self._assets:
+                self._assets[path] = (modified, clip)
+                self._bytes += clip.size
+                self._evict(keep=path)
+        return clip
+
+    ## @brief Load assets
+    ## @param filenames List of wave file paths
+    ## @return Number of loaded assets
+    def preload(self, filenames):
+        loaded = 0
+        for filename in filenames:
+            try:
+                self.get(filename)
+                loaded += 1
+            except (IOError, OSError, wave.Error) as e:
+                self._logger.warning('Fail to preload %s with error %s' % (filename, e))
+        self._logger.debug('Preloaded %d assets. Cache statistics %s' % (loaded, self.statistics()))
+        return loaded
+
+    ## @brief Cache statistics
+    ## @return Dictionary of hits, misses, evictions, items and bytes
+    def statistics(self):
+        with self._lock:
+            result = dict(self._counters)
+            result.update(items=len(self._assets), bytes=self._bytes)
+            return result
+
+    ## @brief Decode wave file
+    ## @param path Path to wave file
+    ## @return playback.Clip instance
+    def _decode(self, path):
+        reader = wave.open(path, 'rb')
+        try:
+            rate, channels, width = reader.getframerate(), reader.getnchannels(), reader.getsampwidth()
+            data = reader.readframes(reader.getnframes())
+        finally:
+            reader.close()
+        if self._output_format is not None:
+            target_rate, target_channels, target_width = self._output_format
+            if width == 1:
+                # 8 bit wave data unsigned, audioop work with signed samples
+                data = audioop.bias(data, 1, -128)
+            if width != target_width:
+                data = audioop.lin2lin(data, width, target_width)
+                width = target_width
+            if channels == 2 and target_channels == 1:
+                data = audioop.tomono(data, width, 0.5, 0.5)
+            elif channels == 1 and target_channels == 2:
+                data = audioop.tostereo(data, width, 1, 1)
+            channels = target_channels
+            if rate != target_rate:
+                data = audioop.ratecv(data, width, channels, rate, target_rate, None)[0]
+                rate = target_rate
+            if width == 1:
+                data = audioop.bias(data, 1, 128)
+        return playback.Clip(data, rate, channels, width)
+
+    ## @brief Evict least recently used assets
+    ## @param keep Path that should not be evicted
+    ## @warning Should be called with lock held
+    def _evict(self, keep=None):
+        while self._bytes > self._budget and self._assets:
+            path = next(iter(self._assets))
+            if path == keep:
+                break
+            self._bytes -= self._assets.pop(path)[1].size
+            self._counters['evictions'] += 1
+            self._logger.debug('Asset %s evicted' % path)
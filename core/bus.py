@@ -0,0 +1,392 @@
+## @file
+## @brief Event bus
+## @details Queue backed signal delivery on top of pydispatch.
+# Module keep pydispatch connect/send API. Receivers connected in asynchronous mode get own bounded queue
+# and worker thread, so dispatcher.send return without waiting them. Senders are not changed - any
+# dispatcher.send reach asynchronous receivers through their queues.
+#
+## @par Overflow policies
+# drop_oldest - Remove oldest queued signal when queue full.\n
+# coalesce - Replace queued signal with same key (see coalesce_key), drop oldest when queue full.\n
+# block - Sender wait until queue has free place.\n
+#
+## @par Coalescing options
+# coalesce_interval - Frame interval. Signals collected during frame, only latest signal per key delivered.\n
+# suppress_unchanged - Signal with same arguments as last delivered signal of same key is dropped.\n
+#
+## @see http://pydispatcher.sourceforge.net/
+import logging
+import threading
+from collections import deque
+from time import time
+
+from pydispatch import dispatcher
+from pydispatch import robustapply
+from pydispatch import saferef
+
+## @brief Any signal/sender
+Any = dispatcher.Any
+## @brief Anonymous sender
+Anonymous = dispatcher.Anonymous
+
+## @brief Overflow policy - drop oldest queued signal
+DROP_OLDEST = 'drop_oldest'
+## @brief Overflow policy - replace queued signal with same key
+COALESCE = 'coalesce'
+## @brief Overflow policy - block sender
+BLOCK = 'block'
+
+## @brief Missing value marker
+_missing = object()
+## @brief Logger instance
+_logger = logging.getLogger('root')
+## @brief Thread local flag - synchronous delivery requested by send_sync
+_delivery_mode = threading.local()
+## @brief Asynchronous receivers by (receiver key, signal, sender) key
+_queued_receivers = dict()
+## @brief Synchronization object - protect receivers dictionary
+_queued_receivers_lock = threading.Lock()
+
+
+## @class SignalMetrics
+## @brief Bus statistics
+## @details Collect per signal delivery latency and per receiver queue depth
+class SignalMetrics(object):
+    ## @brief Create empty statistics
+    def __init__(self):
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Signal - [count, total latency, max latency]
+        self._latency = dict()
+        ## @brief Signal - [dropped, coalesced, suppressed]
+        self._overflow = dict()
+        ## @brief Receiver name - [current depth, maximum depth]
+        self._depth = dict()
+
+    ## @brief Store delivery latency
+    ## @param signal Signal name
+    ## @param latency Time from send to delivery end in seconds
+    def delivered(self, signal, latency):
+        with self._lock:
+            item = self._latency.setdefault(signal, [0, 0.0, 0.0])
+            item[0] += 1
+            item[1] += latency
+            item[2] = max(item[2], latency)
+
+    ## @brief Store overflow event
+    ## @param signal Signal name
+    ## @param reason Why signal was not delivered - dropped, coalesced or suppressed
+    def overflow(self, signal, reason):
+        with self._lock:
+            item = self._overflow.setdefault(signal, [0, 0, 0])
+            item[('dropped', 'coalesced', 'suppressed').index(reason)] += 1
+
+    ## @brief Store receiver queue depth
+    ## @param name Receiver name
+    ## @param depth Current queue depth
+    def depth(self, name, depth):
+        with self._lock:
+            item = self._depth.setdefault(name, [0, 0])
+            item[0] = depth
+            item[1] = max(item[1], depth)
+
+    ## @brief Statistics snapshot
+    ## @return Dictionary with latency, overflow and depth data
+    def snapshot(self):
+        with self._lock:
+            latency = dict((signal, dict(count=item[0],
+                                         average=item[1] / item[0] if item[0] else 0.0,
+                                         maximum=item[2]))
+                           for signal, item in self._latency.items())
+            overflow = dict((signal, dict(dropped=item[0], coalesced=item[1], suppressed=item[2]))
+                            for signal, item in self._overflow.items())
+            depth = dict((name, dict(current=item[0], maximum=item[1])) for name, item in self._depth.items())
+        return dict(latency=latency, overflow=overflow, depth=depth)
+
+
+## @brief Bus statistics instance
+metrics = SignalMetrics()
+
+
+## @class QueuedReceiver
+## @brief Asynchronous receiver wrapper
+## @details Connected to pydispatch instead of receiver. Store signals in bounded queue and deliver them
+# to receiver from worker thread
+class QueuedReceiver(object):
+    ## @brief Create wrapper
+    ## @param receiver Receiver function
+    ## @param signal Signal name
+    ## @param queue_size Maximum queue size
+    ## @param overflow Overflow policy
+    ## @param coalesce_key Function of signal arguments dictionary return coalesce key. Default - all signals same key
+    ## @param weak If True only weak reference to receiver is stored
+    ## @param coalesce_interval Frame interval in seconds - coalesce policy only
+    ## @param suppress_unchanged Drop signals equal to last delivered one with same key - coalesce policy only
+    def __init__(self, receiver, signal, queue_size=100, overflow=DROP_OLDEST, coalesce_key=None, weak=True,
+                 coalesce_interval=0.0, suppress_unchanged=False):
+        if overflow not in (DROP_OLDEST, COALESCE, BLOCK):
+            raise ValueError('Unknown overflow policy %s' % overflow)
+        ## @brief Receiver reference
+        if weak:
+            self._reference = saferef.safeRef(receiver, onDelete=self._receiver_deleted)
+        else:
+            self._reference = lambda: receiver
+        ## @brief Receiver name for statistics
+        self.name = '%s(%s)' % (getattr(receiver, '__name__', repr(receiver)), signal)
+        ## @brief Signal name
+        self.signal = signal
+        ## @brief Maximum queue size
+        self._queue_size = max(1, int(queue_size))
+        ## @brief Overflow policy
+        self._overflow = overflow
+        ## @brief Coalesce key function
+        self._coalesce_key = coalesce_key
+        ## @brief Frame interval
+        self._coalesce_interval = float(coalesce_interval) if overflow == COALESCE else 0.0
+        ## @brief If True unchanged signals dropped
+        self._suppress_unchanged = suppress_unchanged and overflow == COALESCE
+        ## @brief Last delivered arguments by coalesce key
+        self._delivered = dict()
+        ## @brief Queue of [key, message] entries
+        self._queue = deque()
+        ## @brief Queued entries by coalesce key
+        self._queued_keys = dict()
+        ## @brief Synchronization object - queue state changed
+        self._queue_change = threading.Condition()
+        ## @brief Set when wrapper stopped
+        self._stopped = False
+        ## @brief Delivery thread
+        self._thread = threading.Thread(target=self._run, name='Bus-%s' % self.name)
+        self._thread.setDaemon(True)
+
+    ## @brief Start delivery thread
+    def start(self):
+        self._thread.start()
+
+    ## @brief Stop delivery thread
+    ## @details Queued signals are discarded
+    def stop(self):
+        with self._queue_change:
+            self._stopped = True
+            self._queue.clear()
+            self._queued_keys.clear()
+            self._delivered.clear()
+            self._queue_change.notify_all()
+
+    ## @brief Current queue depth
+    @property
+    def depth(self):
+        with self._queue_change:
+            return len(self._queue)
+
+    ## @brief Signal handler called by pydispatch
+    ## @details Queue signal or deliver it immediately when send_sync used
+    ## @param arguments Positional signal arguments
+    ## @param named Signal arguments
+    def __call__(self, *arguments, **named):
+        if getattr(_delivery_mode, 'synchronous', False):
+            return self._deliver(arguments, named)
+        self.put(arguments, named)
+
+    ## @brief Add signal to queue
+    ## @param arguments Positional signal arguments
+    ## @param named Signal arguments
+    def put(self, arguments, named):
+        message = (time(), arguments, named)
+        signal = named.get('signal', self.signal)
+        with self._queue_change:
+            if self._stopped:
+                return
+            key = None
+            if self._overflow == COALESCE:
+                key = self._coalesce_key(named) if self._coalesce_key is not None else None
+                if key in self._queued_keys:
+                    self._queued_keys[key][1] = message
+                    metrics.overflow(signal, 'coalesced')
+                    return
+                if self._suppress_unchanged and self._delivered.get(key, _missing) == self._state(message):
+                    metrics.overflow(signal, 'suppressed')
+                    return
+            while len(self._queue) >= self._queue_size:
+                if self._overflow == BLOCK:
+                    self._queue_change.wait()
+                    if self._stopped:
+                        return
+                else:
+                    dropped = self._queue.popleft()
+                    self._queued_keys.pop(dropped[0], None)
+                    metrics.overflow(signal, 'dropped')
+            entry = [key, message]
+            self._queue.append(entry)
+            if self._overflow == COALESCE:
+                self._queued_keys[key] = entry
+            metrics.depth(self.name, len(self._queue))
+            self._queue_change.notify_all()
+
+    ## @brief Signal state used for unchanged signal detection
+    ## @param message Queued message
+    ## @return Tuple of positional arguments and sorted named arguments except signal and sender
+    @staticmethod
+    def _state(message):
+        return message[1], sorted((name, value) for name, value in message[2].items()
+                                  if name not in ('signal', 'sender'))
+
+    ## @brief Delivery thread
+    ## @details In coalescing mode with frame interval, first signal of frame wait until frame end.
+    # Signals of same key received during frame replace it
+    def _run(self):
+        while True:
+            with self._queue_change:
+                while not self._queue and not self._stopped:
+                    self._queue_change.wait()
+                if self._coalesce_interval > 0:
+                    frame_end = self._queue[0][1][0] + self._coalesce_interval if self._queue else 0
+                    while not self._stopped and time() < frame_end:
+                        self._queue_change.wait(frame_end - time())
+                if self._stopped:
+                    return
+                entry = self._queue.popleft()
+                self._queued_keys.pop(entry[0], None)
+                metrics.depth(self.name, len(self._queue))
+                self._queue_change.notify_all()
+                send_time, arguments, named = entry[1]
+                if self._suppress_unchanged:
+                    state = self._state(entry[1])
+                    if self._delivered.get(entry[0], _missing) == state:
+                        metrics.overflow(named.get('signal', self.signal), 'suppressed')
+                        continue
+                    self._delivered[entry[0]] = state
+            self._deliver(arguments, named)
+            metrics.delivered(named.get('signal', self.signal), time() - send_time)
+
+    ## @brief Call receiver
+    ## @param arguments Positional signal arguments
+    ## @param named Signal arguments
+    ## @return Receiver response
+    def _deliver(self, arguments, named):
+        receiver = self._reference()
+        if receiver is None:
+            return None
+        try:
+            return robustapply.robustApply(receiver, *arguments, **named)
+        except Exception as e:
+            _logger.error('Receiver %s failed with error %s' % (self.name, e))
+            return None
+
+    ## @brief Weak reference callback
+    ## @details Remove wrapper when receiver deleted
+    def _receiver_deleted(self, reference):
+        with _queued_receivers_lock:
+            for key, queued in _queued_receivers.items():
+                if queued is self:
+                    del _queued_receivers[key]
+        try:
+            dispatcher.disconnect(self, signal=self.signal, sender=Any, weak=False)
+        except dispatcher.DispatcherKeyError:
+            pass
+        self.stop()
+
+
+## @brief Receiver identity
+## @details Bound methods identified by object and function, same as pydispatch
+## @param receiver Receiver function
+## @return Hashable receiver key
+def _receiver_key(receiver):
+    if hasattr(receiver, 'im_self') and hasattr(receiver, 'im_func'):
+        return id(receiver.im_self), id(receiver.im_func)
+    return id(receiver)
+
+
+## @brief Connect receiver to signal
+## @details Same as pydispatch connect. In asynchronous mode receiver called from own worker thread
+## @param receiver Receiver function
+## @param signal Signal name
+## @param sender Sender. Default - Any
+## @param weak If True only weak reference to receiver is stored
+## @param asynchronous If True signal delivered through queue
+## @param queue_size Maximum queue size - asynchronous mode only
+## @param overflow Overflow policy - asynchronous mode only
+## @param coalesce_key Coalesce key function - coalesce policy only
+## @param coalesce_interval Frame interval in seconds - coalesce policy only
+## @param suppress_unchanged Drop signals equal to last delivered one with same key - coalesce policy only
+def connect(receiver, signal=Any, sender=Any, weak=True, asynchronous=False, queue_size=100, overflow=DROP_OLDEST,
+            coalesce_key=None, coalesce_interval=0.0, suppress_unchanged=False):
+    if not asynchronous:
+        dispatcher.connect(receiver, signal=signal, sender=sender, weak=weak)
+        return
+    queued = QueuedReceiver(receiver, signal, queue_size, overflow, coalesce_key, weak,
+                            coalesce_interval, suppress_unchanged)
+    key = (_receiver_key(receiver), signal, id(sender))
+    with _queued_receivers_lock:
+        previous = _queued_receivers.pop(key, None)
+        _queued_receivers[key] = queued
+    if previous is not None:
+        dispatcher.disconnect(previous, signal=signal, sender=sender, weak=False)
+        previous.stop()
+    dispatcher.connect(queued, signal=signal, sender=sender, weak=False)
+    queued.start()
+
+
+## @brief Disconnect receiver from signal
+## @param receiver Receiver function
+## @param signal Signal name
+## @param sender Sender. Default - Any
+## @param weak Same value as used in connect
+def disconnect(receiver, signal=Any, sender=Any, weak=True):
+    with _queued_receivers_lock:
+        queued = _queued_receivers.pop((_receiver_key(receiver), signal, id(sender)), None)
+    if queued is None:
+        dispatcher.disconnect(receiver, signal=signal, sender=sender, weak=weak)
+    else:
+        dispatcher.disconnect(queued, signal=signal, sender=sender, weak=False)
+        queued.stop()
+
+
+## @brief Send signal
+## @details Synchronous receivers called in caller thread, asynchronous receivers get signal in queue
+## @param signal Signal name
+## @param sender Sender. Default - Anonymous
+## @return List of (receiver, response) pairs
+def send(signal=Any, sender=Anonymous, *arguments, **named):
+    return dispatcher.send(signal, sender, *arguments, **named)
+
+
+## @brief Send signal and wait to all receivers
+## @details Asynchronous receivers called in caller thread bypassing their queues.
+# Should be used for request/response signals only
+## @param signal Signal name
+## @param sender Sender. Default - Anonymous
+## @return List of (receiver, response) pairs
+def send_sync(signal=Any, sender=Anonymous, *arguments, **named):
+    previous = getattr(_delivery_mode, 'synchronous', False)
+    _delivery_mode.synchronous = True
+    try:
+        return dispatcher.send(signal, sender, *arguments, **named)
+    finally:
+        _delivery_mode.synchronous = previous
+
+
+## @brief Statistics snapshot
+## @details Add current queue depth of all asynchronous receivers
+## @return Dictionary with latency, overflow and depth data
+def statistics():
+    with _queued_receivers_lock:
+        queued = list(_queued_receivers.values())
+    for receiver in queued:
+        metrics.depth(receiver.name, receiver.depth)
+    return metrics.snapshot()
+
+
+## @brief Write statistics to log
+## @param logger Logger instance. Default - root logger
+def report(logger=None):
+    logger = logger or _logger
+    data = statistics()
+    logger.info('Event bus report')
+    for signal, item in sorted(data['latency'].items()):
+        overflow = data['overflow'].get(signal, dict(dropped=0, coalesced=0, suppressed=0))
+        logger.info('  %-24s delivered %6i  avg %7.3fs  max %7.3fs  dropped %4i  coalesced %4i  suppressed %4i' %
+                    (signal, item['count'], item['average'], item['maximum'],
+                     overflow['dropped'], overflow['coalesced'], overflow['suppressed']))
+    for name, item in sorted(data['depth'].items()):
+        logger.info('  %-40s queue depth %4i  max %4i' % (name, item['current'], item['maximum']))
@@ -0,0 +1,207 @@
+## @file
+## @brief Camera capture pipeline
+## @details Camera kept open (warm) between captures. Frame captured as raw RGB straight into memory,
+# rotated by camera itself when angle is multiple of 90 degrees, timestamp drawn on raw frame and frame
+# encoded into JPEG once. Concurrent requests share one capture (single-flight), recently captured frame
+# reused for requests within max_age.
+#
+## @par Sources
+# picamera.PiCamera - Raspberry Pi camera.\n
+# FakeCamera - generated frames with same interface (no camera required).\n
+#
+## @par Self check
+# python -m core.camera - concurrent snapshots from fake camera
+#
+import datetime
+import io
+import logging
+import threading
+from time import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+## @brief Padded frame size of raw RGB capture
+## @details Camera pad raw frame width to multiple of 32 and height to multiple of 16
+## @param resolution Tuple (width, height)
+## @return Tuple (width, height) of padded frame
+def padded_size(resolution):
+    return (resolution[0] + 31) // 32 * 32, (resolution[1] + 15) // 16 * 16
+
+
+## @class _Capture
+## @brief Capture in progress
+class _Capture(object):
+    def __init__(self):
+        ## @brief Set when capture done
+        self.done = threading.Event()
+        ## @brief JPEG data
+        self.data = None
+        ## @brief Capture error
+        self.error = None
+
+
+## @class FakeCamera
+## @brief Camera replacement
+## @details Generate padded raw RGB frames - horizontal stripes moved with every capture
+class FakeCamera(object):
+    ## @brief Create camera
+    ## @param resolution Tuple (width, height)
+    def __init__(self, resolution=(640, 480)):
+        ## @brief Frame resolution
+        self.resolution = resolution
+        ## @brief Clockwise rotation - 0, 90, 180 or 270
+        self.rotation = 0
+        ## @brief Number of captures
+        self.captures = 0
+
+    ## @brief Capture frame
+    ## @param output File-like object
+    ## @param format Only rgb supported
+    ## @param use_video_port Ignored
+    def capture(self, output, format='rgb', use_video_port=False):
+        if format != 'rgb':
+            raise ValueError('Fake camera support only rgb format')
+        width, height = padded_size(self.resolution)
+        self.captures += 1
+        output.write(''.join(chr((row + self.captures * 8) % 256) * (3 * width) for row in range(height)))
+
+    ## @brief Release camera
+    def close(self):
+        pass
+
+
+## @class CameraPipeline
+## @brief Warm camera with in-memory JPEG snapshots
+class CameraPipeline(object):
+    ## @brief Create pipeline
+    ## @param camera picamera.PiCamera or FakeCamera instance
+    ## @param angle Counter clockwise rotation angle of picture in degrees
+    ## @param quality JPEG quality
+    ## @param max_age Time (seconds) captured frame reused for new requests
+    ## @param logger Logger instance
+    def __init__(self, camera, angle=0, quality=85, max_age=1.0, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleTelegram')
+        ## @brief Camera instance
+        self._camera = camera
+        ## @brief Rotation done in software (angle not multiple of 90)
+        self._angle = 0
+        ## @brief JPEG quality
+        self._quality = quality
+        ## @brief Frame reuse time
+        self._max_age = max_age
+        ## @brief Font for timestamp
+        self._font = ImageFont.load_default()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Capture in progress - _Capture instance
+        self._in_flight = None
+        ## @brief Last frame - (capture start time, JPEG data)
+        self._last = None
+        ## @brief Counters
+        self._counters = dict(captures=0, shared=0, reused=0, capture_time=0.0)
+        if angle % 90 == 0:
+            # Camera rotate clockwise, PIL counter clockwise. Sensor resolution swapped for portrait output
+            self._camera.rotation = int(-angle) % 360
+            if self._camera.rotation in (90, 270):
+                width, height = self._camera.resolution
+                self._camera.resolution = (height, width)
+        else:
+            self._angle = angle
+
+    ## @brief Get JPEG snapshot
+    ## @details Request during capture wait for it, frame captured after max_age ago reused
+    ## @return JPEG data
+    ## @exception IOError Capture failed
+    def snapshot(self):
+        with self._lock:
+            if self._last is not None and time() - self._last[0] < self._max_age:
+                self._counters['reused'] += 1
+                return self._last[1]
+            flight = self._in_flight
+            owner = flight is None
+            if owner:
+                flight = self._in_flight = _Capture()
+            else:
+                self._counters['shared'] += 1
+        if owner:
+            start = time()
+            try:
+                flight.data = self._capture()
+            except Exception as e:
+                # picamera errors (PiCameraError) are not IOError - any failure reported to all waiters
+                flight.error = str(e) or e.__class__.__name__
+                self._logger.warning('Capture failed with error %s' % e)
+            finally:
+                with self._lock:
+                    self._in_flight = None
+                    self._counters['captures'] += 1
+                    self._counters['capture_time'] += time() - start
+                    if flight.data is not None:
+                        self._last = (start, flight.data)
+                flight.done.set()
+        flight.done.wait()
+        if flight.error is not None:
+            raise IOError(flight.error)
+        return flight.data
+
+    ## @brief Get JPEG snapshot as file object
+    ## @return BytesIO with JPEG data
+    ## @exception IOError Capture failed
+    def photo(self):
+        return io.BytesIO(self.snapshot())
+
+    ## @brief Pipeline statistics
+    ## @return Dictionary of captures, shared, reused and average capture time (seconds)
+    def statistics(self):
+        with self._lock:
+            result = dict(self._counters)
+        result['capture_time'] = result['capture_time'] / result['captures'] if result['captures'] else 0.0
+        return result
+
+    ## @brief Release camera
+    def close(self):
+        self._camera.close()
+
+    ## @brief Capture and encode frame
+    ## @return JPEG data
+    def _capture(self):
+        resolution = tuple(self._camera.resolution)
+        frame = io.BytesIO()
+        self._camera.capture(frame, format='rgb', use_video_port=True)
+        image = Image.frombuffer('RGB', padded_size(resolution), frame.getvalue(), 'raw', 'RGB', 0, 1)
+        image = image.crop((0, 0, resolution[0], resolution[1]))
+        if self._angle:
+            image = image.rotate(self._angle, expand=True)
+        ImageDraw.Draw(image).text((0, 0), str(datetime.datetime.now()), (255, 255, 255), font=self._font)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=self._quality)
+        return output.getvalue()
+
+
+if __name__ == '__main__':
+    fake = FakeCamera((1280, 720))
+    pipeline = CameraPipeline(fake, angle=90, max_age=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pipeline.snapshot())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    image = Image.open(io.BytesIO(results[0]))
+    print '8 concurrent requests - %d captures, picture %s %dx%d, %d bytes' % \
+          (fake.captures, image.format, image.size[0], image.size[1], len(results[0]))
+    print 'Statistics %s' % pipeline.statistics()
+
+    ## @brief Camera failing like picamera on capture timeout
+    class FailingCamera(FakeCamera):
+        def capture(self, output, format='rgb', use_video_port=False):
+            raise RuntimeError('Timed out waiting for capture to end')
+
+    failing = CameraPipeline(FailingCamera(), max_age=0)
+    for attempt in range(2):
+        try:
+            failing.snapshot()
+        except IOError as e:
+            print 'Failed capture %d reported - %s' % (attempt + 1, e)
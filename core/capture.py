@@ -0,0 +1,134 @@
+## @file
+## @brief Streaming audio capture
+## @details Read raw PCM chunks from recorder process stdout into bounded buffer.
+# Consumer iterate stream while recorder still running, capture ended by endpointer, time limit or stop.
+# Utterance audio never dropped - buffer overrun fail the stream.
+#
+import logging
+import subprocess
+import threading
+from collections import deque
+from time import time
+
+
+## @class AudioStream
+## @brief Recorder output stream
+## @details Iteration yield captured chunks until capture ended and buffer empty.
+# When consumer too slow and buffer full capture ended (reason overrun) and iteration raise IOError,
+# so consumer never receive truncated utterance.
+class AudioStream(object):
+    ## @brief Create stream
+    ## @param command Recorder command line (list). Recorder should write raw audio to stdout
+    ## @param chunk_size Chunk size in bytes
+    ## @param buffer_chunks Buffer size in chunks
+    ## @param max_time Maximum capture time in seconds. None - unlimited
+    ## @param endpointer End of utterance detector (see vad.Endpointer). None - capture until time limit
+    ## @param logger Logger instance
+    ## @param bytes_per_second Audio data rate. Default - 16 kHz 16 bit mono
+    def __init__(self, command, chunk_size=3200, buffer_chunks=100, max_time=None, endpointer=None, logger=None,
+                 bytes_per_second=32000):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('Audio')
+        ## @brief Recorder command line
+        self._command = command
+        ## @brief Chunk size in bytes
+        self._chunk_size = chunk_size
+        ## @brief Audio data rate
+        self._bytes_per_second = bytes_per_second
+        ## @brief Maximum capture time
+        self._max_time = max_time
+        ## @brief End of utterance detector
+        self._endpointer = endpointer
+        ## @brief Buffer size in chunks
+        self._buffer_chunks = buffer_chunks
+        ## @brief Captured chunks not read yet
+        self._buffer = deque()
+        ## @brief Synchronization object - buffer changed
+        self._buffer_change = threading.Condition()
+        ## @brief Set when capture ended
+        self._done = threading.Event()
+        ## @brief Recorder process
+        self._process = None
+        ## @brief Capture start time
+        self._start_time = None
+        ## @brief Captured audio length in seconds
+        self.duration = 0.0
+        ## @brief Capture end reason - endpoint, timeout, stopped, closed or overrun
+        self.reason = None
+
+    ## @brief Start recorder
+    ## @exception OSError Fail to start recorder process
+    def start(self):
+        self._start_time = time()
+        self._process = subprocess.Popen(self._command, stdout=subprocess.PIPE)
+        threading.Thread(target=self._capture, name='AudioStream').start()
+
+    ## @brief Stop capture
+    def stop(self):
+        self._finish('stopped')
+
+    ## @brief Wait until capture ended
+    ## @param timeout Maximum wait time in seconds. Default - wait forever
+    ## @return True if capture ended
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    ## @brief Read captured chunks
+    ## @return Generator of raw PCM chunks
+    ## @exception IOError Buffer overrun - part of utterance lost
+    def __iter__(self):
+        while True:
+            with self._buffer_change:
+                while not self._buffer and not self._done.is_set():
+                    self._buffer_change.wait(1)
+                if self.reason == 'overrun':
+                    raise IOError('Audio stream overrun - consumer too slow')
+                if not self._buffer:
+                    return
+                chunk = self._buffer.popleft()
+            yield chunk
+
+    ## @brief Capture thread
+    ## @warning This function should not be called from outside
+    def _capture(self):
+        reason = 'closed'
+        try:
+            while not self._done.is_set():
+                chunk = self._process.stdout.read(self._chunk_size)
+                if not chunk:
+                    break
+                with self._buffer_change:
+                    if len(self._buffer) >= self._buffer_chunks:
+                        reason = 'overrun'
+                        break
+                    self._buffer.append(chunk)
+                    self._buffer_change.notify_all()
+                self.duration += float(len(chunk)) / self._bytes_per_second
+                if self._endpointer is not None and self._endpointer.process(chunk):
+                    reason = 'endpoint'
+                    break
+                if self._max_time is not None and time() - self._start_time >= self._max_time:
+                    reason = 'timeout'
+                    break
+        except (IOError, ValueError) as e:
+            self._logger.warning('Audio capture failed with error %s' % e)
+        finally:
+            self._finish(reason)
+        if self.reason == 'overrun':
+            self._logger.warning('Audio stream consumer too slow. Capture failed')
+        self._logger.debug('Audio capture ended (%s) after %.2f sec' % (self.reason, self.duration))
+
+    ## @brief Mark capture ended and stop recorder
+    ## @param reason Capture end reason
+    def _finish(self, reason):
+        with self._buffer_change:
+            if self.reason is None:
+                self.reason = reason
+            self._done.set()
+            self._buffer_change.notify_all()
+        if self._process is not None and self._process.poll() is None:
+            try:
+                self._process.terminate()
+            except OSError as e:
+                self._logger.warning('Fail to stop recorder with error %s' % e)
@@ -0,0 +1,89 @@
+## @file
+## @brief Tracked cities registry
+## @details Count weather requests per (city, units) with exponential decay, so frequently requested cities
+# kept tracked and forgotten cities dropped. OpenWeatherMap city id learned from responses - tracked cities
+# refreshed in background by multi-city group request. Request and cache hit counters kept per city.
+#
+import threading
+from time import time
+
+
+## @class CityTracker
+## @brief Frequently requested cities
+class CityTracker(object):
+    ## @brief Create registry
+    ## @param max_cities Maximum number of tracked cities
+    ## @param min_requests Minimum (decayed) number of requests for city to be tracked
+    ## @param half_life Time (seconds) after which request weight halved
+    def __init__(self, max_cities=20, min_requests=2, half_life=24 * 60 * 60):
+        ## @brief Maximum tracked cities
+        self._max_cities = max_cities
+        ## @brief Minimum score
+        self._min_requests = min_requests
+        ## @brief Score half life
+        self._half_life = float(half_life)
+        ## @brief Key - [score, last request time, requests, hits, city id]
+        self._cities = dict()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+
+    ## @brief Record request
+    ## @param key Tuple (city, units)
+    ## @param hit True if request served from cache
+    def record(self, key, hit):
+        now = time()
+        with self._lock:
+            entry = self._cities.get(key)
+            if entry is None:
+                entry = self._cities[key] = [0.0, now, 0, 0, None]
+            entry[0] = self._score(entry, now) + 1
+            entry[1] = now
+            entry[2] += 1
+            entry[3] += hit
+            if len(self._cities) > self._max_cities * 10:
+                self._prune(now)
+
+    ## @brief Store city id
+    ## @param key Tuple (city, units)
+    ## @param city_id OpenWeatherMap city id
+    def learn(self, key, city_id):
+        with self._lock:
+            entry = self._cities.get(key)
+            if entry is not None:
+                entry[4] = city_id
+
+    ## @brief Tracked cities
+    ## @return List of (key, city id) - most requested first
+    def tracked(self):
+        now = time()
+        with self._lock:
+            candidates = [(self._score(entry, now), key, entry[4]) for key, entry in self._cities.items()
+                          if entry[4] is not None]
+        # rounded - requests in short time should not fall below threshold by decay
+        candidates = [item for item in candidates if round(item[0], 2) >= self._min_requests]
+        candidates.sort(reverse=True)
+        return [(key, city_id) for _, key, city_id in candidates[:self._max_cities]]
+
+    ## @brief Hit rate statistics
+    ## @return Dictionary of requests, hits, hit_rate, tracked and per city (requests, hits)
+    def statistics(self):
+        with self._lock:
+            cities = dict(('%s/%s' % key, (entry[2], entry[3])) for key, entry in self._cities.items())
+        requests = sum(item[0] for item in cities.values())
+        hits = sum(item[1] for item in cities.values())
+        return dict(requests=requests, hits=hits, hit_rate=float(hits) / requests if requests else 0.0,
+                    tracked=len(self.tracked()), cities=cities)
+
+    ## @brief Decayed score
+    ## @param entry City entry
+    ## @param now Current time
+    ## @return Score
+    def _score(self, entry, now):
+        return entry[0] * 0.5 ** ((now - entry[1]) / self._half_life)
+
+    ## @brief Drop least requested cities
+    ## @param now Current time
+    ## @warning Should be called with lock held
+    def _prune(self, now):
+        ordered = sorted(self._cities.items(), key=lambda item: self._score(item[1], now), reverse=True)
+        self._cities = dict(ordered[:self._max_cities * 5])
@@ -0,0 +1,234 @@
+## @file
+## @brief Forecast time series store
+## @details 5 day / 3 hour forecast kept per (city, units) in array backed columns - one timestamp array
+# and one array per value. Any request time answered from same download by binary search, numeric values
+# interpolated between neighbour slots. New download merged into series - slots from first new timestamp
+# replaced, older slots kept (limited by keep_past).
+#
+## @par Self check
+# python -m core.forecast_store - compare lookup time with per request JSON parse and list rebuild
+#
+import threading
+from array import array
+from bisect import bisect_left
+from time import time
+
+## @brief Numeric columns - name and path in forecast slot JSON
+_COLUMNS = (
+    ('temp', ('main', 'temp')),
+    ('temp_max', ('main', 'temp_max')),
+    ('temp_min', ('main', 'temp_min')),
+    ('pressure', ('main', 'pressure')),
+    ('humidity', ('main', 'humidity')),
+    ('wind_speed', ('wind', 'speed')),
+    ('wind_direction', ('wind', 'deg')),
+    ('clouds', ('clouds', 'all')),
+    ('rain', ('rain', '3h')),
+    ('snow', ('snow', '3h')),
+)
+## @brief Missing value marker
+_MISSING = float('nan')
+
+
+## @brief Read value from slot JSON
+## @param slot Forecast slot dictionary
+## @param path Keys path
+## @return Float value or _MISSING
+def _value(slot, path):
+    value = slot
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _MISSING
+
+
+## @class ForecastSeries
+## @brief Forecast of one city
+class ForecastSeries(object):
+    ## @brief Create empty series
+    ## @param keep_past Time (seconds) past slots kept after merge
+    def __init__(self, keep_past=24 * 60 * 60):
+        ## @brief Past slots retention
+        self._keep_past = keep_past
+        ## @brief Slot times - Unix time, sorted
+        self.timestamps = array('d')
+        ## @brief Numeric columns
+        self.columns = dict((name, array('d')) for name, _ in _COLUMNS)
+        ## @brief Condition index of slot in conditions list
+        self.condition_index = array('H')
+        ## @brief Distinct (title, description, icon) tuples
+        self.conditions = []
+        ## @brief City name returned by server
+        self.city_name = None
+        ## @brief Last merged JSON - same object not merged twice
+        self.source = None
+
+    ## @brief Number of slots
+    def __len__(self):
+        return len(self.timestamps)
+
+    ## @brief Merge forecast download
+    ## @param forecast_json Forecast JSON (list of slots)
+    def merge(self, forecast_json):
+        slots = sorted(forecast_json.get('list', []), key=lambda item: item['dt'])
+        self.source = forecast_json
+        self.city_name = forecast_json.get('city', {}).get('name', self.city_name)
+        if not slots:
+            return
+        # Replace slots from first new timestamp, drop slots older than retention
+        end = bisect_left(self.timestamps, slots[0]['dt'])
+        start = bisect_left(self.timestamps, time() - self._keep_past, 0, end)
+        del self.timestamps[end:]
+        del self.timestamps[:start]
+        del self.condition_index[end:]
+        del self.condition_index[:start]
+        for column in self.columns.values():
+            del column[end:]
+            del column[:start]
+        for slot in slots:
+            self.timestamps.append(slot['dt'])
+            for name, path in _COLUMNS:
+                self.columns[name].append(_value(slot, path))
+            weather = slot.get('weather') or [{}]
+            condition = (str(weather[0].get('main', '')), str(weather[0].get('description', '')),
+                         str(weather[0].get('icon', '')))
+            if condition not in self.conditions:
+                self.conditions.append(condition)
+            self.condition_index.append(self.conditions.index(condition))
+
+    ## @brief Forecast at time
+    ## @details Numeric values linearly interpolated between neighbour slots (wind direction on shortest arc),
+    # condition taken from nearest slot. Time outside series clamped to first/last slot.
+    ## @param timestamp Unix time
+    ## @return Dictionary in WeatherData.weather_data format or None if series empty
+    def at(self, timestamp):
+        if not self.timestamps:
+            return None
+        pos = bisect_left(self.timestamps, timestamp)
+        if pos == 0 or pos == len(self.timestamps):
+            before = after = min(pos, len(self.timestamps) - 1)
+            ratio = 0.0
+        else:
+            before, after = pos - 1, pos
+            ratio = (timestamp - self.timestamps[before]) / (self.timestamps[after] - self.timestamps[before])
+        values = dict()
+        for name, _ in _COLUMNS:
+            first, second = self.columns[name][before], self.columns[name][after]
+            if first != first or second != second:
+                # missing in one of slots - take nearest
+                value = first if ratio < 0.5 else second
+            elif name == 'wind_direction':
+                value = (first + ((second - first + 180) % 360 - 180) * ratio) % 360
+            else:
+                value = first + (second - first) * ratio
+            values[name] = None if value != value else value
+        title, description, icon = self.conditions[self.condition_index[before if ratio < 0.5 else after]]
+        values.update(title=title, description=description, icon=icon,
+                      timestamp=int(min(max(timestamp, self.timestamps[0]), self.timestamps[-1])))
+        # rain/snow reported only when expected - same meaning as in current weather
+        for name in ('rain', 'snow'):
+            if not values[name]:
+                values[name] = None
+        return values
+
+    ## @brief Check precipitation in time range
+    ## @param start Range start - Unix time
+    ## @param end Range end - Unix time
+    ## @param column rain or snow
+    ## @return True if any slot in range has precipitation
+    def expected(self, start, end, column='rain'):
+        first = bisect_left(self.timestamps, start)
+        last = bisect_left(self.timestamps, end)
+        return any(value > 0 for value in self.columns[column][first:last])
+
+
+## @class ForecastStore
+## @brief Forecast series per (city, units)
+class ForecastStore(object):
+    ## @brief Create store
+    ## @param keep_past Time (seconds) past slots kept in series
+    def __init__(self, keep_past=24 * 60 * 60):
+        ## @brief Past slots retention
+        self._keep_past = keep_past
+        ## @brief Key - ForecastSeries
+        self._series = dict()
+        ## @brief Synchronization object
+        self._lock = threading.RLock()
+
+    ## @brief Get series updated with forecast download
+    ## @details Same JSON object (served from weather cache) merged only once
+    ## @param key Tuple (city, units)
+    ## @param forecast_json Forecast JSON or None to get series without update
+    ## @return ForecastSeries instance or None if city unknown
+    def series(self, key, forecast_json=None):
+        with self._lock:
+            series = self._series.get(key)
+            if forecast_json is None:
+                return series
+            if series is None:
+                series = self._series[key] = ForecastSeries(self._keep_past)
+            if series.source is not forecast_json:
+                series.merge(forecast_json)
+            return series
+
+    ## @brief Forecast at time
+    ## @param key Tuple (city, units)
+    ## @param timestamp Unix time
+    ## @param forecast_json Forecast JSON to merge first. Optional
+    ## @return Weather data dictionary or None if city unknown
+    def at(self, key, timestamp, forecast_json=None):
+        with self._lock:
+            series = self.series(key, forecast_json)
+            return series.at(timestamp) if series is not None else None
+
+    ## @brief Check precipitation in time range
+    ## @param key Tuple (city, units)
+    ## @param start Range start - Unix time
+    ## @param end Range end - Unix time
+    ## @param column rain or snow
+    ## @return True if any slot in range has precipitation, None if city unknown
+    def expected(self, key, start, end, column='rain'):
+        with self._lock:
+            series = self._series.get(key)
+            return series.expected(start, end, column) if series is not None else None
+
+
+if __name__ == '__main__':
+    import json
+    import random
+
+    now = int(time())
+    forecast = {'city': {'name': 'Holon'}, 'list': [
+        {'dt': now + index * 3 * 60 * 60,
+         'main': {'temp': 20 + index % 8, 'pressure': 1010, 'humidity': 60},
+         'wind': {'speed': 3.0, 'deg': (index * 40) % 360}, 'clouds': {'all': 10},
+         'rain': {'3h': 0.5} if index % 5 == 0 else {},
+         'weather': [{'main': 'Clear', 'description': 'clear sky', 'icon': '01d'}]} for index in range(40)]}
+    body = json.dumps(forecast)
+    times = [now + random.randint(0, 5 * 24 * 60 * 60) for _ in range(2000)]
+
+    # Previous behaviour without network time - parse downloaded JSON and rebuild time list per request
+    start = time()
+    for request_time in times:
+        forecast_time = [single_forecast['dt'] for single_forecast in json.loads(body)['list']]
+        bisect_left(forecast_time, request_time)
+    rebuild = time() - start
+
+    store = ForecastStore()
+    start = time()
+    for request_time in times:
+        store.at(('holon', 'metric'), request_time, forecast)
+    lookup = time() - start
+    print 'JSON parse and list rebuild per request: %.1f usec, store lookup with interpolation: %.1f usec' % \
+          (rebuild / len(times) * 1e6, lookup / len(times) * 1e6)
+    print 'In 4.5 hours: %s' % store.at(('holon', 'metric'), now + 4.5 * 60 * 60)
+    # Series rolled forward by 2 slots
+    rolled = {'city': forecast['city'], 'list': forecast['list'][2:] + [
+        dict(forecast['list'][-1], dt=forecast['list'][-1]['dt'] + offset * 3 * 60 * 60) for offset in (1, 2)]}
+    series = store.series(('holon', 'metric'), rolled)
+    print 'Slots after merge: %d, rain expected in 24 hours: %s' % \
+          (len(series), store.expected(('holon', 'metric'), now, now + 24 * 60 * 60))
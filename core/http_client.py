@@ -0,0 +1,243 @@
+## @file
+## @brief Pooled HTTP client
+## @details Keep-alive connections reused per host, gzip encoded responses, timeouts and conditional
+# requests - response validators (ETag, Last-Modified) remembered per URL, and 304 answer served from
+# remembered body. Latency of every request logged.
+#
+## @par Self check
+# python -m core.http_client - run requests against local stand-in server
+#
+import httplib
+import logging
+import socket
+import threading
+import urlparse
+import zlib
+from time import time
+
+
+## @class Response
+## @brief HTTP response
+class Response(object):
+    ## @brief Create response
+    ## @param status HTTP status code
+    ## @param headers Dictionary of headers (lower case names)
+    ## @param body Decoded body
+    ## @param cached True if body served from validator cache (304 received)
+    def __init__(self, status, headers, body, cached=False):
+        ## @brief HTTP status code
+        self.status = status
+        ## @brief Headers
+        self.headers = headers
+        ## @brief Body
+        self.body = body
+        ## @brief True if not modified body reused
+        self.cached = cached
+
+    ## @brief Body for file-like users
+    ## @return Body
+    def read(self):
+        return self.body
+
+
+## @class HttpClient
+## @brief HTTP client with connection pool
+class HttpClient(object):
+    ## @brief Create client
+    ## @param timeout Connection and read timeout in seconds
+    ## @param pool_size Maximum idle connections kept per host
+    ## @param max_validators Maximum number of URLs with remembered validators
+    ## @param logger Logger instance
+    def __init__(self, timeout=10, pool_size=2, max_validators=100, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('HttpClient')
+        ## @brief Timeout
+        self._timeout = timeout
+        ## @brief Idle connections per host
+        self._pool_size = pool_size
+        ## @brief Maximum remembered validators
+        self._max_validators = max_validators
+        ## @brief (scheme, host, port) - list of idle connections
+        self._idle = dict()
+        ## @brief URL - (etag, last modified, headers, body)
+        self._validators = dict()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Counters
+        self._counters = dict(requests=0, reused=0, not_modified=0, errors=0, latency=0.0)
+
+    ## @brief GET request
+    ## @param url Full URL
+    ## @param headers Additional request headers. Optional
+    ## @param conditional If True send remembered validators and reuse body on 304
+    ## @return Response instance
+    ## @exception IOError Connection failed or timed out
+    def get(self, url, headers=None, conditional=True):
+        parts = urlparse.urlsplit(url)
+        host = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = {'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'}
+        request_headers.update(headers or {})
+        with self._lock:
+            validator = self._validators.get(url) if conditional else None
+        if validator is not None:
+            if validator[0]:
+                request_headers['If-None-Match'] = validator[0]
+            if validator[1]:
+                request_headers['If-Modified-Since'] = validator[1]
+        start = time()
+        connection, reused = self._connection(host)
+        try:
+            try:
+                status, response_headers, body = self._request(connection, path, request_headers)
+            except (httplib.HTTPException, socket.error):
+                if not reused:
+                    raise
+                # Server closed idle connection - retry once on new connection
+                connection.close()
+                connection, reused = self._connection(host, fresh=True)
+                status, response_headers, body = self._request(connection, path, request_headers)
+        except (httplib.HTTPException, socket.error) as e:
+            connection.close()
+            with self._lock:
+                self._counters['errors'] += 1
+            raise IOError('Request %s://%s%s failed with error %s' % (parts.scheme, parts.netloc, parts.path, e))
+        latency = time() - start
+        if response_headers.get('connection', '').lower() == 'close':
+            connection.close()
+        else:
+            self._release(host, connection)
+        cached = False
+        if status == 304 and validator is not None:
+            status, response_headers, body, cached = 200, validator[2], validator[3], True
+        elif status == 200 and conditional and ('etag' in response_headers or 'last-modified' in response_headers):
+            with self._lock:
+                if url not in self._validators and len(self._validators) >= self._max_validators:
+                    self._validators.pop(next(iter(self._validators)))
+                self._validators[url] = (response_headers.get('etag'), response_headers.get('last-modified'),
+                                         response_headers, body)
+        with self._lock:
+            self._counters['requests'] += 1
+            self._counters['reused'] += reused
+            self._counters['not_modified'] += cached
+            self._counters['latency'] += latency
+        self._logger.debug('GET %s://%s%s - %d%s in %.1f ms (%s connection)' %
+                           (parts.scheme, parts.netloc, parts.path, status, ' not modified' if cached else '',
+                            latency * 1000, 'reused' if reused else 'new'))
+        return Response(status, response_headers, body, cached)
+
+    ## @brief Close idle connections
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+    ## @brief Client statistics
+    ## @return Dictionary of requests, reused, not_modified, errors and average latency (seconds)
+    def statistics(self):
+        with self._lock:
+            result = dict(self._counters)
+        result['latency'] = result['latency'] / result['requests'] if result['requests'] else 0.0
+        return result
+
+    ## @brief Get connection from pool
+    ## @param host Tuple (scheme, host, port)
+    ## @param fresh If True always create new connection
+    ## @return Tuple of connection and True if connection reused
+    def _connection(self, host, fresh=False):
+        if not fresh:
+            with self._lock:
+                connections = self._idle.get(host)
+                if connections:
+                    return connections.pop(), True
+        if host[0] == 'https':
+            return httplib.HTTPSConnection(host[1], host[2], timeout=self._timeout), False
+        return httplib.HTTPConnection(host[1], host[2], timeout=self._timeout), False
+
+    ## @brief Return connection to pool
+    ## @param host Tuple (scheme, host, port)
+    ## @param connection Connection
+    def _release(self, host, connection):
+        with self._lock:
+            connections = self._idle.setdefault(host, [])
+            if len(connections) < self._pool_size:
+                connections.append(connection)
+                return
+        connection.close()
+
+    ## @brief Send request and read response
+    ## @param connection Connection
+    ## @param path Request path with query
+    ## @param headers Request headers
+    ## @return Tuple of status, headers dictionary and decoded body
+    def _request(self, connection, path, headers):
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        response_headers = dict(response.getheaders())
+        if response_headers.get('content-encoding', '').lower() == 'gzip':
+            try:
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            except zlib.error as e:
+                raise httplib.HTTPException('Broken gzip data - %s' % e)
+        return response.status, response_headers, body
+
+
+if __name__ == '__main__':
+    import gzip
+    import StringIO
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+    ## @brief Connections accepted by stand-in server
+    server_connections = []
+
+    ## @brief Stand-in server - gzip and ETag support
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Buffered writes - whole response sent at once
+        wbufsize = -1
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            server_connections.append(self.client_address)
+
+        def do_GET(self):
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            compressed = StringIO.StringIO()
+            writer = gzip.GzipFile(fileobj=compressed, mode='wb')
+            writer.write('{"cod": "200"}' * 100)
+            writer.close()
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(compressed.getvalue())))
+            self.end_headers()
+            self.wfile.write(compressed.getvalue())
+
+        def log_message(self, *args):
+            pass
+
+    class StandInServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    logging.basicConfig(level=logging.DEBUG)
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    client = HttpClient(timeout=5)
+    for index in range(5):
+        response = client.get('http://127.0.0.1:%d/find?q=Holon&request=%d' % (server.server_port, index % 2))
+        assert len(response.body) == 1400
+    print '5 requests over %d connections, statistics %s' % (len(server_connections), client.statistics())
+    client.close()
+    server.shutdown()
@@ -0,0 +1,73 @@
+## @file
+## @brief Weather icon cache
+## @details Icons stored on disk by content digest (same image stored once), icon code to digest index
+# kept in JSON file. Index checked before any network request, so known icon never downloaded again.
+#
+import hashlib
+import json
+import logging
+import os
+import threading
+
+## @brief Index file name
+INDEX = 'icons.json'
+
+
+## @class IconCache
+## @brief Content addressed icon store
+class IconCache(object):
+    ## @brief Create cache
+    ## @param folder Cache folder
+    ## @param client http_client.HttpClient instance
+    ## @param logger Logger instance
+    def __init__(self, folder, client, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleWeather')
+        ## @brief Cache folder
+        self._folder = folder
+        ## @brief HTTP client
+        self._client = client
+        ## @brief Icon code - digest
+        self._index = dict()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        try:
+            with open(os.path.join(self._folder, INDEX)) as f:
+                self._index = json.load(f)
+        except (IOError, ValueError) as e:
+            self._logger.debug('Icon index not loaded (%s). Starting with empty index' % e)
+
+    ## @brief Get icon file
+    ## @param code Icon code (01d, 10n, ...)
+    ## @param base_url Icon base URL - icon code and .png appended. Used only if icon not cached
+    ## @return Path to icon file
+    ## @exception IOError Download or write failed
+    def path(self, code, base_url):
+        with self._lock:
+            digest = self._index.get(code)
+            if digest is not None and os.path.isfile(self._file(digest)):
+                return self._file(digest)
+            response = self._client.get(base_url + code + '.png', conditional=False)
+            if response.status != 200:
+                raise IOError('Icon %s download failed with status %d' % (code, response.status))
+            digest = hashlib.sha1(response.body).hexdigest()
+            path = self._file(digest)
+            if not os.path.isfile(path):
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(response.body)
+                os.rename(path + '.tmp', path)
+            self._index[code] = digest
+            try:
+                with open(os.path.join(self._folder, INDEX + '.tmp'), 'w') as f:
+                    json.dump(self._index, f)
+                os.rename(os.path.join(self._folder, INDEX + '.tmp'), os.path.join(self._folder, INDEX))
+            except (IOError, OSError) as e:
+                self._logger.warning('Fail to save icon index with error %s' % e)
+            self._logger.debug('Icon %s stored as %s' % (code, digest))
+            return path
+
+    ## @brief Icon file path
+    ## @param digest Content digest
+    ## @return Path
+    def _file(self, digest):
+        return os.path.join(self._folder, digest + '.png')
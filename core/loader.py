@@ -0,0 +1,470 @@
+## @file
+## @brief Plugin loader
+## @details Discover plugins, order them by declared signals and start them concurrently
+## @par Configuration file
+## @verbinclude ./configuration/main.conf
+#
+## @par Plugin manifest
+# Optional class attributes read by loader:\n
+# provides - Tuple of signals served by plugin.\n
+# consumes - Tuple of signals plugin send and require served before plugin start.\n
+# report_ready - If True plugin send PluginReady event when ready, otherwise plugin ready when constructor return.\n
+# ready_timeout - Maximum time to wait for PluginReady event. Default - loader configuration.\n
+#
+## @par Lazy plugins
+# Modules listed in lazy configuration are not imported at startup. Manifest is read from module source
+# and proxy receivers are registered for all provided signals. Module imported and plugins created on first
+# signal, then signal delivered to new plugin receivers by pydispatch itself - exactly once.
+#
+import ast
+import importlib
+import inspect
+import logging
+import os
+import threading
+import Queue
+from time import time
+
+from pydispatch import dispatcher
+
+
+## @class PluginRecord
+## @brief Plugin loading state
+## @details Hold plugin manifest, instance and startup timing
+class PluginRecord(object):
+    ## @brief Create plugin record
+    ## @param module_name Module name of plugin
+    ## @param plugin_class Plugin class object
+    ## @param ready_timeout Default timeout for ready report
+    def __init__(self, module_name, plugin_class, ready_timeout):
+        ## @brief Plugin name - class name
+        self.name = plugin_class.__name__
+        ## @brief Module name
+        self.module_name = module_name
+        ## @brief Plugin class
+        self.plugin_class = plugin_class
+        ## @brief Signals served by plugin
+        self.provides = tuple(getattr(plugin_class, 'provides', ()))
+        ## @brief Signals required before plugin start
+        self.consumes = tuple(getattr(plugin_class, 'consumes', ()))
+        ## @brief If True plugin send PluginReady event
+        self.report_ready = bool(getattr(plugin_class, 'report_ready', False))
+        ## @brief Maximum time to wait for ready report
+        self.ready_timeout = float(getattr(plugin_class, 'ready_timeout', ready_timeout))
+        ## @brief Plugins that should be ready before this one start
+        self.depends = []
+        ## @brief Plugin instance
+        self.instance = None
+        ## @brief Loading state - pending, queued, building, built, ready, timeout, failed
+        self.state = 'pending'
+        ## @brief Time of ready report received (may arrive before constructor return)
+        self.reported = None
+        ## @brief Module import time
+        self.import_time = 0.0
+        ## @brief Build start time
+        self.build_start = None
+        ## @brief Build end time
+        self.build_end = None
+        ## @brief Ready time
+        self.ready_time = None
+
+    ## @brief Startup finished (successfully or not)
+    @property
+    def settled(self):
+        return self.state in ('ready', 'timeout', 'failed')
+
+
+## @class LazyReceiver
+## @brief Proxy receiver of lazy plugin
+## @details Registered on pydispatch before real plugin receivers for single signal. Proxy never forward
+# signal - it only load plugin, signal reach plugin receivers directly
+class LazyReceiver(object):
+    ## @brief Create proxy receiver
+    ## @param lazy_plugin LazyPlugin instance
+    ## @param signal Signal name
+    def __init__(self, lazy_plugin, signal):
+        ## @brief Owner lazy plugin
+        self._lazy_plugin = lazy_plugin
+        ## @brief Proxied signal
+        self.signal = signal
+
+    ## @brief Signal handler
+    ## @details Load plugin on first call, wait while plugin loading
+    ## @param signal Signal name
+    ## @param sender Signal sender
+    ## @param named Signal arguments
+    def __call__(self, signal=None, sender=None, **named):
+        self._lazy_plugin.load(self.signal)
+
+
+## @class LazyPlugin
+## @brief Lazy loaded plugin module
+## @details Import and create plugins of module on first signal from module manifest.
+# Proxy receivers stay connected and never forward signals. pydispatch iterate live receiver lists in
+# connection order, so send that reached proxy (and waited there for load) continue to plugin receivers
+# connected during load, and later sends reach plugin receivers directly. Removing proxy during send
+# would shift receiver list and skip receivers, so proxies are never removed
+class LazyPlugin(object):
+    ## @brief Create lazy plugin
+    ## @param loader PluginLoader instance
+    ## @param module_name Plugin module name
+    ## @param manifest Dictionary of class name - manifest dictionary, read from module source
+    def __init__(self, loader, module_name, manifest):
+        ## @brief Owner loader
+        self._loader = loader
+        ## @brief Logger instance
+        self._logger = logging.getLogger('root')
+        ## @brief Module name
+        self.module_name = module_name
+        ## @brief Class name - manifest
+        self._manifest = manifest
+        ## @brief All signals served by module
+        self.provides = sorted(set(signal for item in manifest.values() for signal in item.get('provides', ())))
+        ## @brief Proxy receivers
+        self._proxies = [LazyReceiver(self, signal) for signal in self.provides]
+        ## @brief Synchronization object - only one thread load module
+        self._load_lock = threading.Lock()
+        ## @brief True after module loaded
+        self._loaded = False
+        ## @brief Ready reports received during load
+        self._reported = set()
+        ## @brief Ready reports synchronization
+        self._ready_event = threading.Condition()
+
+    ## @brief Register proxy receivers
+    def attach(self):
+        for proxy in self._proxies:
+            dispatcher.connect(proxy, signal=proxy.signal, sender=dispatcher.Any, weak=False)
+        self._logger.info('Lazy module %s waiting for %s' % (self.module_name, ', '.join(self.provides)))
+
+    ## @brief Load module if not loaded yet
+    ## @details Return when module loaded and plugins ready (or timed out)
+    ## @param signal Signal name that triggered load
+    def load(self, signal):
+        with self._load_lock:
+            if not self._loaded:
+                self._loaded = True
+                self._logger.info('Signal %s received - loading lazy module %s' % (signal, self.module_name))
+                self._load()
+
+    ## @brief Load module
+    ## @details Import module, create plugins and wait for their ready reports
+    def _load(self):
+        dispatcher.connect(self._plugin_ready, signal='PluginReady', sender=dispatcher.Any)
+        try:
+            start_time = time()
+            try:
+                module_obj = importlib.import_module(self._loader.plugin_dir + '.' + self.module_name)
+            except ImportError as e:
+                self._logger.error('Failed to import lazy module %s with error %s' % (self.module_name, e))
+                return
+            waiting = []
+            for class_name, manifest in sorted(self._manifest.items()):
+                plugin_class = getattr(module_obj, class_name, None)
+                if not inspect.isclass(plugin_class):
+                    continue
+                instance = self._loader.create(self.module_name, plugin_class)
+                if instance is not None and manifest.get('report_ready', False):
+                    waiting.append((class_name, float(manifest.get('ready_timeout', self._loader.ready_timeout))))
+            # Wait for ready reports
+            with self._ready_event:
+                for class_name, timeout in waiting:
+                    deadline = time() + timeout
+                    while class_name not in self._reported and time() < deadline:
+                        self._ready_event.wait(deadline - time())
+                    if class_name not in self._reported:
+                        self._logger.warning('Lazy plugin %s not ready after %.1f sec' % (class_name, timeout))
+            self._logger.info('Lazy module %s loaded in %.2f sec' % (self.module_name, time() - start_time))
+        finally:
+            dispatcher.disconnect(self._plugin_ready, signal='PluginReady', sender=dispatcher.Any)
+
+    ## @brief PluginReady event wrapper
+    ## @param name Plugin name (class name)
+    def _plugin_ready(self, name):
+        with self._ready_event:
+            self._reported.add(name)
+            self._ready_event.notify_all()
+
+
+## @class PluginLoader
+## @brief Dependency aware plugin loader
+## @details Construct plugins on bounded worker pool. Plugin start only after all plugins that provide
+# signals it consumes are settled. Loader finish when all plugins report ready or their timeout expire.
+## @version 1.0.0.0
+class PluginLoader(object):
+    ## @brief Create loader
+    ## @param plugin_dir Plugins package folder
+    ## @param disabled_modules List of disabled module names
+    ## @param disabled_classes List of disabled class names
+    ## @param workers Maximum number of plugins constructed in parallel
+    ## @param ready_timeout Default per plugin ready timeout in seconds
+    ## @param lazy_modules List of module names loaded on first signal
+    def __init__(self, plugin_dir, disabled_modules=(), disabled_classes=(), workers=4, ready_timeout=10.0,
+                 lazy_modules=()):
+        ## @brief Logger instance
+        self._logger = logging.getLogger('root')
+        ## @brief Plugins package folder
+        self.plugin_dir = plugin_dir
+        ## @brief Disabled modules
+        self._disabled_modules = [s.strip() for s in disabled_modules if s.strip()]
+        ## @brief Disabled classes
+        self._disabled_classes = [s.strip() for s in disabled_classes if s.strip()]
+        ## @brief Worker pool size
+        self._workers = max(1, int(workers))
+        ## @brief Default ready timeout
+        self.ready_timeout = float(ready_timeout)
+        ## @brief Modules loaded on first signal
+        self._lazy_modules = [s.strip() for s in lazy_modules if s.strip()]
+        ## @brief Lazy plugin modules
+        self._lazy = []
+        ## @brief Created plugin instances
+        self._instances = []
+        ## @brief Synchronization object - protect instances list
+        self._instances_lock = threading.Lock()
+        ## @brief Plugin records by name
+        self._plugins = dict()
+        ## @brief Plugin names in discovery order
+        self._order = []
+        ## @brief Synchronization object - protect plugin states
+        self._state_change = threading.Condition()
+        ## @brief Build jobs queue
+        self._jobs = Queue.Queue()
+
+    ## @brief Search plugin modules
+    ## @details Return module names of plugin files in plugin folder
+    ## @return List of module names
+    def _find_modules(self):
+        modules = []
+        for fname in sorted(os.listdir(self.plugin_dir)):
+            # Look only for py files
+            if not (fname.endswith('.py') and 'plugin' in fname.lower()):
+                continue
+            module_name = fname[: -3]
+            # Skip base,__init__  and disabled files
+            if module_name in ('base', '__init__') or module_name in self._disabled_modules:
+                self._logger.info('Skipping %s' % fname)
+                continue
+            self._logger.info('Found module %s' % module_name)
+            modules.append(module_name)
+        return modules
+
+    ## @brief Import plugin modules and collect plugin classes
+    ## @details Classes listed in disabled classes are skipped
+    def discover(self):
+        for module_name in self._find_modules():
+            if module_name in self._lazy_modules:
+                manifest = self._read_manifest(module_name)
+                if manifest is not None:
+                    self._lazy.append(LazyPlugin(self, module_name, manifest))
+                    continue
+            start_time = time()
+            try:
+                module_obj = importlib.import_module(self.plugin_dir + '.' + module_name)
+            except ImportError as e:
+                self._logger.warning('Failed to import %s with error %s' % (module_name, e))
+                continue
+            import_time = time() - start_time
+            # Looking for classes in file
+            for elem in dir(module_obj):
+                obj = getattr(module_obj, elem)
+                if not inspect.isclass(obj):
+                    continue
+                if elem in self._disabled_classes:
+                    self._logger.info('Skipping %s' % obj)
+                    continue
+                record = PluginRecord(module_name, obj, self.ready_timeout)
+                record.import_time = import_time
+                self._plugins[record.name] = record
+                self._order.append(record.name)
+        self._resolve_dependencies()
+
+    ## @brief Read plugin manifest from module source
+    ## @details Module is not imported - only class level literal assignments are evaluated
+    ## @param module_name Plugin module name
+    ## @return Dictionary of class name - manifest dictionary or None if module can't be loaded lazily
+    def _read_manifest(self, module_name):
+        path = os.path.join(self.plugin_dir, module_name + '.py')
+        try:
+            with open(path, 'r') as source:
+                tree = ast.parse(source.read(), path)
+        except (IOError, SyntaxError) as e:
+            self._logger.warning('Fail to read manifest of %s with error %s. Loading at startup' % (module_name, e))
+            return None
+        manifest = dict()
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef) or node.name in self._disabled_classes:
+                continue
+            values = dict()
+            for item in node.body:
+                if not isinstance(item, ast.Assign):
+                    continue
+                for target in item.targets:
+                    if isinstance(target, ast.Name) and \
+                            target.id in ('provides', 'consumes', 'report_ready', 'ready_timeout'):
+                        try:
+                            values[target.id] = ast.literal_eval(item.value)
+                        except ValueError:
+                            self._logger.warning('Incorrect manifest value %s.%s' % (node.name, target.id))
+            manifest[node.name] = values
+        if not any(values.get('provides') for values in manifest.values()):
+            self._logger.warning('Module %s not provide any signal. Loading at startup' % module_name)
+            return None
+        return manifest
+
+    ## @brief Create plugin instance
+    ## @details Instance stored in loaded plugin list
+    ## @param module_name Plugin module name
+    ## @param plugin_class Plugin class
+    ## @return Plugin instance or None on error
+    def create(self, module_name, plugin_class):
+        self._logger.info('Loading module %s from %s' % (plugin_class.__name__, module_name))
+        instance = None
+        try:
+            instance = plugin_class()
+        except (ImportError, TypeError) as e:
+            # Some error while creating module instance
+            self._logger.fatal('Incorrect module %s. Error %s' % (plugin_class.__name__, e))
+        except ImportWarning:
+            self._logger.warning('Failed to load %s from %s' % (plugin_class.__name__, module_name))
+        except Exception as e:
+            self._logger.error('Unexpected error while loading %s. Error %s' % (plugin_class.__name__, e))
+        else:
+            self._logger.info('Module %s (version: %s) loaded' %
+                              (plugin_class.__name__, getattr(instance, 'version', 'unknown')))
+            with self._instances_lock:
+                self._instances.append(instance)
+        return instance
+
+    ## @brief Build dependency list
+    ## @details Plugin depend on every other plugin that provide signal it consume.
+    # Signals without provider are ignored
+    def _resolve_dependencies(self):
+        for name in self._order:
+            record = self._plugins[name]
+            for other_name in self._order:
+                other = self._plugins[other_name]
+                if other is record:
+                    continue
+                if set(other.provides) & set(record.consumes):
+                    record.depends.append(other)
+            if record.depends:
+                self._logger.debug('Plugin %s wait for %s' % (name, ', '.join(p.name for p in record.depends)))
+
+    ## @brief Start all discovered plugins
+    ## @details Construct plugins in dependency order and wait until all plugins ready or timed out
+    ## @return List of plugin instances. Lazy plugins added to list when loaded
+    def start(self):
+        for lazy_plugin in self._lazy:
+            lazy_plugin.attach()
+        dispatcher.connect(self._plugin_ready, signal='PluginReady', sender=dispatcher.Any)
+        workers = []
+        for i in range(min(self._workers, max(1, len(self._order)))):
+            worker = threading.Thread(target=self._worker, name='PluginLoader-%i' % i)
+            worker.start()
+            workers.append(worker)
+        start_time = time()
+        try:
+            self._schedule()
+        finally:
+            for worker in workers:
+                self._jobs.put(None)
+            dispatcher.disconnect(self._plugin_ready, signal='PluginReady', sender=dispatcher.Any)
+        self._report(time() - start_time)
+        return self._instances
+
+    ## @brief Scheduler loop
+    ## @details Queue plugins which dependencies are settled, check ready timeouts, break dependency cycles
+    def _schedule(self):
+        with self._state_change:
+            while True:
+                now = time()
+                next_deadline = None
+                for name in self._order:
+                    record = self._plugins[name]
+                    if record.state == 'built':
+                        deadline = record.build_end + record.ready_timeout
+                        if now >= deadline:
+                            self._logger.warning('Plugin %s not ready after %.1f sec' % (name, record.ready_timeout))
+                            record.state = 'timeout'
+                        elif next_deadline is None or deadline < next_deadline:
+                            next_deadline = deadline
+                pending = [self._plugins[name] for name in self._order if self._plugins[name].state == 'pending']
+                for record in pending:
+                    if all(dependency.settled for dependency in record.depends):
+                        record.state = 'queued'
+                        self._jobs.put(record)
+                if all(self._plugins[name].settled for name in self._order):
+                    return
+                in_progress = [name for name in self._order
+                               if self._plugins[name].state in ('queued', 'building', 'built')]
+                if not in_progress:
+                    # Nothing can progress - dependency cycle
+                    record = [p for p in pending if p.state == 'pending'][0]
+                    self._logger.warning('Dependency cycle detected. Starting %s' % record.name)
+                    record.depends = []
+                    continue
+                if next_deadline is None:
+                    self._state_change.wait()
+                else:
+                    self._state_change.wait(max(0.0, next_deadline - now))
+
+    ## @brief Worker thread
+    ## @details Construct plugin instances from job queue
+    def _worker(self):
+        while True:
+            record = self._jobs.get()
+            if record is None:
+                return
+            with self._state_change:
+                record.state = 'building'
+                record.build_start = time()
+            instance = self.create(record.module_name, record.plugin_class)
+            with self._state_change:
+                record.build_end = time()
+                if instance is None:
+                    record.state = 'failed'
+                else:
+                    record.instance = instance
+                    if not record.report_ready or record.reported is not None:
+                        record.state = 'ready'
+                        record.ready_time = record.reported or record.build_end
+                    else:
+                        record.state = 'built'
+                self._state_change.notify_all()
+
+    ## @brief PluginReady event wrapper
+    ## @param name Plugin name (class name)
+    def _plugin_ready(self, name):
+        with self._state_change:
+            record = self._plugins.get(name)
+            if record is None:
+                self._logger.debug('Ready report from unknown plugin %s' % name)
+                return
+            record.reported = time()
+            if record.state in ('built', 'timeout'):
+                record.state = 'ready'
+                record.ready_time = record.reported
+            self._state_change.notify_all()
+
+    ## @brief Startup timing report
+    ## @param total Total startup time
+    def _report(self, total):
+        self._logger.info('Plugin startup report (total %.2f sec)' % total)
+        for name in self._order:
+            record = self._plugins[name]
+            build = (record.build_end - record.build_start) if record.build_end and record.build_start else 0.0
+            ready = (record.ready_time - record.build_start) if record.ready_time and record.build_start else 0.0
+            self._logger.info('  %-20s import %6.2fs  build %6.2fs  ready %6.2fs  %s' %
+                              (name, record.import_time, build, ready, record.state))
+
+    ## @brief Loading timing data
+    ## @return Dictionary of plugin name - (state, build time, ready time)
+    def timing(self):
+        with self._state_change:
+            result = dict()
+            for name in self._order:
+                record = self._plugins[name]
+                build = (record.build_end - record.build_start) if record.build_end and record.build_start else None
+                ready = (record.ready_time - record.build_start) if record.ready_time and record.build_start else None
+                result[name] = (record.state, build, ready)
+            return result
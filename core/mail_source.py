@@ -0,0 +1,416 @@
+## @file
+## @brief Mail sources
+## @details Common interface to mailbox - connect, sync (new and removed message headers), wait for change
+# and close.\n
+# Pop3Source - POP3 mailbox. POP3 server show mailbox snapshot taken at login, so every sync done in new
+# session and change detected by polling.\n
+# ImapSource - IMAP mailbox. Connection kept open between syncs, change pushed by server using IDLE command
+# (RFC 2177), so new mail detected within seconds. Servers without IDLE polled by NOOP.\n
+# Backoff - reconnect delay, exponential with full jitter.
+#
+## @par Self check
+# python -m core.mail_source - IMAP IDLE against local stand-in server
+#
+import imaplib
+import json
+import logging
+import os
+import poplib
+import random
+import re
+import select
+import socket
+import threading
+from email import parser
+from time import time
+
+from core import pop3_sync
+
+## @brief Errors raised by mail sources
+ERRORS = (socket.error, poplib.error_proto, imaplib.IMAP4.error)
+## @brief Header fields fetched from IMAP server
+_IMAP_HEADERS = '(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID SUBJECT FROM DATE)])'
+## @brief Maximum UIDs per IMAP FETCH command
+_FETCH_BATCH = 100
+## @brief UID in FETCH response
+_UID_PATTERN = re.compile(r'UID (\d+)')
+
+
+## @class Backoff
+## @brief Reconnect delay
+## @details Delay drawn uniformly from zero to exponentially growing limit (full jitter), so clients that
+# lost connection together do not reconnect together
+class Backoff(object):
+    ## @brief Create backoff
+    ## @param initial First delay limit in seconds
+    ## @param maximum Maximum delay limit in seconds
+    ## @param factor Limit growth factor per failure
+    def __init__(self, initial=1.0, maximum=300.0, factor=2.0):
+        ## @brief First delay limit
+        self._initial = initial
+        ## @brief Maximum delay limit
+        self._maximum = maximum
+        ## @brief Growth factor
+        self._factor = factor
+        ## @brief Number of failures since last reset
+        self.failures = 0
+
+    ## @brief Delay before next attempt
+    ## @return Delay in seconds
+    def next(self):
+        limit = min(self._maximum, self._initial * self._factor ** self.failures)
+        self.failures += 1
+        return random.uniform(0, limit)
+
+    ## @brief Reset after successful connection
+    def reset(self):
+        self.failures = 0
+
+
+## @class Pop3Source
+## @brief POP3 mailbox
+class Pop3Source(object):
+    ## @brief Create source
+    ## @param host Server host
+    ## @param port Server port
+    ## @param user User name
+    ## @param password Password
+    ## @param state_file Path to synchronization state file
+    ## @param use_ssl If True use POP3 over SSL
+    ## @param poll_interval Time (seconds) between syncs
+    ## @param logger Logger instance
+    def __init__(self, host, port, user, password, state_file, use_ssl=True, poll_interval=120, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleEmail')
+        ## @brief Server address
+        self._address = (host, port)
+        ## @brief Credentials
+        self._credentials = (user, password)
+        ## @brief Use SSL
+        self._use_ssl = use_ssl
+        ## @brief Polling interval
+        self.poll_interval = poll_interval
+        ## @brief Incremental synchronization
+        self._sync = pop3_sync.Pop3Sync(state_file, self._logger)
+
+    ## @brief Known messages
+    ## @return List of records
+    def records(self):
+        return self._sync.records().values()
+
+    ## @brief Check server access
+    ## @exception ERRORS Connection or login failed
+    def connect(self):
+        self._session().quit()
+
+    ## @brief Synchronize with mailbox
+    ## @return Tuple of new records list and removed records list
+    ## @exception ERRORS Connection or server error
+    def sync(self):
+        session = self._session()
+        try:
+            return self._sync.sync(session)
+        finally:
+            try:
+                session.quit()
+            except ERRORS as e:
+                self._logger.debug('Fail to close POP3 session with error %s' % e)
+
+    ## @brief Wait for mailbox change
+    ## @details POP3 can not notify - wait poll interval
+    ## @param timeout Maximum wait time in seconds
+    ## @param stop Event to abort wait
+    ## @return False - change unknown
+    def wait(self, timeout, stop):
+        stop.wait(min(timeout, self.poll_interval))
+        return False
+
+    ## @brief Close source
+    def close(self):
+        pass
+
+    ## @brief Open and login POP3 session
+    ## @return poplib.POP3 instance
+    def _session(self):
+        if self._use_ssl:
+            session = poplib.POP3_SSL(self._address[0], self._address[1])
+        else:
+            session = poplib.POP3(self._address[0], self._address[1])
+        try:
+            session.user(self._credentials[0])
+            session.pass_(self._credentials[1])
+        except ERRORS:
+            session.close()
+            raise
+        return session
+
+
+## @class ImapSource
+## @brief IMAP mailbox with IDLE push
+class ImapSource(object):
+    ## @brief Create source
+    ## @param host Server host
+    ## @param port Server port
+    ## @param user User name
+    ## @param password Password
+    ## @param state_file Path to synchronization state file
+    ## @param mailbox Mailbox name
+    ## @param use_ssl If True use IMAP over SSL
+    ## @param idle_timeout Maximum IDLE time (seconds) before command restarted - server drop idle clients
+    # after 30 minutes
+    ## @param logger Logger instance
+    def __init__(self, host, port, user, password, state_file, mailbox='INBOX', use_ssl=True,
+                 idle_timeout=25 * 60, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleEmail')
+        ## @brief Server address
+        self._address = (host, port)
+        ## @brief Credentials
+        self._credentials = (user, password)
+        ## @brief Mailbox name
+        self._mailbox = mailbox
+        ## @brief Use SSL
+        self._use_ssl = use_ssl
+        ## @brief IDLE restart interval
+        self._idle_timeout = idle_timeout
+        ## @brief State file path
+        self._state_file = state_file
+        ## @brief Open connection - kept between syncs
+        self._connection = None
+        ## @brief True if server support IDLE
+        self._idle_supported = False
+        ## @brief Mailbox UIDVALIDITY - UIDs valid only for same value
+        self._uid_validity = None
+        ## @brief UID - message record
+        self._records = dict()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        try:
+            with open(self._state_file) as f:
+                state = json.load(f)
+            self._uid_validity = state['uidvalidity']
+            self._records = state['records']
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            self._logger.info('Mail state not loaded (%s). Full mailbox synchronization' % e)
+
+    ## @brief Known messages
+    ## @return List of records
+    def records(self):
+        with self._lock:
+            return self._records.values()
+
+    ## @brief Connect, login and select mailbox
+    ## @details Existing connection reused
+    ## @exception ERRORS Connection or login failed
+    def connect(self):
+        if self._connection is not None:
+            return
+        if self._use_ssl:
+            connection = imaplib.IMAP4_SSL(self._address[0], self._address[1])
+        else:
+            connection = imaplib.IMAP4(self._address[0], self._address[1])
+        try:
+            connection.login(self._credentials[0], self._credentials[1])
+            connection.select(self._mailbox, readonly=True)
+            uid_validity = connection.response('UIDVALIDITY')[1][0]
+            # select leave EXISTS (and maybe EXPUNGE) in untagged responses - drop them, so first NOOP
+            # poll report only changes made after select
+            connection.response('EXISTS')
+            connection.response('EXPUNGE')
+        except ERRORS:
+            connection.shutdown()
+            raise
+        self._idle_supported = 'IDLE' in connection.capabilities
+        if uid_validity != self._uid_validity:
+            self._logger.info('Mailbox UIDVALIDITY changed - full synchronization')
+            self._uid_validity = uid_validity
+        self._connection = connection
+        self._logger.debug('IMAP connected. IDLE support - %s' % self._idle_supported)
+
+    ## @brief Synchronize with mailbox
+    ## @details Only headers of new UIDs fetched
+    ## @return Tuple of new records list and removed records list
+    ## @exception ERRORS Connection or server error
+    def sync(self):
+        self.connect()
+        try:
+            uids = self._connection.uid('SEARCH', None, 'ALL')[1][0].split()
+            with self._lock:
+                stale = [uid for uid, record in self._records.items()
+                         if not uid.startswith(str(self._uid_validity) + ':')]
+                known = set(self._records)
+            current = set('%s:%s' % (self._uid_validity, uid) for uid in uids)
+            missing = [uid for uid in uids if '%s:%s' % (self._uid_validity, uid) not in known]
+            new_records = []
+            for start in range(0, len(missing), _FETCH_BATCH):
+                response = self._connection.uid('FETCH', ','.join(missing[start:start + _FETCH_BATCH]),
+                                                _IMAP_HEADERS)[1]
+                for item in response:
+                    if not isinstance(item, tuple):
+                        continue
+                    match = _UID_PATTERN.search(item[0])
+                    if match is None:
+                        continue
+                    new_records.append(('%s:%s' % (self._uid_validity, match.group(1)),
+                                        pop3_sync.make_record(parser.HeaderParser().parsestr(item[1]))))
+        except ERRORS:
+            self.close()
+            raise
+        new_records.sort(key=lambda item: item[1]['Time'])
+        with self._lock:
+            removed = [self._records.pop(uid) for uid in set(stale).union(known.difference(current))
+                       if uid in self._records]
+            self._records.update(new_records)
+            if new_records or removed:
+                self._save()
+        self._logger.debug('Mailbox synchronized - %d messages, %d new, %d removed' %
+                           (len(uids), len(new_records), len(removed)))
+        return [record for _, record in new_records], removed
+
+    ## @brief Wait for mailbox change
+    ## @details IDLE command sent and server notifications (EXISTS, EXPUNGE) awaited. Without IDLE support
+    # mailbox polled by NOOP every 30 seconds.
+    ## @param timeout Maximum wait time in seconds
+    ## @param stop Event to abort wait
+    ## @return True if change reported by server
+    ## @exception ERRORS Connection error
+    def wait(self, timeout, stop):
+        self.connect()
+        try:
+            if self._idle_supported:
+                return self._idle(min(timeout, self._idle_timeout), stop)
+            end = time() + timeout
+            while not stop.is_set() and time() < end:
+                stop.wait(min(30, end - time()))
+                self._connection.noop()
+                if self._connection.response('EXISTS')[1][0] is not None or \
+                        self._connection.response('EXPUNGE')[1][0] is not None:
+                    return True
+            return False
+        except ERRORS:
+            self.close()
+            raise
+
+    ## @brief Close connection
+    def close(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.logout()
+        except ERRORS as e:
+            self._logger.debug('Fail to logout with error %s' % e)
+        self._connection = None
+
+    ## @brief IDLE command
+    ## @param timeout Maximum IDLE time in seconds
+    ## @param stop Event to abort wait
+    ## @return True if change reported by server
+    def _idle(self, timeout, stop):
+        connection = self._connection
+        tag = connection._new_tag()
+        connection.send('%s IDLE\r\n' % tag)
+        line = connection.readline()
+        if not line.startswith('+'):
+            raise imaplib.IMAP4.error('IDLE rejected - %s' % line.strip())
+        changed = False
+        end = time() + timeout
+        ssl_object = getattr(connection, 'sslobj', None)
+        while not changed and not stop.is_set() and time() < end:
+            if not (ssl_object is not None and ssl_object.pending()):
+                # short select timeout - stop event checked while idle
+                if not select.select([connection.socket()], [], [], min(1.0, max(0.0, end - time())))[0]:
+                    continue
+            line = connection.readline()
+            if not line:
+                raise socket.error('Connection closed by server')
+            if line.startswith('*') and line.split()[-1].upper() in ('EXISTS', 'EXPUNGE', 'RECENT'):
+                changed = True
+        connection.send('DONE\r\n')
+        while True:
+            line = connection.readline()
+            if not line:
+                raise socket.error('Connection closed by server')
+            if line.startswith(tag):
+                break
+        return changed
+
+    ## @brief Write state file
+    ## @details Written into temporary file and renamed, so state never left half written
+    ## @warning Should be called with lock held
+    def _save(self):
+        try:
+            with open(self._state_file + '.tmp', 'w') as f:
+                json.dump({'uidvalidity': self._uid_validity, 'records': self._records}, f)
+            os.rename(self._state_file + '.tmp', self._state_file)
+        except (IOError, OSError) as e:
+            self._logger.warning('Fail to save mail state with error %s' % e)
+
+
+if __name__ == '__main__':
+    import SocketServer
+    import tempfile
+
+    ## @brief Stand-in mailbox - list of (UID, headers)
+    mailbox = [(uid, 'Message-ID: <%d@example.com>\r\nFrom: Sender <sender@example.com>\r\nSubject: Message %d\r\n'
+                     'Date: Mon, 1 Jan 2018 10:00:00 +0200\r\n\r\n' % (uid, uid)) for uid in range(1, 6)]
+    ## @brief Set when new message should be pushed to idle client
+    arrived = threading.Event()
+
+    ## @brief Minimal IMAP server - LOGIN, SELECT, UID SEARCH/FETCH, IDLE
+    class StandInHandler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write('* OK [CAPABILITY IMAP4rev1 IDLE] ready\r\n')
+            for line in iter(self.rfile.readline, ''):
+                tag, command = line.split()[0], line.split()[1].upper()
+                arguments = line.split()[2:]
+                if command == 'CAPABILITY':
+                    self.wfile.write('* CAPABILITY IMAP4rev1 IDLE\r\n')
+                elif command in ('SELECT', 'EXAMINE'):
+                    self.wfile.write('* %d EXISTS\r\n* OK [UIDVALIDITY 7] ok\r\n' % len(mailbox))
+                elif command == 'UID' and arguments[0].upper() == 'SEARCH':
+                    self.wfile.write('* SEARCH %s\r\n' % ' '.join(str(uid) for uid, _ in mailbox))
+                elif command == 'UID' and arguments[0].upper() == 'FETCH':
+                    wanted = set(int(uid) for uid in arguments[1].split(','))
+                    for index, (uid, headers) in enumerate(mailbox):
+                        if uid in wanted:
+                            self.wfile.write('* %d FETCH (UID %d BODY[HEADER.FIELDS (MESSAGE-ID SUBJECT FROM DATE)] '
+                                             '{%d}\r\n%s)\r\n' % (index + 1, uid, len(headers), headers))
+                elif command == 'IDLE':
+                    self.wfile.write('+ idling\r\n')
+                    arrived.wait(10)
+                    self.wfile.write('* %d EXISTS\r\n' % len(mailbox))
+                    self.rfile.readline()
+                elif command == 'LOGOUT':
+                    self.wfile.write('* BYE\r\n%s OK LOGOUT completed\r\n' % tag)
+                    return
+                self.wfile.write('%s OK %s completed\r\n' % (tag, command))
+
+    server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    source = ImapSource('127.0.0.1', server.server_address[1], 'user', 'password',
+                        os.path.join(tempfile.mkdtemp(), 'imap_state.json'), use_ssl=False)
+    new, removed = source.sync()
+    print 'Initial sync: %d new, %d removed' % (len(new), len(removed))
+
+    ## @brief Deliver new message after 0.5 second
+    def deliver():
+        mailbox.append((6, 'Message-ID: <6@example.com>\r\nFrom: New <new@example.com>\r\nSubject: New\r\n'
+                           'Date: Mon, 1 Jan 2018 11:00:00 +0200\r\n\r\n'))
+        arrived.set()
+    threading.Timer(0.5, deliver).start()
+    start = time()
+    changed = source.wait(60, threading.Event())
+    print 'IDLE returned after %.2f sec, changed - %s' % (time() - start, changed)
+    new, removed = source.sync()
+    print 'Sync after push: %s' % [record['Subject'] for record in new]
+    source.close()
+    source.connect()
+    source._idle_supported = False
+    print 'NOOP poll without change, changed - %s' % source.wait(1, threading.Event())
+    backoff = Backoff(1, 60)
+    print 'Backoff delays: %s' % ['%.1f' % backoff.next() for _ in range(8)]
+    source.close()
+    server.shutdown()
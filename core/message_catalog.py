@@ -0,0 +1,158 @@
+## @file
+## @brief Compiled response message catalog
+## @details JSON message catalog compiled once at load - emoji aliases of every message substituted, messages
+# stored as tuples ready for random choice and formatting. Weather template matched to description once,
+# result remembered per description. Catalog file modification time checked
+# at most once per check interval, changed file compiled again (hot reload). Catalog with error ignored -
+# previous catalog kept.
+#
+## @par Catalog format
+# Key - list of messages.\n
+# weather - list of [keyword, template] pairs, first pair with keyword found in description used, empty
+# keyword match any description. Template formatted with description, temp and wind.\n
+#
+## @par Self check
+# python -m core.message_catalog - per reply cost of compiled templates against emojize on every reply
+#
+import json
+import logging
+import os
+import random
+import threading
+from time import time
+
+from emoji import emojize
+
+## @brief Maximum number of remembered description matches
+_MAX_MATCHES = 256
+
+
+## @class MessageCatalog
+## @brief Compiled messages with hot reload
+class MessageCatalog(object):
+    ## @brief Load and compile catalog
+    ## @param path Path to JSON catalog
+    ## @param check_interval Minimal time (seconds) between modification checks
+    ## @param logger Logger instance
+    ## @exception IOError Catalog file can not be read
+    ## @exception ValueError Catalog file is not valid
+    def __init__(self, path, check_interval=10.0, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleTelegram')
+        ## @brief Catalog file path
+        self._path = path
+        ## @brief Modification check interval
+        self._check_interval = check_interval
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Time of last modification check
+        self._checked = time()
+        ## @brief Modification time of loaded catalog
+        self._mtime = os.stat(path).st_mtime
+        ## @brief Compiled catalog - (messages, weather templates)
+        self._compiled = self._compile(path)
+        ## @brief Description - weather template
+        self._matches = dict()
+
+    ## @brief Random message
+    ## @param key Catalog key
+    ## @return Message
+    ## @exception KeyError Unknown key
+    def choice(self, key):
+        return random.choice(self._current()[0][key])
+
+    ## @brief Weather reply
+    ## @param description Weather description
+    ## @param temp Temperature
+    ## @param wind Wind description
+    ## @return Reply text
+    def weather(self, description, temp, wind):
+        compiled = self._current()
+        template = self._matches.get(description)
+        if template is None:
+            lower = str(description).lower()
+            template = next(template for keyword, template in compiled[1] if keyword in lower)
+            if len(self._matches) >= _MAX_MATCHES:
+                self._matches.clear()
+            self._matches[description] = template
+        return template % dict(description=description, temp=temp, wind=wind)
+
+    ## @brief Compiled catalog
+    ## @details Catalog compiled again if file changed since last check
+    ## @return Compiled catalog tuple
+    ## @warning This function should not be called from outside
+    def _current(self):
+        if time() - self._checked < self._check_interval:
+            return self._compiled
+        with self._lock:
+            if time() - self._checked < self._check_interval:
+                return self._compiled
+            self._checked = time()
+            try:
+                mtime = os.stat(self._path).st_mtime
+                if mtime != self._mtime:
+                    self._compiled = self._compile(self._path)
+                    self._matches = dict()
+                    self._mtime = mtime
+                    self._logger.info('Message catalog %s reloaded' % self._path)
+            except (IOError, OSError, ValueError) as e:
+                self._logger.warning('Fail to reload message catalog with error %s. Previous catalog used' % e)
+            return self._compiled
+
+    ## @brief Read and compile catalog file
+    ## @param path Path to JSON catalog
+    ## @return Tuple of messages dictionary and weather templates - tuple of (keyword, template)
+    ## @exception IOError Catalog file can not be read
+    ## @exception ValueError Catalog file is not valid
+    ## @warning This function should not be called from outside
+    @staticmethod
+    def _compile(path):
+        with open(path) as data_file:
+            catalog = json.load(data_file)
+        try:
+            weather = catalog.pop('weather')
+            messages = dict((key, tuple(emojize(message, use_aliases=True) for message in values))
+                            for key, values in catalog.items())
+            templates = tuple((keyword.lower(), emojize(template, use_aliases=True))
+                              for keyword, template in weather)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError('Invalid catalog %s - %s' % (path, e))
+        if not any(keyword == '' for keyword, _ in templates):
+            raise ValueError('Invalid catalog %s - weather template for any description missing' % path)
+        if any(not values for values in messages.values()):
+            raise ValueError('Invalid catalog %s - empty message list' % path)
+        return messages, templates
+
+
+if __name__ == '__main__':
+    import timeit
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'configuration',
+                        'telegram_messages.json')
+    catalog = MessageCatalog(path)
+    descriptions = ['clear sky', 'few clouds', 'light rain', 'mist', 'overcast clouds', 'snow']
+
+    ## @brief Reply built like before - branch on description and emojize every reply
+    def emojize_reply(description, temp, wind):
+        if "clear" in str(description).lower():
+            return emojize(":sunny: Weather is %s with temperature %02.1fC and %s" %
+                           (description, temp, wind), use_aliases=True)
+        elif "cloud" in str(description).lower():
+            return emojize(":cloud: Weather is %s with temperature %02.1fC and %s" %
+                           (description, temp, wind), use_aliases=True)
+        elif "rain" in str(description).lower():
+            return emojize(":umbrella: Weather is %s with temperature %02.1fC and %s" %
+                           (description, temp, wind), use_aliases=True)
+        return emojize(":earth_africa: Weather is %s with temperature %02.1fC and %s" %
+                       (description, temp, wind), use_aliases=True)
+
+    for description in descriptions:
+        assert catalog.weather(description, 21.5, 'light breeze') == \
+            emojize_reply(description, 21.5, 'light breeze'), description
+    count = 20000
+    for name, function in (('emojize every reply', emojize_reply), ('compiled catalog', catalog.weather)):
+        elapsed = timeit.timeit(lambda: [function(description, 21.5, 'light breeze')
+                                         for description in descriptions], number=count // len(descriptions))
+        print '%-20s %6.2f us per weather reply' % (name, elapsed / count * 1e6)
+    elapsed = timeit.timeit(lambda: catalog.choice('authorization_require'), number=count)
+    print '%-20s %6.2f us per message' % ('catalog choice', elapsed / count * 1e6)
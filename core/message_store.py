@@ -0,0 +1,131 @@
+## @file
+## @brief Email message store
+## @details Message headers indexed by receive time (sorted list - binary search for "since" queries) and by
+# sender - normalized address and name tokens. Queries answered without scan of all messages, lock held
+# only while index accessed. Messages older than retention window pruned.
+#
+import re
+import threading
+from bisect import bisect_left, insort
+from email import utils
+from time import time
+
+## @brief Name token separator
+_TOKEN_SPLIT = re.compile(r'[^a-z0-9]+')
+
+
+## @brief Split sender into normalized address and name tokens
+## @param sender From header value
+## @return Tuple of address (lower case) and set of tokens
+def sender_keys(sender):
+    name, address = utils.parseaddr(sender or '')
+    address = address.lower()
+    tokens = set(token for token in _TOKEN_SPLIT.split(name.lower()) if token)
+    tokens.update(token for token in _TOKEN_SPLIT.split(address.split('@')[0]) if token)
+    return address, tokens
+
+
+## @class MessageStore
+## @brief Indexed message headers
+class MessageStore(object):
+    ## @brief Create store
+    ## @param retention Time (seconds) messages kept
+    def __init__(self, retention=7 * 24 * 60 * 60):
+        ## @brief Retention window
+        self._retention = retention
+        ## @brief Message-ID - record
+        self._messages = dict()
+        ## @brief Sorted list of (time, Message-ID)
+        self._times = []
+        ## @brief Address - set of Message-ID
+        self._by_address = dict()
+        ## @brief Name token - set of Message-ID
+        self._by_token = dict()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+
+    ## @brief Number of messages
+    def __len__(self):
+        return len(self._messages)
+
+    ## @brief Add message
+    ## @param record Dictionary of Message-ID, Subject, From and Time
+    ## @return True if message added, False if already known or older than retention window
+    def add(self, record):
+        message_id = record['Message-ID']
+        with self._lock:
+            if message_id in self._messages or record['Time'] < time() - self._retention:
+                return False
+            self._messages[message_id] = record
+            insort(self._times, (record['Time'], message_id))
+            address, tokens = sender_keys(record['From'])
+            self._by_address.setdefault(address, set()).add(message_id)
+            for token in tokens:
+                self._by_token.setdefault(token, set()).add(message_id)
+            return True
+
+    ## @brief Remove message
+    ## @param message_id Message-ID
+    def remove(self, message_id):
+        with self._lock:
+            self._remove(message_id)
+
+    ## @brief Number of messages received since time
+    ## @param since Unix time
+    ## @return Number of messages
+    def count_since(self, since):
+        with self._lock:
+            return len(self._times) - bisect_left(self._times, (since,))
+
+    ## @brief Messages from sender
+    ## @details Sender matched by address (if contain @) or by all name tokens
+    ## @param sender Sender name or address
+    ## @param since Unix time. Optional - all messages
+    ## @return List of records, oldest first
+    def from_sender(self, sender, since=None):
+        sender = sender.lower().strip()
+        with self._lock:
+            if '@' in sender:
+                found = set(self._by_address.get(sender, ()))
+            else:
+                tokens = [token for token in _TOKEN_SPLIT.split(sender) if token]
+                if not tokens:
+                    return []
+                found = set(self._by_token.get(tokens[0], ()))
+                for token in tokens[1:]:
+                    found.intersection_update(self._by_token.get(token, ()))
+            records = [self._messages[message_id] for message_id in found]
+        if since is not None:
+            records = [record for record in records if record['Time'] >= since]
+        return sorted(records, key=lambda record: record['Time'])
+
+    ## @brief Remove messages older than retention window
+    ## @return Number of removed messages
+    def prune(self):
+        limit = time() - self._retention
+        with self._lock:
+            end = bisect_left(self._times, (limit,))
+            for _, message_id in self._times[:end]:
+                self._remove(message_id, keep_time=True)
+            del self._times[:end]
+            return end
+
+    ## @brief Remove message from indexes
+    ## @param message_id Message-ID
+    ## @param keep_time If True time index not updated (caller remove it)
+    ## @warning Should be called with lock held
+    def _remove(self, message_id, keep_time=False):
+        record = self._messages.pop(message_id, None)
+        if record is None:
+            return
+        if not keep_time:
+            position = bisect_left(self._times, (record['Time'], message_id))
+            if position < len(self._times) and self._times[position][1] == message_id:
+                del self._times[position]
+        address, tokens = sender_keys(record['From'])
+        for index, key in [(self._by_address, address)] + [(self._by_token, token) for token in tokens]:
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(message_id)
+                if not ids:
+                    del index[key]
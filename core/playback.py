@@ -0,0 +1,303 @@
+## @file
+## @brief In-memory audio playback
+## @details Clips (PCM data with format) played through persistent output stream.
+# Wave files memory mapped, wave buffers (RIFF data) and raw PCM buffers played without temporary files.
+# Output stream kept open between clips, so consecutive clips played without gap. Stream closed after
+# idle timeout to release audio device.
+#
+## @par Outputs
+# AplayOutput - aplay process reading raw PCM from stdin.\n
+# FileSink - write played audio into wave file (no sound card required).\n
+#
+import logging
+import mmap
+import shlex
+import struct
+import subprocess
+import threading
+import wave
+from time import time, sleep
+
+## @brief Write block size in bytes
+_BLOCK_SIZE = 65536
+## @brief aplay sample format names by sample width
+_APLAY_FORMAT = {1: 'U8', 2: 'S16_LE', 3: 'S24_3LE', 4: 'S32_LE'}
+
+
+## @class ClipError
+## @brief Unsupported or broken audio data
+class ClipError(Exception):
+    pass
+
+
+## @class Clip
+## @brief PCM audio clip
+class Clip(object):
+    ## @brief Create clip
+    ## @param data PCM data - string, buffer or memory map
+    ## @param rate Samples per second
+    ## @param channels Number of channels
+    ## @param width Sample size in bytes
+    ## @param offset PCM data start in data
+    ## @param size PCM data size. Default - till data end
+    def __init__(self, data, rate=16000, channels=1, width=2, offset=0, size=None):
+        ## @brief Audio data
+        self._data = data
+        ## @brief PCM data start
+        self._offset = offset
+        ## @brief PCM data size
+        self.size = len(data) - offset if size is None else min(size, len(data) - offset)
+        ## @brief Samples per second
+        self.rate = rate
+        ## @brief Number of channels
+        self.channels = channels
+        ## @brief Sample size in bytes
+        self.width = width
+
+    ## @brief Clip format
+    @property
+    def format(self):
+        return self.rate, self.channels, self.width
+
+    ## @brief Clip length in seconds
+    @property
+    def duration(self):
+        return float(self.size) / (self.rate * self.channels * self.width)
+
+    ## @brief Iterate PCM data blocks without copy of whole clip
+    ## @param block_size Block size in bytes
+    ## @return Generator of buffer objects
+    def blocks(self, block_size=_BLOCK_SIZE):
+        for position in range(self._offset, self._offset + self.size, block_size):
+            yield buffer(self._data, position, min(block_size, self._offset + self.size - position))
+
+    ## @brief Release memory map if any
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    ## @brief Create clip from wave data
+    ## @param data RIFF wave data - string or memory map
+    ## @return Clip instance
+    ## @exception ClipError Not PCM wave data
+    @staticmethod
+    def from_wave(data):
+        if len(data) < 12 or data[0:4] != 'RIFF' or data[8:12] != 'WAVE':
+            raise ClipError('Not a wave data')
+        position = 12
+        audio_format = None
+        while position + 8 <= len(data):
+            chunk_id = data[position:position + 4]
+            chunk_size = struct.unpack('<I', data[position + 4:position + 8])[0]
+            if chunk_id == 'fmt ':
+                audio_format = struct.unpack('<HHIIHH', data[position + 8:position + 24])
+            elif chunk_id == 'data':
+                if audio_format is None or audio_format[0] != 1:
+                    raise ClipError('Not a PCM wave data')
+                return Clip(data, audio_format[2], audio_format[1], audio_format[5] / 8, position + 8, chunk_size)
+            position += 8 + chunk_size + (chunk_size & 1)
+        raise ClipError('No audio data found')
+
+    ## @brief Create clip from wave file
+    ## @details File memory mapped
+    ## @param filename Path to wave file
+    ## @return Clip instance
+    ## @exception ClipError Not PCM wave file
+    ## @exception IOError Fail to read file
+    @staticmethod
+    def from_file(filename):
+        with open(filename, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error) as e:
+                raise ClipError('Fail to map %s with error %s' % (filename, e))
+        try:
+            return Clip.from_wave(data)
+        except ClipError:
+            data.close()
+            raise
+
+    ## @brief Create clip from buffer
+    ## @param data RIFF wave data or raw PCM data
+    ## @param rate Samples per second of raw data
+    ## @param channels Number of channels of raw data
+    ## @param width Sample size of raw data
+    ## @return Clip instance
+    @staticmethod
+    def from_buffer(data, rate=16000, channels=1, width=2):
+        if data[0:4] == 'RIFF':
+            return Clip.from_wave(data)
+        return Clip(data, rate, channels, width)
+
+
+## @class AplayOutput
+## @brief aplay output stream
+## @details aplay restarted only when clip format changed
+class AplayOutput(object):
+    ## @brief Output play in real time
+    realtime = True
+
+    ## @brief Create output
+    ## @param command aplay command line. $format$, $rate$, $channels$ replaced by clip format
+    ## @param logger Logger instance
+    def __init__(self, command, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('Audio')
+        ## @brief Command line
+        self._command = shlex.split(command)
+        ## @brief Player process
+        self._process = None
+        ## @brief Current stream format
+        self._format = None
+
+    ## @brief Write PCM data
+    ## @param clip Clip instance
+    ## @param block Data block
+    ## @exception IOError Player failed
+    def write(self, clip, block):
+        if self._process is None or self._process.poll() is not None or self._format != clip.format:
+            self.close()
+            command = [item.replace('$format$', _APLAY_FORMAT.get(clip.width, 'S16_LE'))
+                       .replace('$rate$', str(clip.rate)).replace('$channels$', str(clip.channels))
+                       for item in self._command]
+            try:
+                self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+            except OSError as e:
+                raise IOError('Fail to start player with error %s' % e)
+            self._format = clip.format
+        self._process.stdin.write(block)
+
+    ## @brief Close stream
+    ## @details Player finish buffered data and exit
+    def close(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+                self._process.wait()
+            except (IOError, OSError) as e:
+                self._logger.warning('Fail to close player with error %s' % e)
+        self._process = None
+        self._format = None
+
+
+## @class FileSink
+## @brief Wave file output
+## @details All clips of same format played until close written into one wave file
+class FileSink(object):
+    ## @brief Output does not play in real time
+    realtime = False
+
+    ## @brief Create output
+    ## @param filename Path to wave file. Each new file (after close) numbered: name.N.wav
+    def __init__(self, filename):
+        ## @brief Path to wave file
+        self._filename = filename
+        ## @brief Wave writer
+        self._writer = None
+        ## @brief Current stream format
+        self._format = None
+        ## @brief Number of created files
+        self.files = 0
+        ## @brief Written PCM bytes
+        self.written = 0
+
+    ## @brief Write PCM data
+    ## @param clip Clip instance
+    ## @param block Data block
+    def write(self, clip, block):
+        if self._writer is None or self._format != clip.format:
+            self.close()
+            self._writer = wave.open(self._filename if not self.files else
+                                     '%s.%d.wav' % (self._filename[:-4], self.files), 'wb')
+            self._writer.setframerate(clip.rate)
+            self._writer.setnchannels(clip.channels)
+            self._writer.setsampwidth(clip.width)
+            self._format = clip.format
+            self.files += 1
+        self._writer.writeframes(str(block))
+        self.written += len(block)
+
+    ## @brief Close wave file
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._format = None
+
+
+## @class PlaybackEngine
+## @brief Clip player with play clock
+## @details Clip written into output and end time of clip computed from play clock - end of previous clip
+# if still playing, otherwise now. Output closed after idle timeout.
+class PlaybackEngine(object):
+    ## @brief Create engine
+    ## @param output AplayOutput or FileSink instance
+    ## @param idle_timeout Time without playback (seconds) before output closed
+    ## @param logger Logger instance
+    def __init__(self, output, idle_timeout=2.0, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('Audio')
+        ## @brief Output
+        self._output = output
+        ## @brief Idle timeout
+        self._idle_timeout = idle_timeout
+        ## @brief Synchronization object - protect output
+        self._lock = threading.Lock()
+        ## @brief Time when last written clip end playing
+        self._clock = 0.0
+        ## @brief Idle close timer
+        self._idle_timer = None
+
+    ## @brief Play clip
+    ## @details Return when clip written into output (output buffer may still hold end of clip)
+    ## @param clip Clip instance
+    ## @param stop Event to abort playback. Optional
+    ## @return Time when clip end playing
+    ## @exception IOError Output failed
+    def play(self, clip, stop=None):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            now = time()
+            end = (max(now, self._clock) + clip.duration) if self._output.realtime else now
+            try:
+                for block in clip.blocks():
+                    if stop is not None and stop.is_set():
+                        end = time()
+                        break
+                    self._output.write(clip, block)
+            except IOError:
+                self._output.close()
+                raise
+            finally:
+                self._clock = end
+                self._idle_timer = threading.Timer(max(0.0, end - time()) + self._idle_timeout, self._idle)
+                self._idle_timer.daemon = True
+                self._idle_timer.start()
+            return end
+
+    ## @brief Wait until time
+    ## @param end Time returned by play
+    ## @param stop Event to abort wait. Optional
+    def wait(self, end, stop=None):
+        remain = end - time()
+        if remain <= 0:
+            return
+        if stop is not None:
+            stop.wait(remain)
+        else:
+            sleep(remain)
+
+    ## @brief Close output
+    def close(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            self._output.close()
+
+    ## @brief Idle timer callback
+    def _idle(self):
+        with self._lock:
+            if time() >= self._clock:
+                self._logger.debug('Playback idle. Closing output')
+                self._output.close()
@@ -0,0 +1,162 @@
+## @file
+## @brief Incremental POP3 synchronization
+## @details New messages found by UIDL (unique id listing), only headers of new messages downloaded by
+# TOP n 0. Headers of known messages kept in JSON state file by UID, so messages not downloaded again
+# after restart. Messages removed from server removed from state.
+#
+## @par Self check
+# python -m core.pop3_sync - synchronize with local POP3 stand-in server
+#
+import json
+import logging
+import os
+import threading
+from email import parser
+from email import utils
+from time import time
+
+
+## @brief Convert message header into record
+## @param headers email.message.Message with headers
+## @return Dictionary of Message-ID, Subject, From and Time (Unix time)
+def make_record(headers):
+    date = utils.parsedate_tz(headers['Date']) if headers['Date'] else None
+    timestamp = utils.mktime_tz(date) if date is not None else time()
+    return {'Message-ID': str(headers['Message-ID']), 'Subject': str(headers['Subject']),
+            'From': str(headers['From']), 'Time': int(timestamp)}
+
+
+## @class Pop3Sync
+## @brief UIDL based mailbox synchronization
+class Pop3Sync(object):
+    ## @brief Create synchronizer
+    ## @param state_file Path to JSON state file
+    ## @param logger Logger instance
+    def __init__(self, state_file, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleEmail')
+        ## @brief State file path
+        self._state_file = state_file
+        ## @brief UID - message record
+        self._records = dict()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Counters
+        self._counters = dict(syncs=0, downloaded=0, bytes=0)
+        try:
+            with open(self._state_file) as f:
+                self._records = json.load(f)
+        except (IOError, ValueError) as e:
+            self._logger.info('Mail state not loaded (%s). Full mailbox synchronization' % e)
+
+    ## @brief Known messages
+    ## @return Dictionary UID - record
+    def records(self):
+        with self._lock:
+            return dict(self._records)
+
+    ## @brief Synchronize with mailbox
+    ## @param connection Logged in poplib.POP3 instance
+    ## @return Tuple of new records list and removed records list
+    ## @exception poplib.error_proto Server error
+    ## @exception socket.error Connection error
+    def sync(self, connection):
+        listing = {}
+        for line in connection.uidl()[1]:
+            number, uid = line.split(None, 1)
+            listing[uid] = number
+        with self._lock:
+            known = set(self._records)
+        new_records = []
+        downloaded_bytes = 0
+        for uid in listing:
+            if uid in known:
+                continue
+            response, lines, octets = connection.top(listing[uid], 0)
+            record = make_record(parser.HeaderParser().parsestr('\n'.join(lines)))
+            new_records.append((uid, record))
+            downloaded_bytes += octets
+        new_records.sort(key=lambda item: item[1]['Time'])
+        with self._lock:
+            removed = [self._records.pop(uid) for uid in known.difference(listing)]
+            self._records.update(new_records)
+            self._counters['syncs'] += 1
+            self._counters['downloaded'] += len(new_records)
+            self._counters['bytes'] += downloaded_bytes
+            if new_records or removed:
+                self._save()
+        self._logger.debug('Mailbox synchronized - %d messages, %d new, %d removed' %
+                           (len(listing), len(new_records), len(removed)))
+        return [record for _, record in new_records], removed
+
+    ## @brief Synchronization statistics
+    ## @return Dictionary of syncs, downloaded (headers), bytes and messages
+    def statistics(self):
+        with self._lock:
+            result = dict(self._counters)
+            result.update(messages=len(self._records))
+            return result
+
+    ## @brief Write state file
+    ## @details Written into temporary file and renamed, so state never left half written
+    ## @warning Should be called with lock held
+    def _save(self):
+        try:
+            with open(self._state_file + '.tmp', 'w') as f:
+                json.dump(self._records, f)
+            os.rename(self._state_file + '.tmp', self._state_file)
+        except (IOError, OSError) as e:
+            self._logger.warning('Fail to save mail state with error %s' % e)
+
+
+if __name__ == '__main__':
+    import SocketServer
+    import poplib
+    import tempfile
+
+    ## @brief Stand-in mailbox - UID, message
+    mailbox = [('uid-%d' % index, 'Message-ID: <%d@example.com>\r\nFrom: Sender %d <sender%d@example.com>\r\n'
+                                  'Subject: Message %d\r\nDate: Mon, 1 Jan 2018 10:%02d:00 +0200\r\n\r\n%s' %
+                (index, index, index % 3, index, index, 'body line\r\n' * 1000)) for index in range(1, 51)]
+    ## @brief Commands received by stand-in server
+    commands = []
+
+    ## @brief Minimal POP3 server
+    class StandInHandler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write('+OK ready\r\n')
+            for line in iter(self.rfile.readline, ''):
+                command = line.strip().split()
+                commands.append(command[0].upper())
+                if command[0].upper() == 'UIDL':
+                    self.wfile.write('+OK\r\n' + ''.join('%d %s\r\n' % (index + 1, uid)
+                                                         for index, (uid, _) in enumerate(mailbox)) + '.\r\n')
+                elif command[0].upper() == 'TOP':
+                    message = mailbox[int(command[1]) - 1][1]
+                    self.wfile.write('+OK\r\n' + message.split('\r\n\r\n')[0] + '\r\n\r\n.\r\n')
+                elif command[0].upper() == 'QUIT':
+                    self.wfile.write('+OK bye\r\n')
+                    return
+                else:
+                    self.wfile.write('+OK\r\n')
+
+    server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    state = os.path.join(tempfile.mkdtemp(), 'mail_state.json')
+    for attempt in range(3):
+        if attempt == 2:
+            # Message removed, new message arrived
+            mailbox.pop(0)
+            mailbox.append(('uid-new', 'Message-ID: <new@example.com>\r\nFrom: New <new@example.com>\r\n'
+                                       'Subject: New\r\nDate: Mon, 1 Jan 2018 12:00:00 +0200\r\n\r\nbody\r\n'))
+        del commands[:]
+        sync = Pop3Sync(state)
+        connection = poplib.POP3('127.0.0.1', server.server_address[1])
+        new, removed = sync.sync(connection)
+        connection.quit()
+        print 'Sync %d: %d new, %d removed, %d TOP commands, %s' % \
+              (attempt + 1, len(new), len(removed), commands.count('TOP'), sync.statistics())
+    server.shutdown()
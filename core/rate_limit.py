@@ -0,0 +1,49 @@
+## @file
+## @brief Request rate limiting
+## @details Token bucket - tokens added at constant rate up to bucket capacity, each request take tokens.
+# Allow short bursts up to capacity while long term rate stay within budget.
+#
+import threading
+from time import time
+
+
+## @class TokenBucket
+## @brief Token bucket rate limiter
+class TokenBucket(object):
+    ## @brief Create bucket
+    ## @details Bucket created full
+    ## @param rate Tokens added per second
+    ## @param capacity Maximum tokens in bucket
+    def __init__(self, rate, capacity):
+        ## @brief Refill rate
+        self._rate = float(rate)
+        ## @brief Bucket capacity
+        self._capacity = float(capacity)
+        ## @brief Available tokens
+        self._tokens = float(capacity)
+        ## @brief Last refill time
+        self._updated = time()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Number of rejected requests
+        self.rejected = 0
+
+    ## @brief Take tokens
+    ## @details Never block
+    ## @param tokens Number of tokens
+    ## @return True if tokens taken, False if budget exhausted
+    def consume(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            self.rejected += 1
+            return False
+
+    ## @brief Add tokens for elapsed time
+    ## @warning Should be called with lock held
+    def _refill(self):
+        now = time()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
@@ -0,0 +1,151 @@
+## @file
+## @brief Resident hot-word recognizer
+## @details Keep recognition engine process running with loaded model. Engine read raw audio from stdin,
+# audio captured by separate capture process and forwarded through gate. Pause replace microphone input
+# with silence (optionally release capture device), resume open gate again without engine reload.
+#
+import logging
+import subprocess
+import threading
+import Queue
+
+
+## @class ResidentRecognizer
+## @brief Long lived recognition engine with gated microphone input
+class ResidentRecognizer(object):
+    ## @brief Create recognizer
+    ## @param recognizer_command Recognition engine command line (list). Engine should read raw audio from stdin
+    ## @param capture_command Capture command line (list). Capture should write raw audio to stdout
+    ## @param logger Logger instance
+    ## @param chunk_size Audio chunk size in bytes
+    def __init__(self, recognizer_command, capture_command, logger=None, chunk_size=2048):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('Audio')
+        ## @brief Recognition engine command line
+        self._recognizer_command = recognizer_command
+        ## @brief Capture command line
+        self._capture_command = capture_command
+        ## @brief Audio chunk size
+        self._chunk_size = chunk_size
+        ## @brief Recognition engine process
+        self._recognizer = None
+        ## @brief Capture process
+        self._capture = None
+        ## @brief Recognized lines
+        self._lines = Queue.Queue()
+        ## @brief Synchronization object - capture state changed
+        self._state_change = threading.Condition()
+        ## @brief True while microphone audio forwarded to engine
+        self._open = False
+        ## @brief Set on stop
+        self._stopped = False
+
+    ## @brief Engine process running
+    @property
+    def alive(self):
+        return self._recognizer is not None and self._recognizer.poll() is None
+
+    ## @brief Start engine if not running
+    ## @details Model loading done once here
+    def start(self):
+        if self.alive:
+            return
+        self._logger.info('Starting resident recognition process')
+        self._recognizer = subprocess.Popen(self._recognizer_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        threading.Thread(target=self._read_lines, args=(self._recognizer,), name='RecognizerOutput').start()
+        threading.Thread(target=self._pump, args=(self._recognizer,), name='RecognizerInput').start()
+
+    ## @brief Open microphone gate
+    ## @details Start capture process if released. Lines recognized before resume are dropped
+    def resume(self):
+        self.start()
+        self._drain()
+        with self._state_change:
+            if self._capture is None or self._capture.poll() is not None:
+                self._capture = subprocess.Popen(self._capture_command, stdout=subprocess.PIPE)
+            self._open = True
+            self._state_change.notify_all()
+
+    ## @brief Close microphone gate
+    ## @details Engine receive silence instead of microphone input
+    ## @param release_device If True capture process stopped and audio device released
+    def pause(self, release_device=False):
+        with self._state_change:
+            self._open = False
+            if release_device:
+                self._stop_capture()
+            self._state_change.notify_all()
+
+    ## @brief Stop engine and capture
+    def stop(self):
+        with self._state_change:
+            self._stopped = True
+            self._open = False
+            self._stop_capture()
+            self._state_change.notify_all()
+        if self.alive:
+            try:
+                self._recognizer.terminate()
+            except OSError as e:
+                self._logger.warning('Fail to stop recognition process with error %s' % e)
+
+    ## @brief Read recognized line
+    ## @param timeout Maximum wait time in seconds
+    ## @return Recognized text or None on timeout
+    def readline(self, timeout=None):
+        try:
+            return self._lines.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    ## @brief Remove pending recognized lines
+    def _drain(self):
+        try:
+            while True:
+                self._lines.get_nowait()
+        except Queue.Empty:
+            pass
+
+    ## @brief Stop capture process
+    ## @warning Should be called with state lock held
+    def _stop_capture(self):
+        if self._capture is not None and self._capture.poll() is None:
+            try:
+                self._capture.terminate()
+            except OSError as e:
+                self._logger.warning('Fail to stop capture process with error %s' % e)
+        self._capture = None
+
+    ## @brief Engine output thread
+    ## @param process Engine process
+    def _read_lines(self, process):
+        for line in iter(process.stdout.readline, ''):
+            line = line.replace('\n', ' ').replace('\r', '').strip()
+            if line:
+                self._lines.put(line)
+        self._logger.info('Recognition process output closed')
+
+    ## @brief Engine input thread
+    ## @details Forward captured audio to engine, silence when gate closed
+    ## @param process Engine process
+    def _pump(self, process):
+        silence = '\x00' * self._chunk_size
+        while process.poll() is None:
+            with self._state_change:
+                while not self._stopped and (self._capture is None or self._capture.poll() is not None):
+                    self._state_change.wait(1)
+                if self._stopped:
+                    return
+                capture = self._capture
+            chunk = capture.stdout.read(self._chunk_size)
+            if not chunk:
+                # Capture stopped
+                continue
+            with self._state_change:
+                forward = self._open
+            try:
+                process.stdin.write(chunk if forward else silence[:len(chunk)])
+                process.stdin.flush()
+            except IOError as e:
+                self._logger.warning('Recognition process input closed with error %s' % e)
+                return
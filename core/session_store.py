@@ -0,0 +1,241 @@
+## @file
+## @brief Telegram session store
+## @details Conversation state of users (authorized, active_state, weather_city) kept in dictionaries split
+# into stripes by user id, every stripe protected by its own lock - handlers of different users do not wait
+# for each other. User ids normalized to int. Changes written to JSON snapshot file by background thread
+# (write-behind) - many changes written by one write, handler never wait for disk. Snapshot written into
+# temporary file and renamed, so restart read one complete file.
+#
+## @par Self check
+# python -m core.session_store - concurrent updates, snapshot, reload and damaged snapshot
+#
+import json
+import logging
+import os
+import threading
+from time import time
+
+## @brief Session fields
+FIELDS = ('authorized', 'active_state', 'weather_city')
+
+
+## @class Session
+## @brief User conversation state
+class Session(object):
+    __slots__ = FIELDS
+
+    def __init__(self, authorized=False, active_state=None, weather_city=None):
+        ## @brief User pass authorization
+        self.authorized = authorized
+        ## @brief Dialog state - None, city_name, weather_time or say_text
+        self.active_state = active_state
+        ## @brief City of weather request
+        self.weather_city = weather_city
+
+    ## @brief Snapshot representation
+    ## @return List of field values
+    def dump(self):
+        return [getattr(self, field) for field in FIELDS]
+
+
+## @class SessionStore
+## @brief Lock striped session dictionary with write-behind snapshot
+class SessionStore(object):
+    ## @brief Create store and load snapshot
+    ## @param state_file Path to JSON snapshot file
+    ## @param stripes Number of lock stripes
+    ## @param flush_interval Maximum time (seconds) change waits before written
+    ## @param logger Logger instance
+    def __init__(self, state_file, stripes=16, flush_interval=5.0, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleTelegram')
+        ## @brief Snapshot file path
+        self._state_file = state_file
+        ## @brief Write delay
+        self._flush_interval = flush_interval
+        ## @brief Stripes - dictionaries user id - Session
+        self._stripes = [dict() for _ in range(stripes)]
+        ## @brief Stripe locks
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        ## @brief Set when store changed since last snapshot
+        self._dirty = threading.Event()
+        ## @brief Serialize snapshot writes
+        self._write_lock = threading.Lock()
+        ## @brief Stop flag
+        self._stopped = threading.Event()
+        ## @brief Number of updates per stripe
+        self._updates = [0] * stripes
+        ## @brief Snapshot counters
+        self._counters = dict(writes=0, write_time=0.0)
+        self._load()
+        ## @brief Snapshot writer thread
+        self._writer = threading.Thread(target=self._write_behind, name='SessionWriter')
+        self._writer.daemon = True
+        self._writer.start()
+
+    ## @brief Check if user has session
+    ## @param user_id User id
+    def __contains__(self, user_id):
+        user_id = int(user_id)
+        with self._locks[user_id % len(self._locks)]:
+            return user_id in self._stripes[user_id % len(self._stripes)]
+
+    ## @brief Get user session
+    ## @param user_id User id
+    ## @return Copy of Session or None if user unknown
+    def get(self, user_id):
+        user_id = int(user_id)
+        with self._locks[user_id % len(self._locks)]:
+            session = self._stripes[user_id % len(self._stripes)].get(user_id)
+            return Session(*session.dump()) if session is not None else None
+
+    ## @brief Create session of new user
+    ## @param user_id User id
+    ## @return True if session created, False if user already known
+    def create(self, user_id):
+        user_id = int(user_id)
+        with self._locks[user_id % len(self._locks)]:
+            stripe = self._stripes[user_id % len(self._stripes)]
+            if user_id in stripe:
+                return False
+            stripe[user_id] = Session()
+            self._updates[user_id % len(self._updates)] += 1
+        self._dirty.set()
+        return True
+
+    ## @brief Update session fields
+    ## @details Session created if user unknown
+    ## @param user_id User id
+    ## @param fields Field values - authorized, active_state and/or weather_city
+    ## @exception AttributeError Unknown field
+    def update(self, user_id, **fields):
+        user_id = int(user_id)
+        with self._locks[user_id % len(self._locks)]:
+            session = self._stripes[user_id % len(self._stripes)].setdefault(user_id, Session())
+            for field, value in fields.items():
+                setattr(session, field, value)
+            self._updates[user_id % len(self._updates)] += 1
+        self._dirty.set()
+
+    ## @brief Write snapshot now if store changed
+    def flush(self):
+        if self._dirty.isSet():
+            self._dirty.clear()
+            self._save()
+
+    ## @brief Stop writer thread and write pending changes
+    def close(self):
+        self._stopped.set()
+        self._dirty.set()
+        self._writer.join(self._flush_interval + 1)
+        self.flush()
+
+    ## @brief Store statistics
+    ## @return Dictionary of sessions, updates, writes and average write time (seconds)
+    def statistics(self):
+        result = dict(self._counters, sessions=0, updates=sum(self._updates))
+        for lock, stripe in zip(self._locks, self._stripes):
+            with lock:
+                result['sessions'] += len(stripe)
+        result['write_time'] = result['write_time'] / result['writes'] if result['writes'] else 0.0
+        return result
+
+    ## @brief Read snapshot file
+    ## @warning This function should not be called from outside
+    def _load(self):
+        try:
+            with open(self._state_file) as f:
+                snapshot = json.load(f)
+        except (IOError, ValueError) as e:
+            self._logger.info('Telegram sessions not loaded (%s). Empty store' % e)
+            return
+        if not isinstance(snapshot, dict):
+            self._logger.info('Telegram sessions not loaded (snapshot is not dictionary). Empty store')
+            return
+        skipped = 0
+        for user_id, values in snapshot.items():
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            if not isinstance(values, list) or len(values) != len(FIELDS):
+                skipped += 1
+                continue
+            self._stripes[user_id % len(self._stripes)][user_id] = Session(*values)
+        if skipped:
+            self._logger.warning('%d invalid Telegram sessions skipped' % skipped)
+        self._logger.debug('%d Telegram sessions loaded' % (len(snapshot) - skipped))
+
+    ## @brief Write-behind thread
+    ## @details Wait for first change, then collect changes for flush interval and write them together
+    ## @warning This function should not be called from outside
+    def _write_behind(self):
+        while not self._stopped.isSet():
+            self._dirty.wait()
+            self._stopped.wait(self._flush_interval)
+            self.flush()
+
+    ## @brief Write snapshot file
+    ## @details Every stripe copied under its own lock - handlers blocked only while their stripe copied
+    ## @warning This function should not be called from outside
+    def _save(self):
+        with self._write_lock:
+            start = time()
+            snapshot = dict()
+            for lock, stripe in zip(self._locks, self._stripes):
+                with lock:
+                    snapshot.update((str(user_id), session.dump()) for user_id, session in stripe.items())
+            try:
+                with open(self._state_file + '.tmp', 'w') as f:
+                    json.dump(snapshot, f, separators=(',', ':'))
+                os.rename(self._state_file + '.tmp', self._state_file)
+            except (IOError, OSError) as e:
+                self._logger.warning('Fail to save Telegram sessions with error %s' % e)
+                return
+            self._counters['writes'] += 1
+            self._counters['write_time'] += time() - start
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    state = os.path.join(tempfile.mkdtemp(), 'sessions.json')
+    store = SessionStore(state, flush_interval=0.2)
+
+    ## @brief Dialog of many users - string and int ids mixed like in Telegram handlers
+    def dialog(first):
+        for user_id in range(first, first + 2500):
+            store.create(str(user_id))
+            store.update(user_id, authorized=True)
+            store.update(str(user_id), active_state='city_name')
+            store.update(user_id, active_state='weather_time', weather_city='Haifa')
+
+    begin = time()
+    threads = [threading.Thread(target=dialog, args=(index * 2500,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print '40000 updates from 4 threads in %.3fs' % (time() - begin)
+    store.close()
+    print 'Statistics %s' % store.statistics()
+
+    begin = time()
+    reloaded = SessionStore(state)
+    session = reloaded.get(1234)
+    print 'Reload %d sessions in %.3fs, %d bytes - user 1234 %s' % \
+          (reloaded.statistics()['sessions'], time() - begin, os.path.getsize(state), session.dump())
+    print 'String id lookup %s' % ('1234' in reloaded)
+    reloaded.close()
+
+    with open(state, 'w') as f:
+        json.dump({'1': [True, None, 'Haifa'], 'abc': [True, None, None], '2': [True], '3': 'text'}, f)
+    damaged = SessionStore(state)
+    print 'Damaged snapshot - %d of 4 sessions loaded' % damaged.statistics()['sessions']
+    damaged.close()
+    with open(state, 'w') as f:
+        json.dump([1, 2, 3], f)
+    damaged = SessionStore(state)
+    print 'Snapshot not dictionary - %d sessions loaded' % damaged.statistics()['sessions']
+    damaged.close()
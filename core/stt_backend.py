@@ -0,0 +1,120 @@
+## @file
+## @brief Streaming speech recognition backends
+## @details Backends upload audio chunks while recording still running (HTTP chunked transfer encoding)
+# and return recognition result in WIT.AI format - dictionary with '_text' and 'entities' keys.
+# HttpBackend talk to any server with same protocol - used with local fake server for development.
+#
+## @par Self check
+# python -m core.stt_backend [file.raw] - start local fake server and stream audio through HttpBackend
+#
+import httplib
+import json
+import urlparse
+
+## @brief Content type of raw 16 kHz 16 bit mono audio
+RAW_AUDIO = 'audio/raw;encoding=signed-integer;bits=16;rate=16000;endian=little'
+
+
+## @class WitBackend
+## @brief WIT.AI speech endpoint
+## @details Use WIT.AI client, client upload generator with chunked transfer encoding
+class WitBackend(object):
+    ## @brief Create backend
+    ## @param client WIT.AI client instance
+    ## @param content_type Audio content type
+    def __init__(self, client, content_type=RAW_AUDIO):
+        ## @brief WIT.AI client
+        self._client = client
+        ## @brief Audio content type
+        self._content_type = content_type
+
+    ## @brief Recognize speech
+    ## @param chunks Iterable of audio chunks
+    ## @return Recognition result
+    def recognize(self, chunks):
+        return self._client.speech(iter(chunks), None, {'Content-Type': self._content_type})
+
+
+## @class HttpBackend
+## @brief Generic HTTP speech endpoint
+class HttpBackend(object):
+    ## @brief Create backend
+    ## @param url Speech endpoint URL
+    ## @param headers Additional request headers
+    ## @param content_type Audio content type
+    ## @param timeout Socket timeout in seconds
+    def __init__(self, url, headers=None, content_type=RAW_AUDIO, timeout=10):
+        ## @brief Parsed endpoint URL
+        self._url = urlparse.urlparse(url)
+        ## @brief Additional request headers
+        self._headers = headers or dict()
+        ## @brief Audio content type
+        self._content_type = content_type
+        ## @brief Socket timeout
+        self._timeout = timeout
+
+    ## @brief Recognize speech
+    ## @param chunks Iterable of audio chunks
+    ## @return Recognition result
+    ## @exception IOError Server error
+    def recognize(self, chunks):
+        if self._url.scheme == 'https':
+            connection = httplib.HTTPSConnection(self._url.netloc, timeout=self._timeout)
+        else:
+            connection = httplib.HTTPConnection(self._url.netloc, timeout=self._timeout)
+        try:
+            path = self._url.path or '/'
+            if self._url.query:
+                path += '?' + self._url.query
+            connection.putrequest('POST', path)
+            connection.putheader('Content-Type', self._content_type)
+            connection.putheader('Transfer-Encoding', 'chunked')
+            for name, value in self._headers.items():
+                connection.putheader(name, value)
+            connection.endheaders()
+            for chunk in chunks:
+                if chunk:
+                    connection.send('%X\r\n%s\r\n' % (len(chunk), chunk))
+            connection.send('0\r\n\r\n')
+            response = connection.getresponse()
+            data = response.read()
+            if response.status != httplib.OK:
+                raise IOError('Speech server error %d %s' % (response.status, response.reason))
+            return json.loads(data)
+        finally:
+            connection.close()
+
+
+if __name__ == '__main__':
+    import sys
+    import threading
+    from time import time
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    ## @brief Fake speech server - report received audio size
+    class FakeSpeechHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            size = 0
+            while True:
+                length = int(self.rfile.readline().strip(), 16)
+                size += length
+                self.rfile.read(length + 2)
+                if length == 0:
+                    break
+            body = json.dumps({'_text': 'received %d bytes' % size, 'entities': {}})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), FakeSpeechHandler)
+    threading.Thread(target=server.handle_request).start()
+    audio = open(sys.argv[1], 'rb').read() if len(sys.argv) > 1 else '\x00' * 32000 * 3
+    backend = HttpBackend('http://127.0.0.1:%d/speech' % server.server_port)
+    start = time()
+    result = backend.recognize(audio[i:i + 3200] for i in range(0, len(audio), 3200))
+    print 'Result %s in %.3f sec' % (result, time() - start)
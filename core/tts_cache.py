@@ -0,0 +1,216 @@
+## @file
+## @brief Persistent speech cache
+## @details Synthesized wave files stored in cache folder, index kept in JSON manifest so cache survive restart.
+# Entries kept in least recently used order (OrderedDict - O(1) lookup, touch and eviction).
+# Cache limited by number of items and total size in bytes. Recently used order changed by lookup written
+# by timer - at most one manifest write per flush interval, order survive restart even if module never released.
+#
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+## @brief Manifest file name
+MANIFEST = 'manifest.json'
+
+
+## @brief Create cache key
+## @details Key depend on text and on all settings that change synthesized audio (engine, voice)
+## @param text Text to convert
+## @param settings Engine settings
+## @return Hex digest
+def make_key(text, *settings):
+    return hashlib.sha1('\0'.join([str(item) for item in settings] + [text])).hexdigest()
+
+
+## @class SpeechCache
+## @brief LRU cache of wave files
+class SpeechCache(object):
+    ## @brief Load cache
+    ## @param folder Cache folder
+    ## @param max_items Maximum number of entries
+    ## @param max_bytes Maximum total size of entries
+    ## @param logger Logger instance
+    ## @param flush_interval Maximum time (seconds) changed order waits before manifest written
+    def __init__(self, folder, max_items, max_bytes, logger=None, flush_interval=30.0):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleTTS')
+        ## @brief Cache folder
+        self._folder = folder
+        ## @brief Maximum number of entries
+        self._max_items = max_items
+        ## @brief Maximum total size
+        self._max_bytes = max_bytes
+        ## @brief Key - [size, text] in LRU order (oldest first)
+        self._entries = OrderedDict()
+        ## @brief Total size of entries
+        self._bytes = 0
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Manifest changed since last save
+        self._dirty = False
+        ## @brief Manifest write delay
+        self._flush_interval = flush_interval
+        ## @brief Pending manifest write timer
+        self._flush_timer = None
+        ## @brief Counters
+        self._counters = dict(hits=0, misses=0, evictions=0)
+        self._load()
+
+    ## @brief Path of cache entry file
+    ## @param key Cache key
+    ## @return Wave file path
+    def path(self, key):
+        return os.path.join(self._folder, key + '.wav')
+
+    ## @brief Find entry
+    ## @details Found entry marked as recently used
+    ## @param key Cache key
+    ## @return Wave file path or None if not cached
+    def lookup(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self._counters['misses'] += 1
+                return None
+            if not os.path.isfile(self.path(key)):
+                self._logger.info('Cached file %s removed from disk' % key)
+                self._bytes -= self._entries.pop(key)[0]
+                self._dirty = True
+                self._schedule_flush()
+                self._counters['misses'] += 1
+                return None
+            self._entries[key] = self._entries.pop(key)
+            self._dirty = True
+            self._schedule_flush()
+            self._counters['hits'] += 1
+            return self.path(key)
+
+    ## @brief Check entry
+    ## @details Entry not marked as used, hit/miss counters not changed
+    ## @param key Cache key
+    ## @return True if entry cached
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries and os.path.isfile(self.path(key))
+
+    ## @brief Remove entry
+    ## @param key Cache key
+    def remove(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return
+            self._bytes -= self._entries.pop(key)[0]
+            self._remove_file(key)
+            self._save()
+
+    ## @brief Store entry
+    ## @details Old entries evicted until cache fit limits
+    ## @param key Cache key
+    ## @param data Wave data
+    ## @param text Source text
+    ## @return Wave file path
+    ## @exception IOError Fail to write file
+    def store(self, key, data, text=''):
+        path = self.path(key)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[0]
+            self._entries[key] = [len(data), text]
+            self._bytes += len(data)
+            self._evict(keep=key)
+            self._save()
+        return path
+
+    ## @brief Remove all entries
+    def clear(self):
+        with self._lock:
+            for key in self._entries.keys():
+                self._remove_file(key)
+            self._entries.clear()
+            self._bytes = 0
+            self._dirty = True
+            self._save()
+
+    ## @brief Save manifest if changed
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    ## @brief Cache statistics
+    ## @return Dictionary of hits, misses, evictions, items and bytes
+    def statistics(self):
+        with self._lock:
+            result = dict(self._counters)
+            result.update(items=len(self._entries), bytes=self._bytes)
+            return result
+
+    ## @brief Evict least recently used entries
+    ## @param keep Key that should not be evicted
+    ## @warning Should be called with lock held
+    def _evict(self, keep=None):
+        while len(self._entries) > self._max_items or self._bytes > self._max_bytes:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._logger.debug('Removing old item %s' % key)
+            self._bytes -= self._entries.pop(key)[0]
+            self._remove_file(key)
+            self._counters['evictions'] += 1
+            self._dirty = True
+
+    ## @brief Start manifest write timer if not started
+    ## @warning Should be called with lock held
+    def _schedule_flush(self):
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self._flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    ## @brief Remove entry file
+    ## @param key Cache key
+    def _remove_file(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError as e:
+            self._logger.warning('Fail to remove old cached item with error %s' % e)
+
+    ## @brief Load manifest
+    ## @details Entries without file on disk dropped
+    def _load(self):
+        try:
+            with open(os.path.join(self._folder, MANIFEST)) as f:
+                entries = json.load(f)
+        except (IOError, ValueError) as e:
+            self._logger.info('Cache manifest not loaded (%s). Starting with empty cache' % e)
+            return
+        for key, size, text in entries:
+            if os.path.isfile(self.path(key)):
+                self._entries[key] = [size, text]
+                self._bytes += size
+        with self._lock:
+            self._evict()
+            if self._dirty or len(self._entries) != len(entries):
+                self._save()
+        self._logger.debug('Loaded %d cached items (%d bytes)' % (len(self._entries), self._bytes))
+
+    ## @brief Write manifest
+    ## @details Written into temporary file and renamed, so manifest never left half written. Pending write
+    # timer cancelled - manifest is current
+    ## @warning Should be called with lock held
+    def _save(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        manifest = os.path.join(self._folder, MANIFEST)
+        try:
+            with open(manifest + '.tmp', 'w') as f:
+                json.dump([[key, entry[0], entry[1]] for key, entry in self._entries.items()], f)
+            os.rename(manifest + '.tmp', manifest)
+            self._dirty = False
+        except (IOError, OSError) as e:
+            self._logger.warning('Fail to save cache manifest with error %s' % e)
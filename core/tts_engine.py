@@ -0,0 +1,406 @@
+## @file
+## @brief Speech synthesis engines
+## @details Synthesis engine convert text into in-memory wave buffer (RIFF data).
+# SynthesisPool keep several engine instances warm and serve requests from priority queue.
+#
+## @par Engines
+# FestivalServer - persistent festival process in server mode, text sent over socket.\n
+# Text2Wave - one text2wave process per request (no warm state, used as fallback).\n
+#
+## @see http://www.cstr.ed.ac.uk/projects/festival/
+import logging
+import os
+import re
+import shlex
+import socket
+import subprocess
+import tempfile
+import threading
+import Queue
+from time import time, sleep
+
+## @brief Festival server data block terminator
+_FESTIVAL_KEY = 'ft_StUfF_key'
+## @brief Sentence boundary - whitespace after sentence end punctuation
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+## @brief Clause boundary - whitespace after comma
+_CLAUSE_END = re.compile(r'(?<=,)\s+')
+
+
+## @brief Split text into sentences
+## @details Sentences longer than max_length split on clauses, short clauses joined back up to max_length
+## @param text Text to split
+## @param max_length Maximum sentence length before clause split
+## @return List of text chunks
+def split_sentences(text, max_length=120):
+    chunks = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        if len(sentence) <= max_length:
+            chunks.append(sentence)
+            continue
+        chunk = ''
+        for clause in _CLAUSE_END.split(sentence):
+            if chunk and len(chunk) + len(clause) + 1 > max_length:
+                chunks.append(chunk)
+                chunk = ''
+            chunk = chunk + ' ' + clause if chunk else clause
+        chunks.append(chunk)
+    return [chunk for chunk in chunks if chunk.strip()] or [text]
+
+
+## @class SynthesisError
+## @brief Synthesis engine failure
+class SynthesisError(Exception):
+    pass
+
+
+## @class FestivalServer
+## @brief Festival server process
+## @details Process started once, voice loaded once. Connection kept open between requests,
+# process restarted on failure
+class FestivalServer(object):
+    ## @brief Create engine
+    ## @param command Server command line, $port$ replaced by port number
+    ## @param port Server port
+    ## @param voice Festival voice name. Empty - festival default voice
+    ## @param logger Logger instance
+    ## @param start_timeout Maximum server start time in seconds
+    def __init__(self, command, port, voice='', logger=None, start_timeout=30):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleTTS')
+        ## @brief Server command line
+        self._command = [item.replace('$port$', str(port)) for item in shlex.split(command)]
+        ## @brief Server port
+        self._port = port
+        ## @brief Festival voice name
+        self._voice = voice
+        ## @brief Maximum server start time
+        self._start_timeout = start_timeout
+        ## @brief Server process
+        self._process = None
+        ## @brief Server connection
+        self._socket = None
+        ## @brief Received data not processed yet
+        self._buffer = ''
+
+    ## @brief Start server and connect
+    ## @exception SynthesisError Server not started in time
+    def start(self):
+        if self._socket is not None:
+            return
+        if self._process is None or self._process.poll() is not None:
+            self._logger.debug('Starting festival server on port %d' % self._port)
+            self._process = subprocess.Popen(self._command)
+        deadline = time() + self._start_timeout
+        while True:
+            try:
+                self._socket = socket.create_connection(('127.0.0.1', self._port), timeout=self._start_timeout)
+                break
+            except socket.error:
+                if time() > deadline or self._process.poll() is not None:
+                    raise SynthesisError('Festival server on port %d not started' % self._port)
+                sleep(0.1)
+        self._buffer = ''
+        self._command_send('(Parameter.set \'Wavefiletype \'riff)')
+        if self._voice:
+            self._command_send('(voice_%s)' % self._voice)
+
+    ## @brief Stop server
+    def stop(self):
+        self._disconnect()
+        if self._process is not None and self._process.poll() is None:
+            try:
+                self._process.terminate()
+            except OSError as e:
+                self._logger.warning('Fail to stop festival server with error %s' % e)
+        self._process = None
+
+    ## @brief Convert text to wave
+    ## @param text Text to convert
+    ## @return Wave data
+    ## @exception SynthesisError Synthesis failed
+    def synthesize(self, text):
+        self.start()
+        text = text.replace('\\', '\\\\').replace('"', '\\"')
+        try:
+            waves = self._command_send('(utt.send.wave.client (utt.synth (Utterance Text "%s")))' % text)
+        except (socket.error, SynthesisError):
+            # Server restarted on next request
+            self._disconnect()
+            raise
+        if not waves:
+            raise SynthesisError('Festival server return no wave data')
+        return waves[0]
+
+    ## @brief Send command and read reply
+    ## @param command Scheme expression
+    ## @return List of received wave blocks
+    ## @exception SynthesisError Command failed
+    def _command_send(self, command):
+        self._socket.sendall(command + '\n')
+        waves = []
+        while True:
+            reply = self._read(3)
+            if reply == 'OK\n':
+                return waves
+            elif reply == 'ER\n':
+                raise SynthesisError('Festival server fail to execute %s' % command)
+            elif reply in ('WV\n', 'LP\n'):
+                data = self._read(terminator=_FESTIVAL_KEY)
+                if reply == 'WV\n':
+                    waves.append(data)
+            else:
+                raise SynthesisError('Unexpected festival server reply %r' % reply)
+
+    ## @brief Read from server connection
+    ## @param size Number of bytes to read
+    ## @param terminator Read until terminator (terminator removed from result)
+    ## @return Data read
+    ## @exception SynthesisError Connection closed
+    def _read(self, size=None, terminator=None):
+        while True:
+            if terminator is not None:
+                position = self._buffer.find(terminator)
+                if position >= 0:
+                    data, self._buffer = self._buffer[:position], self._buffer[position + len(terminator):]
+                    return data
+            elif len(self._buffer) >= size:
+                data, self._buffer = self._buffer[:size], self._buffer[size:]
+                return data
+            chunk = self._socket.recv(65536)
+            if not chunk:
+                raise SynthesisError('Festival server connection closed')
+            self._buffer += chunk
+
+    ## @brief Close server connection
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+        self._socket = None
+        self._buffer = ''
+
+
+## @class Text2Wave
+## @brief Command line synthesis engine
+## @details New process started for each request
+class Text2Wave(object):
+    ## @brief Create engine
+    ## @param command Command line, (if) replaced by input text file, (of) by output wave file
+    ## @param logger Logger instance
+    def __init__(self, command, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleTTS')
+        ## @brief Command line
+        self._command = shlex.split(command)
+
+    ## @brief Nothing to start - compatibility with FestivalServer
+    def start(self):
+        pass
+
+    ## @brief Nothing to stop - compatibility with FestivalServer
+    def stop(self):
+        pass
+
+    ## @brief Convert text to wave
+    ## @param text Text to convert
+    ## @return Wave data
+    ## @exception SynthesisError Synthesis failed
+    def synthesize(self, text):
+        text_handle, text_file = tempfile.mkstemp(suffix='.txt')
+        wave_handle, wave_file = tempfile.mkstemp(suffix='.wav')
+        try:
+            os.write(text_handle, text)
+            os.close(text_handle)
+            os.close(wave_handle)
+            command = [item.replace('(if)', text_file).replace('(of)', wave_file) for item in self._command]
+            if subprocess.call(command) != 0:
+                raise SynthesisError('Synthesis command %s failed' % command)
+            with open(wave_file, 'rb') as f:
+                return f.read()
+        except (OSError, IOError) as e:
+            raise SynthesisError('Fail to run synthesis command with error %s' % e)
+        finally:
+            for path in (text_file, wave_file):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+## @class SynthesisRequest
+## @brief Synthesis pool request
+## @details Created by SynthesisPool.submit
+class SynthesisRequest(object):
+    ## @brief Create request
+    ## @param text Text to convert
+    ## @param priority Request priority - lower value served first
+    def __init__(self, text, priority):
+        ## @brief Text to convert
+        self.text = text
+        ## @brief Request priority
+        self.priority = priority
+        ## @brief Request time
+        self.submitted = time()
+        ## @brief Time spent in queue - valid when done
+        self.queue_wait = None
+        ## @brief Synthesis time - valid when done
+        self.synthesis_time = None
+        ## @brief Wave data - valid when done
+        self.wave = None
+        ## @brief Error message if synthesis failed
+        self.error = None
+        ## @brief Set when request done
+        self._done = threading.Event()
+
+    ## @brief Wait for result
+    ## @param timeout Maximum wait time in seconds. Default - wait forever
+    ## @return Wave data
+    ## @exception SynthesisError Synthesis failed or timeout
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise SynthesisError('Synthesis timeout')
+        if self.error is not None:
+            raise SynthesisError(self.error)
+        return self.wave
+
+
+## @class SynthesisPool
+## @brief Pool of warm synthesis engines
+## @details One worker thread per engine, requests served from shared priority queue
+class SynthesisPool(object):
+    ## @brief Create pool and start engines
+    ## @param engines List of engines (FestivalServer or Text2Wave instances)
+    ## @param logger Logger instance
+    def __init__(self, engines, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleTTS')
+        ## @brief Engines
+        self._engines = engines
+        ## @brief Request queue - (priority, sequence, request)
+        self._requests = Queue.PriorityQueue()
+        ## @brief Synchronization object - protect counters
+        self._lock = threading.Lock()
+        ## @brief Request counter
+        self._sequence = 0
+        ## @brief Number of busy workers
+        self._busy = 0
+        ## @brief Pool creation time
+        self._created = time()
+        ## @brief Statistics - name - [count, total, maximum]
+        self._statistics = dict()
+        ## @brief Maximum queue depth
+        self._max_depth = 0
+        for index, engine in enumerate(engines):
+            threading.Thread(target=self._worker, args=(engine,), name='Synthesis-%d' % index).start()
+
+    ## @brief Queue request
+    ## @param text Text to convert
+    ## @param priority Request priority - lower value served first
+    ## @return SynthesisRequest instance
+    def submit(self, text, priority=0):
+        request = SynthesisRequest(text, priority)
+        with self._lock:
+            self._sequence += 1
+            self._requests.put((priority, self._sequence, request))
+            self._max_depth = max(self._max_depth, self._requests.qsize())
+        return request
+
+    ## @brief Convert text to wave
+    ## @param text Text to convert
+    ## @param priority Request priority - lower value served first
+    ## @return Wave data
+    ## @exception SynthesisError Synthesis failed
+    def synthesize(self, text, priority=0):
+        return self.submit(text, priority).result()
+
+    ## @brief Number of idle workers
+    ## @return Idle workers minus queued requests
+    def idle(self):
+        with self._lock:
+            return len(self._engines) - self._busy - self._requests.qsize()
+
+    ## @brief Stop workers and engines
+    def stop(self):
+        for _ in self._engines:
+            self._requests.put((float('inf'), 0, None))
+
+    ## @brief Timing statistics
+    ## @return Dictionary of queue_wait/synthesis - dictionary (count, average, maximum), workers, maximum queue
+    # depth and utilization (synthesis time share of total worker time)
+    def statistics(self):
+        with self._lock:
+            result = dict((name, dict(count=item[0], average=item[1] / item[0] if item[0] else 0.0, maximum=item[2]))
+                          for name, item in self._statistics.items())
+            busy_time = self._statistics.get('synthesis', [0, 0.0, 0.0])[1]
+            result.update(workers=len(self._engines), max_queue_depth=self._max_depth,
+                          utilization=busy_time / ((time() - self._created) * len(self._engines)))
+            return result
+
+    ## @brief Worker thread
+    ## @param engine Engine owned by worker
+    def _worker(self, engine):
+        try:
+            engine.start()
+        except SynthesisError as e:
+            self._logger.warning('Synthesis engine start failed with error %s' % e)
+        while True:
+            _, _, request = self._requests.get()
+            if request is None:
+                engine.stop()
+                return
+            with self._lock:
+                self._busy += 1
+            start = time()
+            request.queue_wait = start - request.submitted
+            try:
+                request.wave = engine.synthesize(request.text)
+            except (SynthesisError, IOError, OSError) as e:
+                request.error = str(e)
+                self._logger.error('Synthesis of "%s" failed with error %s' % (request.text, e))
+            request.synthesis_time = time() - start
+            with self._lock:
+                self._busy -= 1
+                self._store('queue_wait', request.queue_wait)
+                self._store('synthesis', request.synthesis_time)
+            self._logger.debug('Synthesis of "%s" took %.3f sec, queue wait %.3f sec' %
+                               (request.text, request.synthesis_time, request.queue_wait))
+            request._done.set()
+
+    ## @brief Store statistic value
+    ## @warning Should be called with lock held
+    def _store(self, name, value):
+        item = self._statistics.setdefault(name, [0, 0.0, 0.0])
+        item[0] += 1
+        item[1] += value
+        item[2] = max(item[2], value)
+
+
+if __name__ == '__main__':
+    import sys
+
+    # First audio latency benchmark - python -m core.tts_engine [command]
+    # Whole text synthesis against sentence split synthesis - time to first PlayFile dispatched like
+    # TtsPlugin.text2wav does: sentences queued at once, each sent for playback as soon as its result ready
+    sentence = 'The weather today is partly cloudy with a light breeze from the west.'
+    pool = SynthesisPool([Text2Wave(sys.argv[1] if len(sys.argv) > 1 else 'text2wave (if) -o (of)')
+                          for _ in range(2)])
+    try:
+        print '%10s %10s %12s %12s %12s' % ('sentences', 'chars', 'whole', 'first play', 'last play')
+        for count in (1, 2, 4, 8):
+            text = ' '.join([sentence] * count)
+            start = time()
+            pool.synthesize(text)
+            whole = time() - start
+            dispatched = []
+            start = time()
+            for request in [pool.submit(chunk) for chunk in split_sentences(text)]:
+                request.result()
+                dispatched.append(time() - start)
+            print '%10d %10d %11.3fs %11.3fs %11.3fs' % (count, len(text), whole, dispatched[0], dispatched[-1])
+    except SynthesisError as e:
+        print 'Synthesis failed with error %s' % e
+    finally:
+        pool.stop()
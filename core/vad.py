@@ -0,0 +1,124 @@
+## @file
+## @brief Voice activity detection
+## @details Detect end of user utterance in raw PCM stream (signed little endian samples).
+# Chunk marked as speech when RMS energy above threshold, or when energy above half of threshold and
+# zero-crossing rate in speech range (weak fricatives). Utterance ended after configured trailing silence,
+# or when no speech detected during no_speech_timeout.
+#
+## @par Benchmark
+# python -m core.vad [file.wav ...] - time to callback with endpointing against fixed record window
+#
+import audioop
+
+
+## @class Endpointer
+## @brief End of utterance detector
+class Endpointer(object):
+    ## @brief Create detector
+    ## @param sample_rate Samples per second
+    ## @param sample_width Sample size in bytes
+    ## @param threshold RMS energy threshold of speech
+    ## @param trailing_silence Silence length after speech (seconds) that end utterance
+    ## @param no_speech_timeout Time (seconds) to wait for speech start
+    ## @param zero_crossing Zero-crossing rate range (crossings per second) of low energy speech.
+    # None - energy only detection
+    ## @param leading_padding Audio kept before speech start (seconds) when leading silence trimmed
+    def __init__(self, sample_rate=16000, sample_width=2, threshold=500, trailing_silence=0.8, no_speech_timeout=5.0,
+                 zero_crossing=(1000, 6000), leading_padding=0.2):
+        ## @brief Samples per second
+        self.sample_rate = sample_rate
+        ## @brief Sample size in bytes
+        self.sample_width = sample_width
+        ## @brief RMS energy threshold of speech
+        self.threshold = threshold
+        ## @brief Silence length that end utterance
+        self.trailing_silence = trailing_silence
+        ## @brief Time to wait for speech start
+        self.no_speech_timeout = no_speech_timeout
+        ## @brief Zero-crossing rate range of low energy speech
+        self.zero_crossing = zero_crossing
+        ## @brief Audio kept before speech start
+        self.leading_padding = leading_padding
+        ## @brief Processed audio length in seconds
+        self.position = 0.0
+        ## @brief Speech start position or None
+        self.speech_start = None
+        ## @brief Last speech chunk end position
+        self.speech_end = None
+
+    ## @brief Process next chunk
+    ## @param chunk Raw PCM data
+    ## @return True when utterance ended
+    def process(self, chunk):
+        duration = float(len(chunk)) / (self.sample_rate * self.sample_width)
+        speech = self.is_speech(chunk)
+        self.position += duration
+        if speech:
+            if self.speech_start is None:
+                self.speech_start = self.position - duration
+            self.speech_end = self.position
+            return False
+        if self.speech_end is None:
+            return self.position >= self.no_speech_timeout
+        return self.position - self.speech_end >= self.trailing_silence
+
+    ## @brief Check if chunk contain speech
+    ## @param chunk Raw PCM data
+    ## @return True if speech detected
+    def is_speech(self, chunk):
+        energy = audioop.rms(chunk, self.sample_width)
+        if energy >= self.threshold:
+            return True
+        if self.zero_crossing is None or energy < self.threshold / 2 or not chunk:
+            return False
+        samples = len(chunk) / self.sample_width
+        rate = audioop.cross(chunk, self.sample_width) * float(self.sample_rate) / samples
+        return self.zero_crossing[0] <= rate <= self.zero_crossing[1]
+
+    ## @brief Leading silence length
+    ## @return Byte offset of speech start minus leading padding. 0 if no speech detected
+    def speech_offset(self):
+        if self.speech_start is None:
+            return 0
+        start = max(0.0, self.speech_start - self.leading_padding)
+        return int(start * self.sample_rate) * self.sample_width
+
+
+if __name__ == '__main__':
+    import struct
+    import sys
+    import wave
+
+    ## @brief Fixed record window of current record_file behaviour
+    fixed_window = 10.0
+
+    ## @brief Synthetic fixture - silence, speech, silence
+    def synthetic():
+        silence = '\x00\x00' * 16000
+        speech = ''.join(struct.pack('<h', 3000 if (i / 8) % 2 else -3000) for i in range(16000))
+        return 'synthetic', silence + speech * 2 + silence * 7
+
+    fixtures = []
+    for path in sys.argv[1:]:
+        reader = wave.open(path, 'rb')
+        if reader.getnchannels() != 1 or reader.getsampwidth() != 2:
+            print 'Skip %s - only mono 16 bit supported' % path
+            continue
+        data = reader.readframes(reader.getnframes())
+        if reader.getframerate() != 16000:
+            data = audioop.ratecv(data, 2, 1, reader.getframerate(), 16000, None)[0]
+        fixtures.append((path, data))
+    if not fixtures:
+        fixtures.append(synthetic())
+
+    print '%-40s %10s %10s %10s %10s' % ('fixture', 'fixed', 'vad', 'saved', 'trimmed')
+    for name, data in fixtures:
+        endpointer = Endpointer()
+        # Audio captured in real time - callback time equal to processed audio length
+        for offset in range(0, len(data), 3200):
+            if endpointer.process(data[offset:offset + 3200]):
+                break
+        callback_time = min(endpointer.position, fixed_window)
+        print '%-40s %9.2fs %9.2fs %9.2fs %9.2fs' % (name[-40:], fixed_window, callback_time,
+                                                     fixed_window - callback_time,
+                                                     float(endpointer.speech_offset()) / 32000)
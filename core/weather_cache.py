@@ -0,0 +1,203 @@
+## @file
+## @brief Weather data cache
+## @details Downloaded weather data kept per (city, endpoint, units) key with per endpoint time to live.
+# Concurrent requests of same key share one download (single-flight). Expired entry still served during
+# stale period while background refresh running (stale-while-revalidate).
+#
+## @par Self check
+# python -m core.weather_cache - run concurrent requests against local stand-in server
+#
+import logging
+import threading
+from time import time
+
+
+## @class _Flight
+## @brief Download in progress
+class _Flight(object):
+    def __init__(self):
+        ## @brief Set when download done
+        self.done = threading.Event()
+        ## @brief Downloaded data
+        self.data = None
+        ## @brief Download error
+        self.error = None
+
+
+## @class WeatherCache
+## @brief TTL cache with request coalescing
+class WeatherCache(object):
+    ## @brief Create cache
+    ## @param ttl Dictionary endpoint - time to live in seconds. Endpoint not in dictionary - default_ttl
+    ## @param stale_ttl Time (seconds) after expiration while entry still served and refreshed in background
+    ## @param default_ttl Time to live of endpoints not listed in ttl
+    ## @param logger Logger instance
+    def __init__(self, ttl, stale_ttl=0, default_ttl=600, logger=None):
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('moduleWeather')
+        ## @brief Time to live per endpoint
+        self._ttl = ttl
+        ## @brief Stale period
+        self._stale_ttl = stale_ttl
+        ## @brief Default time to live
+        self._default_ttl = default_ttl
+        ## @brief Key - (fetch time, data)
+        self._entries = dict()
+        ## @brief Key - _Flight of running downloads
+        self._in_flight = dict()
+        ## @brief Synchronization object
+        self._lock = threading.Lock()
+        ## @brief Counters
+        self._counters = dict(hits=0, stale=0, misses=0, coalesced=0, errors=0)
+
+    ## @brief Get data
+    ## @param key Tuple (city, endpoint, units)
+    ## @param fetch Function that download data. Should raise IOError on failure
+    ## @return Cached or downloaded data
+    ## @exception IOError Download failed and no cached data available
+    def get(self, key, fetch):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time() - entry[0]
+                ttl = self._ttl.get(key[1], self._default_ttl)
+                if age < ttl:
+                    self._counters['hits'] += 1
+                    return entry[1]
+                if age < ttl + self._stale_ttl:
+                    self._counters['stale'] += 1
+                    if key not in self._in_flight:
+                        self._in_flight[key] = _Flight()
+                        threading.Thread(target=self._fetch, args=(key, fetch, self._in_flight[key]),
+                                         name='WeatherRefresh').start()
+                    return entry[1]
+            flight = self._in_flight.get(key)
+            if flight is None:
+                self._counters['misses'] += 1
+                flight = self._in_flight[key] = _Flight()
+                owner = True
+            else:
+                self._counters['coalesced'] += 1
+                owner = False
+        if owner:
+            self._fetch(key, fetch, flight)
+        flight.done.wait()
+        if flight.error is not None:
+            raise IOError(flight.error)
+        return flight.data
+
+    ## @brief Store data downloaded outside of cache (batch request)
+    ## @param key Tuple (city, endpoint, units)
+    ## @param data Data
+    def put(self, key, data):
+        with self._lock:
+            self._entries[key] = (time(), data)
+
+    ## @brief Time to entry expiration
+    ## @param key Tuple (city, endpoint, units)
+    ## @return Seconds until expired (negative if already expired) or None if not cached
+    def remaining(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return self._ttl.get(key[1], self._default_ttl) - (time() - entry[0])
+
+    ## @brief Remove expired entries
+    ## @details Entries older than time to live plus stale period removed
+    def prune(self):
+        now = time()
+        with self._lock:
+            for key, entry in self._entries.items():
+                if now - entry[0] > self._ttl.get(key[1], self._default_ttl) + self._stale_ttl:
+                    del self._entries[key]
+
+    ## @brief Cache statistics
+    ## @return Dictionary of hits, stale, misses, coalesced, errors and items
+    def statistics(self):
+        with self._lock:
+            result = dict(self._counters)
+            result.update(items=len(self._entries))
+            return result
+
+    ## @brief Download data and store it
+    ## @details Any download error (also unexpected data) reported to waiting requests as IOError,
+    # flight always completed - key never left blocked
+    ## @param key Cache key
+    ## @param fetch Download function
+    ## @param flight _Flight instance
+    def _fetch(self, key, fetch, flight):
+        try:
+            self._logger.debug('Downloading weather data %s' % (key,))
+            flight.data = fetch()
+        except Exception as e:
+            flight.error = str(e) or e.__class__.__name__
+            self._logger.warning('Weather download %s failed with error %s' % (key, e))
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._entries[key] = (time(), flight.data)
+                else:
+                    self._counters['errors'] += 1
+                del self._in_flight[key]
+            flight.done.set()
+
+
+if __name__ == '__main__':
+    import json
+    import urllib
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from time import sleep
+
+    ## @brief Number of requests received by stand-in server
+    server_requests = []
+
+    ## @brief Stand-in weather server - slow response to expose concurrent requests
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server_requests.append(self.path)
+            sleep(0.2)
+            body = json.dumps({'cod': '200', 'path': self.path})
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class StandInServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    url = 'http://127.0.0.1:%d/find?q=Holon' % server.server_port
+    cache = WeatherCache({'find': 0.5}, stale_ttl=5)
+    fetch = lambda: json.loads(urllib.urlopen(url).read())
+    threads = [threading.Thread(target=cache.get, args=(('Holon', 'find', 'metric'), fetch)) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print '10 concurrent requests - %d server requests' % len(server_requests)
+    sleep(0.6)
+    start = time()
+    cache.get(('Holon', 'find', 'metric'), fetch)
+    print 'Stale request served in %.3f sec' % (time() - start)
+    sleep(0.5)
+    print 'Server requests %d, statistics %s' % (len(server_requests), cache.statistics())
+
+    ## @brief Download with unexpected data - list instead of dictionary
+    def broken_fetch():
+        return json.loads(urllib.urlopen(url).read()).items().get('cod')
+
+    for attempt in range(2):
+        start = time()
+        try:
+            cache.get(('Bat Yam', 'find', 'metric'), broken_fetch)
+        except IOError as e:
+            print 'Broken response %d reported in %.3f sec - %s' % (attempt + 1, time() - start, e)
+    server.shutdown()
@@ -0,0 +1,184 @@
+## @file
+## @brief Keyed worker pool
+## @details Tasks executed by fixed number of worker threads. Tasks with same key (chat) executed one by one
+# in submit order, tasks with different keys executed in parallel. Number of concurrently running tasks
+# limited per task name (command) - key waiting for busy command does not hold worker.
+# Queue bounded - task rejected when queue full.
+#
+## @par Self check
+# python -m core.worker_pool - ordering and limits with sleeping tasks
+#
+import logging
+import threading
+from collections import deque
+from time import time
+
+
+## @class _Task
+## @brief Queued task
+class _Task(object):
+    def __init__(self, name, function, args, kwargs):
+        ## @brief Task name - command
+        self.name = name
+        ## @brief Function
+        self.function = function
+        ## @brief Positional arguments
+        self.args = args
+        ## @brief Keyword arguments
+        self.kwargs = kwargs
+        ## @brief Submit time
+        self.submitted = time()
+
+
+## @class KeyedWorkerPool
+## @brief Worker pool with per key ordering
+class KeyedWorkerPool(object):
+    ## @brief Create pool and start workers
+    ## @param workers Number of worker threads
+    ## @param max_queue Maximum number of queued (not running) tasks
+    ## @param limits Dictionary task name - maximum concurrently running tasks. Optional
+    ## @param logger Logger instance
+    ## @exception ValueError Limit below 1 - tasks of such name never executed
+    def __init__(self, workers=4, max_queue=100, limits=None, logger=None):
+        if limits and min(limits.values()) < 1:
+            raise ValueError('Concurrency limit below 1')
+        ## @brief Logger instance
+        self._logger = logger or logging.getLogger('WorkerPool')
+        ## @brief Queue limit
+        self._max_queue = max_queue
+        ## @brief Concurrency limits
+        self._limits = limits or dict()
+        ## @brief Key - deque of tasks. Key present while it has queued or running task
+        self._queues = dict()
+        ## @brief Keys ready for execution
+        self._ready = deque()
+        ## @brief Task name - deque of keys waiting for free slot
+        self._blocked = dict()
+        ## @brief Task name - number of running tasks
+        self._running = dict()
+        ## @brief Number of queued tasks
+        self._pending = 0
+        ## @brief Task name - [count, total latency, maximum latency, total queue wait]
+        self._latency = dict()
+        ## @brief Number of rejected tasks
+        self._rejected = 0
+        ## @brief Stop flag
+        self._stopped = False
+        ## @brief Synchronization object
+        self._condition = threading.Condition()
+        ## @brief Worker threads
+        self._workers = []
+        for index in range(workers):
+            worker = threading.Thread(target=self._worker, name='Worker-%d' % index)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    ## @brief Submit task
+    ## @param key Ordering key - tasks with same key executed in submit order
+    ## @param name Task name - used for limits and statistics
+    ## @param function Function to execute
+    ## @return True if task queued, False if queue full or pool stopped
+    def submit(self, key, name, function, *args, **kwargs):
+        with self._condition:
+            if self._stopped or self._pending >= self._max_queue:
+                self._rejected += 1
+                return False
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+                self._ready.append(key)
+            queue.append(_Task(name, function, args, kwargs))
+            self._pending += 1
+            self._condition.notify()
+            return True
+
+    ## @brief Stop workers
+    ## @details Running tasks completed, queued tasks dropped
+    ## @param timeout Maximum time (seconds) to wait for each worker
+    def stop(self, timeout=5.0):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    ## @brief Pool statistics
+    ## @return Dictionary of pending, rejected, running (per name) and per name latency -
+    # count, average and maximum latency and average queue wait in seconds
+    def statistics(self):
+        with self._condition:
+            latency = dict((name, dict(count=item[0], average=item[1] / item[0], maximum=item[2],
+                                       wait=item[3] / item[0]))
+                           for name, item in self._latency.items())
+            return dict(pending=self._pending, rejected=self._rejected, workers=len(self._workers),
+                        running=dict((name, count) for name, count in self._running.items() if count),
+                        latency=latency)
+
+    ## @brief Worker thread
+    ## @warning This function should not be called from outside
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                key = self._ready.popleft()
+                task = self._queues[key][0]
+                limit = self._limits.get(task.name)
+                if limit is not None and self._running.get(task.name, 0) >= limit:
+                    # Key wait for free slot without holding worker
+                    self._blocked.setdefault(task.name, deque()).append(key)
+                    continue
+                self._queues[key].popleft()
+                self._pending -= 1
+                self._running[task.name] = self._running.get(task.name, 0) + 1
+            start = time()
+            try:
+                task.function(*task.args, **task.kwargs)
+            except Exception as e:
+                self._logger.exception('Task %s of %s failed with error %s' % (task.name, key, e))
+            end = time()
+            with self._condition:
+                self._running[task.name] -= 1
+                statistics = self._latency.setdefault(task.name, [0, 0.0, 0.0, 0.0])
+                statistics[0] += 1
+                statistics[1] += end - start
+                statistics[2] = max(statistics[2], end - start)
+                statistics[3] += start - task.submitted
+                blocked = self._blocked.get(task.name)
+                if blocked:
+                    self._ready.append(blocked.popleft())
+                if self._queues[key]:
+                    self._ready.append(key)
+                else:
+                    del self._queues[key]
+                self._condition.notify_all()
+
+
+if __name__ == '__main__':
+    from time import sleep
+
+    ## @brief Execution log - (key, index, start, end)
+    log = []
+    pool = KeyedWorkerPool(workers=4, limits={'camera': 1})
+
+    ## @brief Sleeping task
+    def task(key, index, duration):
+        start = time()
+        sleep(duration)
+        log.append((key, index, start, time()))
+
+    begin = time()
+    # Chat 1 - slow weather request followed by fast text, chat 2 and 3 - camera requests
+    pool.submit(1, 'weather', task, 1, 0, 0.3)
+    pool.submit(1, 'text', task, 1, 1, 0.01)
+    pool.submit(2, 'camera', task, 2, 0, 0.2)
+    pool.submit(3, 'camera', task, 3, 0, 0.2)
+    pool.submit(4, 'text', task, 4, 0, 0.01)
+    sleep(0.8)
+    for key, index, start, end in sorted(log, key=lambda item: item[2]):
+        print 'Chat %d task %d: %.2f - %.2f' % (key, index, start - begin, end - begin)
+    print 'Statistics %s' % pool.statistics()
+    pool.stop()
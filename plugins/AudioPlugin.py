@@ -6,14 +6,23 @@
 #
 import ConfigParser
 import logging
+import os
 import subprocess
 import threading
 import shlex
 import subprocess
+import wave
 from time import sleep
 from pydispatch import dispatcher
 from uuid import uuid4
 
+from core import audio_arbiter
+from core import audio_assets
+from core import capture
+from core import playback
+from core import vad
+from core import recognizer
+
 ## @class AudioSubSystem
 ## @brief AudioSubSystem package
 ## @details Allow sound playing and recording
@@ -23,14 +32,22 @@ class AudioSubSystem:
     version = "1.0.0.0"
     ## @brief Short plugin description
     description = "Audio sub-system"
+    ## @brief Signals served by plugin - loader manifest
+    provides = ('WaitToHotWord', 'PlayFile', 'RecordFile', 'RecordStream', 'PreloadAudio')
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ()
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief Create Audio subsystem instance
     ## @details Create and initialize instance
     ## @exception ImportError Configuration or IO system errorModule will be unloaded.
     ## @par Registering on events:
     # WaitToHotWordWait until Hot-Word not detected in audio input and send notification.\n
-    # PlayFilePlay audio file.\n
-    # RecordFileRecord audio input into file
+    # PlayFilePlay audio file or in-memory buffer.\n
+    # RecordFileRecord audio input into file\n
+    # RecordStream - Stream audio input until end of utterance\n
+    # PreloadAudio - Decode audio assets into memory
     #
     ## @par Generate events:
     # HotWordDetectionActiveSet to True when STT engine trying to detect hot-word in audio stream.\n
@@ -38,13 +55,23 @@ class AudioSubSystem:
     # HotWordDetectedHot-word detected.
     # PlaybackActiveSet to True when audio player play file.\n
     # RecordActiveSet to True when audio recorder record audio into file.\n
+    # AudioLatency - Measured queue wait and device switch time of audio job.\n
     #
 
     def __init__(self):
         ## @brief Event objectallow synchronize audio file play/record and STT engine
         self._hot_word_detection_active = threading.Event()
+        ## @brief Set while hot-word detection thread running (including wait for audio device)
+        self._hot_word_thread_active = threading.Event()
         ## @brief Allow bypass through Raspberry Pi IO system bug. Only one instance can control audio system
-        self._io_system_busy = threading.Event()
+        self._arbiter = audio_arbiter.AudioArbiter(logging.getLogger('Audio'))
+        ## @brief Running recognition process
+        self._recognize_process = None
+        ## @brief Resident recognizer - None if recognition process started for each detection
+        self._recognizer = None
+        ## @brief Keep capture device open while file played - resident recognizer receive silence
+        self._capture_on_playback = False
+        self._playback = None
         ## @brief Shutdown eventsignaling to all thread exit
         self._exit_flag = threading.Event()
         ## @brief Unique id for speaker try icon
@@ -79,12 +106,40 @@ class AudioSubSystem:
             command_line = command_line.replace('$lang$', lang_model)
             ## @brief command line to activate hot-word detection engine
             self._recognition_engine = shlex.split(engine + ' ' + command_line + ' ' + log_redirect)
+            if self._config.getboolean('Activation', 'resident'):
+                resident_options = self._config.get('Activation', 'resident_options')
+                resident_options = resident_options.replace('$dict$', dictionary)
+                resident_options = resident_options.replace('$lang$', lang_model)
+                capture_engine = self._config.get('Capture', 'engine')
+                capture_options = self._config.get('Capture', 'options')
+                self._capture_on_playback = self._config.getboolean('Capture', 'keep_open_on_playback')
+                self._recognizer = recognizer.ResidentRecognizer(
+                    shlex.split(engine + ' ' + resident_options + ' ' + log_redirect),
+                    shlex.split(capture_engine + ' ' + capture_options), self._logger)
 
             playback_engine = self._config.get('Playback', 'engine')
             playback_option = self._config.get('Playback', 'options')
             playback_log_redirect = self._config.get('Playback', 'log_redirect')
             ## @brief command line to activate file playback
             self._playback_engine = shlex.split(playback_engine + ' ' + playback_option + ' ' + playback_log_redirect)
+            if self._config.getboolean('Playback', 'stream'):
+                sink = self._config.get('Playback', 'sink')
+                if sink:
+                    output = playback.FileSink(sink)
+                else:
+                    output = playback.AplayOutput(self._config.get('Playback', 'stream_command'), self._logger)
+                ## @brief In-memory playback engine - None if player started for each file
+                self._playback = playback.PlaybackEngine(output, self._config.getfloat('Playback', 'idle_timeout'),
+                                                         self._logger)
+
+            output_format = self._config.get('Assets', 'output_format')
+            ## @brief Decoded audio assets
+            self._assets = audio_assets.AssetCache(
+                self._config.getint('Assets', 'budget'),
+                tuple(int(item) for item in output_format.split(',')) if output_format else None, self._logger)
+            ## @brief Folders of audio assets - files from these folders played from asset cache
+            self._asset_folders = [os.path.join(os.path.abspath(folder), '')
+                                   for folder in self._config.get('Assets', 'folders').split(';') if folder]
 
             record_engine = self._config.get('Record', 'engine')
             record_option = self._config.get('Record', 'options')
@@ -93,6 +148,22 @@ class AudioSubSystem:
             self._max_record_time = self._config.get('Record', 'max_record_time')
             ## @brief command line to activate record engine
             self._record_engine = shlex.split(record_engine + ' ' + record_option + ' ' + record_log_redirect)
+            stream_option = self._config.get('Record', 'stream_options')
+            ## @brief command line to activate streaming record engine - raw audio to stdout
+            self._stream_engine = shlex.split(record_engine + ' ' + stream_option + ' ' + record_log_redirect)
+            ## @brief Stream chunk size in bytes
+            self._stream_chunk_size = self._config.getint('Record', 'stream_chunk_size')
+            ## @brief Stream buffer size in chunks - overrun fail recognition
+            self._stream_buffer_chunks = self._config.getint('Record', 'stream_buffer_chunks')
+            ## @brief End of utterance detector parameters
+            self._vad_options = dict(threshold=self._config.getint('VAD', 'threshold'),
+                                     trailing_silence=self._config.getfloat('VAD', 'trailing_silence'),
+                                     no_speech_timeout=self._config.getfloat('VAD', 'no_speech_timeout'),
+                                     zero_crossing=(self._config.getint('VAD', 'zero_crossing_min'),
+                                                    self._config.getint('VAD', 'zero_crossing_max')),
+                                     leading_padding=self._config.getfloat('VAD', 'leading_padding'))
+            ## @brief Stop file record at end of utterance and trim leading silence
+            self._vad_record = self._config.getboolean('VAD', 'record_file')
 
             if self._config.getboolean('Activation', 'auto_start'):
                 self.start_hot_word_detection(10)
@@ -118,17 +189,41 @@ class AudioSubSystem:
             self._logger.error('Fail to subscribe on "RecordFile" event with error %s.Module unload' % e)
             raise ImportError
 
+        try:
+            dispatcher.connect(self.record_stream, signal='RecordStream', sender=dispatcher.Any)
+        except dispatcher.DispatcherTypeError as e:
+            self._logger.error('Fail to subscribe on "RecordStream" event with error %s.Module unload' % e)
+            raise ImportError
+
+        try:
+            dispatcher.connect(self.preload_audio, signal='PreloadAudio', sender=dispatcher.Any)
+        except dispatcher.DispatcherTypeError as e:
+            self._logger.error('Fail to subscribe on "PreloadAudio" event with error %s.Module unload' % e)
+            raise ImportError
+        self._logger.info('Audio module ready')
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
+
     ## @brief Stop module
     ## @details Stop all module thread and sub-programs
     def __del__(self):
-        dispatcher.disconnect(self.start_hot_word_detection)
-        dispatcher.disconnect(self.play_file)
+        dispatcher.disconnect(self.start_hot_word_detection, signal='WaitToHotWord', sender=dispatcher.Any)
+        dispatcher.disconnect(self.play_file, signal='PlayFile', sender=dispatcher.Any)
+        dispatcher.disconnect(self.record_file, signal='RecordFile', sender=dispatcher.Any)
+        dispatcher.disconnect(self.record_stream, signal='RecordStream', sender=dispatcher.Any)
+        dispatcher.disconnect(self.preload_audio, signal='PreloadAudio', sender=dispatcher.Any)
         self._exit_flag.set()
+        self._stop_recognize_process()
+        if self._recognizer is not None:
+            self._recognizer.stop()
+        if self._playback is not None:
+            self._playback.close()
         sleep(5)
         if self._hot_word_detection_active.isSet():
             self._logger.error('Fail to stop recognition process')
-        if self._io_system_busy.isSet():
-            self._logger.error('Fail to stop playback process')
+        if self._arbiter.owner() is not None:
+            self._logger.error('Fail to stop %s process' % self._arbiter.owner())
+        self._logger.debug('Audio latency statistics %s' % self._arbiter.statistics())
+        self._logger.debug('Audio asset statistics %s' % self._assets.statistics())
         self._logger.debug('Audio module release')
 
     ## @brief WaitToHotWord event wrapper
@@ -138,13 +233,15 @@ class AudioSubSystem:
         if self._exit_flag.is_set():
             self._logger.warning('Shutdown flag set. Ignoring start command')
             return
-        if self._hot_word_detection_active.isSet():
+        if self._hot_word_thread_active.isSet():
             self._logger.warning('Recognizing already running. Ignoring')
             return
         self._logger.info('Starting Hot word detection')
+        self._hot_word_thread_active.set()
         try:
             threading.Thread(target=self._start_hot_word_detection, args=(delay,)).start()
         except threading.ThreadError as e:
+            self._hot_word_thread_active.clear()
             self._logger.error('Fail top start detection thread with error %s' % e)
 
     ## @brief WaitToHotWord thread
@@ -159,99 +256,221 @@ class AudioSubSystem:
     ## @see guiPlugin
     def _start_hot_word_detection(self, delay=None):
         if delay is not None:
-            sleep(delay)
-        self._logger.info('Starting recognize process')
+            self._exit_flag.wait(delay)
+        try:
+            while not self._exit_flag.isSet():
+                # Wait until audio device free - play/record jobs preempt recognizer
+                ticket = self._arbiter.acquire('listen', preempt=self._pause_recognition)
+                self._publish_latency(ticket)
+                try:
+                    if self._hot_word_detection(ticket):
+                        return
+                finally:
+                    self._arbiter.release(ticket)
+        finally:
+            self._hot_word_thread_active.clear()
+
+    ## @brief Run recognition until hot-word detected or device preempted
+    ## @param ticket Audio device ticket
+    ## @return True if hot-word detected or shutdown requested, False if preempted by play/record job
+    ## @warning This function should not be called from outside
+    def _hot_word_detection(self, ticket):
         dispatcher.send(signal='HotWordDetectionActive', status=True)
         dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
                         icon_path="microphone_passive.png")
-
-        _recognize_process = subprocess.Popen(self._recognition_engine, stdout=subprocess.PIPE)
+        if self._recognizer is not None:
+            self._logger.info('Resuming resident recognizer')
+            self._recognizer.resume()
+        else:
+            self._logger.info('Starting recognize process')
+            self._recognize_process = subprocess.Popen(self._recognition_engine, stdout=subprocess.PIPE)
         self._hot_word_detection_active.set()
-        while not self._exit_flag.isSet():
-            line = _recognize_process.stdout.readline().replace('\n', ' ').replace('\r', '')
-            if self._io_system_busy.isSet():
-                self._logger.info('Playback started.Stop recognition process')
-                dispatcher.send(signal='HotWordDetectionActive', status=False)
-                dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
-                                icon_path="microphone_off.png")
-                _recognize_process.terminate()
-                self._hot_word_detection_active.clear()
-                while self._io_system_busy.isSet():
-                    sleep(1)
-                dispatcher.send(signal='HotWordDetectionActive', status=True)
-                dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
-                                icon_path="microphone_passive.png")
-                _recognize_process = subprocess.Popen(self._recognition_engine, stdout=subprocess.PIPE)
-                self._hot_word_detection_active.set()
-            if line != '':
-                for word in self._hot_words:
-                    if word in line:
-                        _recognize_process.terminate()
-                        self._logger.info('Hot word %s detected in input %s' % (word, line))
-                        self._logger.info('Stop recognition process')
-                        dispatcher.send(signal='HotWordDetected', text=word)
-                        dispatcher.send(signal='HotWordDetectionActive', status=False)
-                        dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
-                                        icon_path="microphone_off.png")
-                        self._hot_word_detection_active.clear()
-                        return
-                    if "EMERGENCY SHUTDOWN" in line:
-                        self._logger.warning("EMERGENCY SHUTDOWN")
-                        bashCommand = "killall python"
-                        subprocess.Popen(bashCommand.split())
+        release_device = True
+        try:
+            while not self._exit_flag.isSet():
+                if ticket.preempted:
+                    self._logger.info('%s requested.Pause recognition' % ticket.preempted_by)
+                    release_device = ticket.preempted_by != 'play' or not self._capture_on_playback
+                    return False
+                line = self._read_recognized_line()
+                if line is None:
+                    # Process terminated - preempted or failed
+                    if not ticket.preempted:
+                        self._logger.warning('Recognition process terminated')
+                        self._exit_flag.wait(1)
+                    return False
+                if line != '':
+                    for word in self._hot_words:
+                        if word in line:
+                            self._logger.info('Hot word %s detected in input %s' % (word, line))
+                            self._logger.info('Pause recognition')
+                            self._pause_recognition(release_device=True)
+                            dispatcher.send(signal='HotWordDetected', text=word)
+                            return True
+                        if "EMERGENCY SHUTDOWN" in line:
+                            self._logger.warning("EMERGENCY SHUTDOWN")
+                            bashCommand = "killall python"
+                            subprocess.Popen(bashCommand.split())
+            return True
+        finally:
+            self._pause_recognition(release_device)
+            dispatcher.send(signal='HotWordDetectionActive', status=False)
+            dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
+                            icon_path="microphone_off.png")
+            self._hot_word_detection_active.clear()
+
+    ## @brief Read next line of recognition output
+    ## @return Recognized text, empty string if nothing recognized yet, None if recognition process terminated
+    ## @warning This function should not be called from outside
+    def _read_recognized_line(self):
+        if self._recognizer is not None:
+            line = self._recognizer.readline(0.2)
+            if line is None:
+                return '' if self._recognizer.alive else None
+            return line
+        line = self._recognize_process.stdout.readline()
+        if line == '' and self._recognize_process.poll() is not None:
+            return None
+        return line.replace('\n', ' ').replace('\r', '')
+
+    ## @brief Pause recognition
+    ## @details Used as preempt callback of audio arbiter. Resident recognizer switched to silence input,
+    # otherwise recognition process stopped
+    ## @param release_device Release capture device of resident recognizer
+    ## @warning This function should not be called from outside
+    def _pause_recognition(self, release_device=False):
+        if self._recognizer is not None:
+            self._recognizer.pause(release_device)
+        else:
+            self._stop_recognize_process()
+
+    ## @brief Stop recognition process
+    ## @warning This function should not be called from outside
+    def _stop_recognize_process(self):
+        process = self._recognize_process
+        if process is not None and process.poll() is None:
+            try:
+                process.terminate()
+            except OSError as e:
+                self._logger.warning('Fail to stop recognition process with error %s' % e)
+
+    ## @brief Publish audio job latency
+    ## @param ticket Granted audio device ticket
+    ## @par Generate events:
+    # AudioLatency - Queue wait and device switch time.\n
+    #
+    ## @warning This function should not be called from outside
+    def _publish_latency(self, ticket):
+        dispatcher.send(signal='AudioLatency', kind=ticket.kind, queue_wait=ticket.queue_wait,
+                        switch_time=ticket.switch_time)
 
     ## @brief PlayFile event wrapper
     ## @details Initialize thread that allow to communication audio player
-    ## @param filename string Path to audio file
+    ## @param filename string Path to audio file. Optional if buffer given
     ## @param delay float Delay before start STT engine.Optional. Default - 0
     ## @param callback obj Callback function when playback completed.Optional. Default - None
-    def play_file(self, filename, delay=None, callback=None):
+    ## @param buffer string Wave data or raw PCM data (16 kHz, 16 bit, mono).Optional. Default - None.
+    # Empty buffer - nothing played, callback called when clips queued before it finished
+    def play_file(self, filename=None, delay=None, callback=None, buffer=None):
         if self._exit_flag.is_set():
             self._logger.warning('Shutdown flag set. Ignoring start command')
             return
+        if filename is None and buffer is None:
+            self._logger.warning('Nothing to play. Ignoring')
+            return
         self._logger.info('Starting file playback')
+        # Request device now to keep playback order, delayed requests queued after delay
+        ticket = self._arbiter.submit('play') if delay is None else None
         try:
-            threading.Thread(target=self._play_file, args=(filename, delay, callback)).start()
+            threading.Thread(target=self._play_file, args=(filename, delay, callback, ticket, buffer)).start()
         except threading.ThreadError as e:
+            if ticket is not None:
+                self._arbiter.release(ticket)
             self._logger.error('Fail to start playback thread with error %s' % e)
 
     ## @brief PlayFile thread
-    ## @details Communicate with audio player
+    ## @details Communicate with audio player. When next waiting job is playback too, device handed over as soon
+    # as clip written into output stream, so consecutive clips played without gap
     ## @param filename string Path to audio file
     ## @param delay float Delay before start STT engine - optional. Default - 0
     ## @param callback obj Callback function when playback completed - optional. Default - None
+    ## @param ticket Audio device ticket - optional. Default - requested after delay
+    ## @param buffer string Wave data or raw PCM data - optional. Default - None
     ## @warning This function should not be called from outside
     ## @par Generate events:
     # PlaybackActiveSet to True when audio player play file.\n
     # GuiNotificationGUI tray update.
     #
     ## @see guiPlugin
-    def _play_file(self, filename, delay=None, callback=None):
+    def _play_file(self, filename, delay=None, callback=None, ticket=None, buffer=None):
         if delay is not None:
             sleep(delay)
-        if self._io_system_busy.isSet():
-            self._logger.warning('Another playback active waiting to end')
-        while self._io_system_busy.isSet():
-            sleep(1)
-        self._io_system_busy.set()
-        if self._hot_word_detection_active.isSet():
-            self._logger.warning('Hot word detection running waiting to termination')
-        while self._hot_word_detection_active.isSet():
-            sleep(1)
+        if ticket is None:
+            ticket = self._arbiter.submit('play')
+        self._arbiter.wait(ticket)
+        self._publish_latency(ticket)
+        end = None
+        handoff = False
         try:
             dispatcher.send(signal='PlaybackActive', status=True)
             dispatcher.send(signal='GuiNotification', source=self._gui_speaker_status_uuid, icon_path="speaking.png")
-            subprocess.call([s.replace('$file$', filename) for s in self._playback_engine])
-        except OSError as e:
-            self._logger.error('Fail to play file %s with error %s' % (filename, e))
+            if self._playback is not None:
+                end = self._play_clip(filename, buffer)
+            elif filename is not None:
+                subprocess.call([s.replace('$file$', filename) for s in self._playback_engine])
+            elif buffer:
+                player = subprocess.Popen([s.replace('$file$', '-') for s in self._playback_engine],
+                                          stdin=subprocess.PIPE)
+                player.communicate(buffer)
+        except (OSError, IOError, playback.ClipError) as e:
+            self._logger.error('Fail to play %s with error %s' % (filename or 'buffer', e))
         finally:
-            dispatcher.send(signal='PlaybackActive', status=False)
-            dispatcher.send(signal='GuiNotification', source=self._gui_speaker_status_uuid, icon_path="speaker_off.png")
-            self._io_system_busy.clear()
-            
+            handoff = end is not None and self._arbiter.next_kind() == 'play'
+            if end is not None and not handoff:
+                self._playback.wait(end, self._exit_flag)
+            if not handoff:
+                dispatcher.send(signal='PlaybackActive', status=False)
+                dispatcher.send(signal='GuiNotification', source=self._gui_speaker_status_uuid,
+                                icon_path="speaker_off.png")
+            self._arbiter.release(ticket)
+
+        if handoff:
+            # Next clip already queued in output - wait until this clip played out
+            self._playback.wait(end, self._exit_flag)
         if callable(callback):
             callback()
 
+    ## @brief Play file or buffer through playback engine
+    ## @param filename string Path to audio file or None
+    ## @param buffer string Wave data or raw PCM data
+    ## @return Time when clip end playing
+    ## @warning This function should not be called from outside
+    def _play_clip(self, filename, buffer):
+        if filename is not None and self._is_asset(filename):
+            return self._playback.play(self._assets.get(filename), self._exit_flag)
+        clip = playback.Clip.from_file(filename) if filename is not None else playback.Clip.from_buffer(buffer)
+        try:
+            return self._playback.play(clip, self._exit_flag)
+        finally:
+            clip.close()
+
+    ## @brief Check if file is audio asset
+    ## @param filename string Path to audio file
+    ## @return True if file located in one of asset folders
+    ## @warning This function should not be called from outside
+    def _is_asset(self, filename):
+        path = os.path.abspath(filename)
+        return any(path.startswith(folder) for folder in self._asset_folders)
+
+    ## @brief PreloadAudio event wrapper
+    ## @details Decode audio assets in background
+    ## @param filenames list Paths to wave files
+    def preload_audio(self, filenames):
+        try:
+            threading.Thread(target=self._assets.preload, args=(list(filenames),), name='AssetPreload').start()
+        except threading.ThreadError as e:
+            self._logger.error('Fail to start asset preload thread with error %s' % e)
+
     ## @brief RecordFile event wrapper
     ## @details Initialize thread that allow to communication audio recorder
     ## @param filename string Path to audio file
@@ -267,9 +486,13 @@ class AudioSubSystem:
         elif record_time > self._max_record_time:
             self._logger.warning('Record time too large reducing')
         self._logger.info('Starting audio record')
+        # Request device now to keep request order, delayed requests queued after delay
+        ticket = self._arbiter.submit('record') if delay is None else None
         try:
-            threading.Thread(target=self._record_file, args=(filename, record_time, delay, callback)).start()
+            threading.Thread(target=self._record_file, args=(filename, record_time, delay, callback, ticket)).start()
         except threading.ThreadError as e:
+            if ticket is not None:
+                self._arbiter.release(ticket)
             self._logger.error('Fail to start audio record thread with error %s' % e)
 
     ## @brief Record thread
@@ -278,39 +501,111 @@ class AudioSubSystem:
     ## @param record_time float Record time - optional. Default - maximum allowed time as set in config file
     ## @param delay float Delay before start STT engine - optional. Default - 0
     ## @param callback obj Callback function when playback completed - optional. Default - None
+    ## @param ticket Audio device ticket - optional. Default - requested after delay
     ## @warning This function should not be called from outside
     ## @par Generate events:
     # RecordActive - Set to True when audio recorder record audio into file.\n
     # GuiNotification - GUI tray update.
     #
     ## @see guiPlugin
-    def _record_file(self, filename, record_time, delay=None, callback=None):
+    def _record_file(self, filename, record_time, delay=None, callback=None, ticket=None):
         if delay is not None:
             sleep(delay)
-        if self._io_system_busy.isSet():
-            self._logger.warning('Another playback active waiting to end')
-        while self._io_system_busy.isSet():
-            sleep(1)
-        self._io_system_busy.set()
-        if self._hot_word_detection_active.isSet():
-            self._logger.warning('Hot word detection running waiting to termination')
-        while self._hot_word_detection_active.isSet():
-            sleep(1)
-
+        if ticket is None:
+            ticket = self._arbiter.submit('record')
+        self._arbiter.wait(ticket)
+        self._publish_latency(ticket)
         try:
-            call_command = [s.replace('$file$', filename) for s in self._record_engine]
-            call_command = [s.replace('$time$', record_time) for s in call_command]
             dispatcher.send(signal='RecordActive', status=True)
             dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
                             icon_path="microphone_record.png")
-            subprocess.call(call_command)
-        except OSError as e:
+            if self._vad_record:
+                self._record_utterance(filename, float(record_time))
+            else:
+                call_command = [s.replace('$file$', filename) for s in self._record_engine]
+                call_command = [s.replace('$time$', str(record_time)) for s in call_command]
+                subprocess.call(call_command)
+        except (OSError, IOError, wave.Error) as e:
             self._logger.error('Fail to record file %s with error %s' % (filename, e))
         finally:
-            self._io_system_busy.clear()
+            self._arbiter.release(ticket)
             dispatcher.send(signal='RecordActive', status=False)
             dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
                             icon_path="microphone_off.png")
 
         if callable(callback):
             callback(filename)
+
+    ## @brief Record single utterance into file
+    ## @details Record ended by end of utterance detection, leading silence removed
+    ## @param filename string Path to audio file
+    ## @param record_time float Maximum record time
+    ## @warning This function should not be called from outside
+    def _record_utterance(self, filename, record_time):
+        endpointer = vad.Endpointer(**self._vad_options)
+        stream = capture.AudioStream(self._stream_engine, self._stream_chunk_size, self._stream_buffer_chunks,
+                                     record_time, endpointer, self._logger)
+        stream.start()
+        data = ''.join(stream)
+        writer = wave.open(filename, 'wb')
+        try:
+            writer.setnchannels(1)
+            writer.setsampwidth(endpointer.sample_width)
+            writer.setframerate(endpointer.sample_rate)
+            writer.writeframes(data[endpointer.speech_offset():])
+        finally:
+            writer.close()
+        self._logger.debug('Record ended (%s) after %.2f sec, %.2f sec of leading silence removed' %
+                           (stream.reason, stream.duration,
+                            float(endpointer.speech_offset()) / (endpointer.sample_rate * endpointer.sample_width)))
+
+    ## @brief RecordStream event wrapper
+    ## @details Start streaming record. Record ended by end of utterance detection or time limit
+    ## @param callback obj Function called with capture.AudioStream when record started. Callback should
+    # consume stream in own thread
+    ## @param record_time float Maximum record time - optional. Default - maximum allowed time as set in config file
+    def record_stream(self, callback, record_time=None):
+        if self._exit_flag.is_set():
+            self._logger.warning('Shutdown flag set. Ignoring start command')
+            return
+        if record_time is None:
+            record_time = self._max_record_time
+        self._logger.info('Starting audio stream')
+        ticket = self._arbiter.submit('record')
+        try:
+            threading.Thread(target=self._record_stream, args=(callback, float(record_time), ticket)).start()
+        except threading.ThreadError as e:
+            self._arbiter.release(ticket)
+            self._logger.error('Fail to start audio stream thread with error %s' % e)
+
+    ## @brief Streaming record thread
+    ## @details Keep audio device until stream ended
+    ## @param callback obj Function called with capture.AudioStream when record started
+    ## @param record_time float Maximum record time
+    ## @param ticket Audio device ticket
+    ## @warning This function should not be called from outside
+    ## @par Generate events:
+    # RecordActive - Set to True while audio streamed.\n
+    # GuiNotification - GUI tray update.
+    #
+    ## @see guiPlugin
+    def _record_stream(self, callback, record_time, ticket):
+        self._arbiter.wait(ticket)
+        self._publish_latency(ticket)
+        stream = capture.AudioStream(self._stream_engine, self._stream_chunk_size, self._stream_buffer_chunks,
+                                     record_time, vad.Endpointer(**self._vad_options), self._logger)
+        try:
+            dispatcher.send(signal='RecordActive', status=True)
+            dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
+                            icon_path="microphone_record.png")
+            stream.start()
+            callback(stream)
+            stream.wait(record_time + 1)
+        except OSError as e:
+            self._logger.error('Fail to stream audio with error %s' % e)
+        finally:
+            stream.stop()
+            self._arbiter.release(ticket)
+            dispatcher.send(signal='RecordActive', status=False)
+            dispatcher.send(signal='GuiNotification', source=self._gui_microphone_status_uuid,
+                            icon_path="microphone_off.png")
@@ -1,33 +1,41 @@
 ## @file
 ## @brief Zoho email communication sub-system
-## @details Allow to comunicate with Zoho email server using POP3 protocol
+## @details Allow to comunicate with Zoho email server using IMAP (push) or POP3 protocol
 ## par Configuration file
 ## @verbinclude ./configuration/email.conf
 #
 import ConfigParser
 import logging
+import os
 import threading
 import time
-import dateutil.parser
 from uuid import uuid4
-import socket
-
-from email import parser
-import poplib
 
 import keyring
 from pydispatch import dispatcher
 
+from core import mail_source
+from core import message_store
+
+## @brief Default server address per protocol
+_DEFAULT_SERVERS = {'pop3': ('pop.zoho.com', 995), 'imap': ('imap.zoho.com', 993)}
+
 
 ## @class ZohoEmail
 ## @brief Email plugin
-## @details Communication with Zoho (https://www.zoho.com/) email and retrieve email using POP3 protocol
+## @details Communication with Zoho (https://www.zoho.com/) email and retrieve email using IMAP or POP3 protocol
 ## @version 1.0.0.0
 class ZohoEmail:
     ## @brief Plugin version
     version = '1.0.0.0'
     ## @brief Plugin description
     description = 'Zoho email client module'
+    ## @brief Signals served by plugin - loader manifest
+    provides = ('SpeechRecognize',)
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ('SayText', 'SpeechAccepted', 'RestartInteraction')
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief Create Email interface instance
     ## @details Create and initialize instance
@@ -45,10 +53,6 @@ class ZohoEmail:
         self._gui_status = str(uuid4())
         ## @brief Shutdown event - signal to all thread exit
         self._shutdown = threading.Event()
-        ## @brief Message list
-        self._message_list = dict()
-        ## @brief Message list synchronization object - allow thread safe update
-        self._message_list_token = threading.Lock()
         try:
             ## @brief logger instance
             self._logger = logging.getLogger('moduleEmail')
@@ -76,15 +80,48 @@ class ZohoEmail:
 
             ## @brief Email list refresh interval
             self._update_interval = self._config.getint('General', 'update_interval')
+            state_file = self._config.get('General', 'state_file')
+            if not os.path.exists(os.path.dirname(state_file)):
+                try:
+                    os.makedirs(os.path.dirname(state_file))
+                except OSError as e:
+                    self._logger.error('Fail to create state folder with error %s.Module unload' % e)
+                    raise ImportError
+            try:
+                retention = self._config.getint('General', 'retention_hours') * 60 * 60
+            except ConfigParser.Error as e:
+                self._logger.warning('Fail to read retention with error %s. Using default.' % e)
+                retention = 7 * 24 * 60 * 60
+            ## @brief Message store indexed by time and sender
+            self._messages = message_store.MessageStore(retention)
 
+            protocol = self._config.get('Server', 'protocol').lower()
+            if protocol not in _DEFAULT_SERVERS:
+                self._logger.error('Unknown mail protocol %s.Module unload' % protocol)
+                raise ImportError
             try:
                 ## @brief Zoho email sever URL
                 self._server_url = self._config.get('Server', 'url')
                 ## @brief Zoho email server communication protocol
                 self._server_port = self._config.getint('Server', 'port')
             except (ConfigParser.Error, ValueError):
-                self._server_url = 'pop.zoho.com'
-                self._server_port = 995
+                self._server_url, self._server_port = _DEFAULT_SERVERS[protocol]
+            # State format differ between protocols - separate file per protocol
+            state_file = '%s_%s%s' % (os.path.splitext(state_file)[0], protocol, os.path.splitext(state_file)[1])
+            if protocol == 'imap':
+                ## @brief Mail source - mailbox access
+                self._source = mail_source.ImapSource(self._server_url, self._server_port,
+                                                      "%s@zoho.com" % self.api_user, self.api_key, state_file,
+                                                      self._config.get('Server', 'mailbox'), logger=self._logger)
+            else:
+                self._source = mail_source.Pop3Source(self._server_url, self._server_port,
+                                                      "%s@zoho.com" % self.api_user, self.api_key, state_file,
+                                                      poll_interval=self._update_interval * 60, logger=self._logger)
+            for record in self._source.records():
+                self._messages.add(record)
+            ## @brief Reconnect delay
+            self._backoff = mail_source.Backoff(self._config.getfloat('Server', 'reconnect_min'),
+                                                self._config.getfloat('Server', 'reconnect_max'))
 
         except ConfigParser.Error as e:
             self._logger.error('Fail to read configuration file with error %s.Module unload' % e)
@@ -103,7 +140,8 @@ class ZohoEmail:
         except OSError as e:
             self._logger.warning('Fail to start periodic update thread with error %s' % e)
 
-        self._logger.info('Weather module ready')
+        self._logger.info('Email module ready')
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
 
     ## @brief Stop module
     ## @details Stop all module thread and sub-programs
@@ -112,103 +150,53 @@ class ZohoEmail:
         self._shutdown.set()
         self._logger.debug('Email module release')
 
-    ## @brief Connect to email server
-    ## @details Connect and login to email server
-    ## @warning This function should not be called from outside
-    ## @par Generate events:
-    # GuiNotification - GUI tray update.\n
-    #
-    ## @see guiPlugin
-    def _connect(self):
-        dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="email_refresh.png")
-        try:
-            pop_conn = poplib.POP3_SSL(self._server_url, self._server_port)
-
-            pop_conn.user("%s@zoho.com" % self.api_user)
-            pass_response = pop_conn.pass_(self.api_key)
-            if "+OK" in pass_response:
-                self._logger.debug('Connected to Email server')
-            else:
-                self._logger.warning('Fail to connect.Please check password\username. Got response %s' % pass_response)
-                return None
-        except poplib.error_proto as e:
-            dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="email_error.png")
-            self._logger.warning("Fail to connect.Error %s" % e)
-            return None
-        except socket.error as e:
-            dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="email_error.png")
-            self._logger.warning("Socket error %s" % e)
-            return None
-        else:
-            self._logger.debug('Pass response %s' % pass_response)
-            return pop_conn
-
     ## @brief Wait to new emails
-    ## @details Refresh emails on email server
+    ## @details Synchronize mailbox and wait for change - pushed by IMAP server or polling interval.
+    # On connection error source closed and reconnected after backoff delay.
     ## @warning This function should not be called from outside
     ## @par Generate events:
     # GuiNotification - GUI tray update.\n
-    # SpeechAccepted - Notify that module start process user request.\n
-    # RestartInteraction - Restart Hot-Word detection.\n
-    # SayText - Response to user request using TTS engine.\n
     #
     ## @see guiPlugin
-    ## @see AudioSubSystem
-    ## @see TtsPlugin
     def _periodic_update(self):
-        time.sleep(15)
-        pop_conn = None
-        while pop_conn is None:
-            pop_conn = self._connect()
-            if pop_conn is None:
-                self._shutdown.wait(self._update_interval)
-
+        self._shutdown.wait(15)
+        connected = False
         while not self._shutdown.isSet():
             try:
+                if not connected:
+                    dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="email_refresh.png")
+                    self._source.connect()
+                    self._logger.debug('Connected to Email server')
+                    connected = True
+                    self._backoff.reset()
                 self._logger.debug('Refreshing email list')
-                messages = [pop_conn.retr(i) for i in range(1, len(pop_conn.list()[1]) + 1)]
-                messages = ["\n".join(mssg[1]) for mssg in messages]
-                messages = [parser.Parser().parsestr(mssg) for mssg in messages]
+                new_records, removed_records = self._source.sync()
                 new_message = False
 
-                self._message_list_token.acquire()
-
-                for message in messages:
-                    if not (message['Message-ID'] in self._message_list):
-                        self._logger.info('New message found')
-                        self._message_list[str(message['Message-ID'])] = dict(Subject=str(message['Subject']),
-                                                                              From=str(message['From']),
-                                                                              Time=int(time.mktime(
-                                                                                 dateutil.parser.parse(
-                                                                                     message['Date']).timetuple())))
-                        if time.time() - self._message_list[message['Message-ID']]['Time'] < (1 * 60 * 60):
-                            new_message = True
-
-                self._message_list_token.release()
+                for record in removed_records:
+                    self._messages.remove(record['Message-ID'])
+                for record in new_records:
+                    self._logger.info('New message found')
+                    self._messages.add(record)
+                    if time.time() - record['Time'] < (1 * 60 * 60):
+                        new_message = True
+                self._messages.prune()
 
                 if new_message:
                     dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="new_email.png")
                 else:
                     dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="")
 
-                for i in range(0, 60 * self._update_interval, 30):
-                    self._shutdown.wait(30)
-                    self._logger.debug('Sending NOOP')
-                    pop_conn.noop()
-
-                    if self._shutdown.isSet():
-                        pop_conn.quit()
-                        return
-            except (socket.error, poplib.error_proto) as e:
-                self._logger.warning('Got error - %s. Reconnecting' % e)
-                pop_conn = None
-                while pop_conn is None:
-                    pop_conn = self._connect()
-                    if pop_conn is None:
-                        self._shutdown.wait(self._update_interval)
-                        if self._shutdown.isSet():
-                            pop_conn.quit()
-                            return
+                if self._source.wait(60 * self._update_interval, self._shutdown):
+                    self._logger.debug('Mailbox change reported by server')
+            except mail_source.ERRORS as e:
+                connected = False
+                self._source.close()
+                delay = self._backoff.next()
+                dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="email_error.png")
+                self._logger.warning('Got error - %s. Reconnecting in %.1f sec' % (e, delay))
+                self._shutdown.wait(delay)
+        self._source.close()
 
     ## @brief SpeechRecognize event wrapper
     ## @details If user request contain email entity with high confidence begin request process
@@ -250,11 +238,7 @@ class ZohoEmail:
 
         if search_person is None:
             # ask for update only
-            new_email = 0
-            self._message_list_token.acquire()
-            for message_id, message_data in self._message_list.iteritems():
-                if (time.time() - message_data['Time']) < (1 * 60 * 60):
-                    new_email += 1
+            new_email = self._messages.count_since(time.time() - 1 * 60 * 60)
             if new_email == 0:
                 dispatcher.send(signal='SayText', text="You don't have any new email from last hour",
                                 callback=self.sythsys_complete)
@@ -262,11 +246,7 @@ class ZohoEmail:
                 dispatcher.send(signal='SayText', text="You receive %i new email in last hour" % new_email,
                                 callback=self.sythsys_complete)
         else:
-            new_email = 0
-            self._message_list_token.acquire()
-            for message_id, message_data in self._message_list.iteritems():
-                if ((time.time() - message_data['Time']) < (1 * 60 * 60)) and (search_person in message_data['From']):
-                    new_email += 1
+            new_email = len(self._messages.from_sender(search_person, time.time() - 1 * 60 * 60))
             if new_email == 0:
                 dispatcher.send(signal='SayText',
                                 text="You don't have any new email from %s in last hour" % search_person,
@@ -275,7 +255,6 @@ class ZohoEmail:
                 dispatcher.send(signal='SayText', text="You receive %i new email from %s in last hour" %
                                                        (new_email, search_person), callback=self.sythsys_complete)
 
-        self._message_list_token.release()
         dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="")
 
     ## @brief Restart user interaction
@@ -22,6 +22,12 @@ class Humour:
     version = '1.0.0.0'
     ## @brief Short plugin description
     description = 'Humour sense'
+    ## @brief Signals served by plugin - loader manifest
+    provides = ('SpeechRecognize',)
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ('SayText', 'PlayFile', 'PreloadAudio', 'SpeechAccepted', 'RestartInteraction')
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief Initialize humor
     ## @details Initialize humor sense. Everyone should have one
@@ -33,7 +39,8 @@ class Humour:
     # SpeechAccepted - Notify that module start process user request.\n
     # RestartInteraction - Restart Hot-Word detection.\n
     # SayText - Response to user request using TTS engine.\n
-    # PlayFile - Response with audio file
+    # PlayFile - Response with audio file\n
+    # PreloadAudio - Decode audio responses in advance
     #
     ## @see AudioSubSystem
     ## @see TtsPlugin
@@ -51,12 +58,18 @@ class Humour:
                 self.humour=json.load(fp)
         except IOError as e:
             self._logger.warning('Fail to load humour database with error %s' % e)
+        else:
+            sounds = set(os.path.join('./plugins/wav_data', sound) for item in self.humour.values()
+                         if item['type'] == 'sound' for sound in item['sound'])
+            dispatcher.send(signal='PreloadAudio', filenames=sorted(sounds))
 
         try:
             dispatcher.connect(self.joke, signal='SpeechRecognize', sender=dispatcher.Any)
         except dispatcher.DispatcherTypeError as e:
             self._logger.error('Fail to subscribe on "SpeechRecognize" event with error %s.Module unload' % e)
             raise ImportError
+        self._logger.info('Joke module ready')
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
 
     ## @brief Wrapper for SpeechRecognize event
     ## @details Start thread to analyze user input text
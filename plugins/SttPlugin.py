@@ -19,6 +19,8 @@ from uuid import uuid4
 
 from wit import Wit
 
+from core import stt_backend
+
 ## @class STT
 ## @brief Speech to Text abstraction
 ## @details Allow interface with STT engine
@@ -28,6 +30,12 @@ class STT:
     version = '1.0.0.2'
     ## @brief Short plugin description
     description = 'Interface to WIT STT engine'
+    ## @brief Signals served by plugin - loader manifest
+    provides = ('HotWordDetected', 'RestartInteraction', 'SpeechAccepted')
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ('SayResponse', 'RecordFile', 'RecordStream', 'WaitToHotWord')
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief STT and NLP abstraction
     ## @details Create and initialize instance for WIT.ai STT and NLP engine
@@ -79,12 +87,24 @@ class STT:
             self._temp_folder = self._config.get('Folders', 'TempFolder')
             if not os.path.exists(self._temp_folder):
                 os.makedirs(self._temp_folder)
+            ## @brief Stream user voice to recognition server while recording
+            self._streaming = self._config.getboolean('Streaming', 'enabled')
+            backend = self._config.get('Streaming', 'backend')
+            if backend not in ('wit', 'http'):
+                self._logger.error('Unknown streaming backend %s.Module unload' % backend)
+                raise ImportError
+            backend_url = self._config.get('Streaming', 'url')
         except ConfigParser.Error as e:
             self._logger.error('Fail to read configuration file with error %s.Module unload' % e)
             raise ImportError
 
         ## @brief WIT.AI communication instance
         self.client = Wit(api_key)
+        ## @brief Streaming recognition backend
+        if backend == 'wit':
+            self._backend = stt_backend.WitBackend(self.client)
+        else:
+            self._backend = stt_backend.HttpBackend(backend_url)
         try:
             dispatcher.connect(self.record_user, signal='HotWordDetected', sender=dispatcher.Any)
         except dispatcher.DispatcherTypeError as e:
@@ -100,6 +120,8 @@ class STT:
         except dispatcher.DispatcherTypeError as e:
             self._logger.error('Fail to subscribe on "RestartInteraction" event with error %s.Module unload' % e)
             raise ImportError
+        self._logger.info('STT module ready')
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
 
     ## @brief Stop module
     ## @details Empty module - required only for compatibility
@@ -127,6 +149,10 @@ class STT:
             return
         dispatcher.send(signal='SayResponse', response='Activation')
         dispatcher.send(signal='VoiceActivationAccepted', status=True, sender='STT')  # Special message for brain module
+        if self._streaming:
+            self._logger.debug('Requesting audio stream')
+            dispatcher.send(signal='RecordStream', callback=self.stream_analyze)
+            return
         record_filename = os.path.join(self._temp_folder, str(uuid.uuid4()) + '.wav')
         self._logger.debug('Requesting record into %s' % record_filename)
         dispatcher.send(signal='RecordFile', filename=record_filename, callback=self.wav_analyze)
@@ -137,22 +163,63 @@ class STT:
     def wav_analyze(self, filename):
         threading.Thread(target=self._wav_analyze, args=(filename,)).start()
 
+    ## @brief Callback function
+    ## @details Start thread that upload audio stream to recognition server
+    ## @param stream capture.AudioStream with user voice request
+    def stream_analyze(self, stream):
+        threading.Thread(target=self._analyze, args=(self._recognize_stream, stream, False)).start()
+
     ## @brief Convert wave file into text
-    ## @details Send file to WIT.AI servers and, receive raw text, and text entities
     ## @param filename path to wave file that be send to WIT.AI server
-    ## @todo Remove silence
-    def _wav_analyze(self, filename):
+    ## @return Recognition result
+    def _recognize_file(self, filename):
         self._logger.debug('File record complete - filename %s' % filename)
+        with open(filename, 'rb') as f:
+            resp = self.client.speech(f, None, {'Content-Type': 'audio/wav'})
+            with open(filename[:-3] + 'json', 'w') as fp:
+                json.dump(resp, fp)
+        return resp
+
+    ## @brief Convert audio stream into text
+    ## @details Audio chunks uploaded while user still speaking
+    ## @param stream capture.AudioStream with user voice request
+    ## @return Recognition result
+    def _recognize_stream(self, stream):
+        resp = self._backend.recognize(self._utterance(stream))
+        self._logger.debug('Audio stream ended (%s) after %.2f sec' % (stream.reason, stream.duration))
+        return resp
+
+    ## @brief Audio chunks of user request
+    ## @details Processing notified when stream ended (end of utterance), before recognition result received
+    ## @param stream capture.AudioStream with user voice request
+    ## @return Generator of audio chunks
+    ## @exception IOError Audio stream failed
+    def _utterance(self, stream):
+        for chunk in stream:
+            yield chunk
+        self._processing()
+
+    ## @brief Notify start of request processing
+    def _processing(self):
         dispatcher.send(signal='SayResponse', response='Processing')
         dispatcher.send(signal='GuiNotification', source=self._gui_recognize_uuid, icon_path="analyzing.png")
-        # TODO - Remove silence
+
+    ## @brief Convert wave file into text
+    ## @details Send file to WIT.AI servers and, receive raw text, and text entities
+    ## @param filename path to wave file that be send to WIT.AI server
+    def _wav_analyze(self, filename):
+        self._analyze(self._recognize_file, filename)
+
+    ## @brief Recognize user request and notify processing modules
+    ## @param recognize Function that return recognition result
+    ## @param source Recognize function argument - file name or audio stream
+    ## @param processing Notify processing before recognition. False - recognize function notify it
+    def _analyze(self, recognize, source, processing=True):
+        if processing:
+            self._processing()
         try:
-            resp = None
             self._logger.debug('Connection to speech processing engine')
-            with open(filename, 'rb') as f:
-                resp = self.client.speech(f, None, {'Content-Type': 'audio/wav'})
-                with open(filename[:-3] + 'json', 'w') as fp:
-                    json.dump(resp, fp)
+            resp = recognize(source)
         except:
             self._logger.warning('Fail to analyze speech with error')
             dispatcher.send(signal='SayResponse', response='Unclear')
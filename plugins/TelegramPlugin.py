@@ -14,23 +14,22 @@ import logging
 import threading
 import time
 import datetime
-import json
-import random
 from uuid import uuid4
 import os
 
-from PIL import Image, ImageFont, ImageDraw
-
-
 import telegram.ext
 import telegram
-from emoji import emojize
 
 import picamera
 
 import keyring
 from pydispatch import dispatcher
 
+from core import camera
+from core import message_catalog
+from core import session_store
+from core import worker_pool
+
 ## @class TelegramBot
 ## @brief Additional user interface
 ## @details Communicate with Telegram servers and generate response base on system status
@@ -40,6 +39,12 @@ class TelegramBot:
     version = '1.0.0.0'
     ## @brief Short Plugin description
     description = 'Telegram bot'
+    ## @brief Signals served by plugin - loader manifest
+    provides = ()
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ('WeatherRequest', 'SayText')
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief Start telegram plugin
     ## @details Create and initialize instance start fetching messages. Allow interaction with camera
@@ -59,8 +64,6 @@ class TelegramBot:
         self._camera_gui_status = str(uuid4())
         ## @brief Notify to all thread exit
         self._shutdown = threading.Event()
-        ## @brief User status dictionary (Login, autorization, dialog state)
-        self._user_status = dict()
         ## @brief syncronization event - Allow GUI update
         self._activity_event = threading.Event()
 
@@ -81,10 +84,28 @@ class TelegramBot:
             login_name = self._config.get('API', 'login')
             ## @brief Rotation angle of camera picture
             self._camera_angle = self._config.getfloat('Camera', 'angle')
-
-            with open("./configuration/telegram_messages.json", "r") as data_file:
-                ## @brief Response messages dictionary
-                self.response = json.load(data_file)
+            camera_source = self._config.get('Camera', 'source')
+            camera_quality = self._config.getint('Camera', 'quality')
+            camera_max_age = self._config.getfloat('Camera', 'max_age')
+            session_file = self._config.get('System', 'session_file')
+            session_flush = self._config.getfloat('System', 'session_flush')
+            try:
+                limits = dict((name.strip(), int(limit)) for name, limit in
+                              [item.split(':') for item in self._config.get('Workers', 'limits').split(',')
+                               if item.strip()])
+                if any(limit < 1 for limit in limits.values()):
+                    raise ValueError('limit below 1')
+            except ValueError as e:
+                raise ConfigParser.Error('Invalid Workers limits (command:limit,...) - %s' % e)
+            ## @brief Handler worker pool - handlers of one chat executed in order, chats in parallel
+            self._workers = worker_pool.KeyedWorkerPool(self._config.getint('Workers', 'workers'),
+                                                        self._config.getint('Workers', 'max_queue'), limits,
+                                                        self._logger)
+
+            ## @brief Response messages - compiled once, reloaded when file changed
+            self.response = message_catalog.MessageCatalog("./configuration/telegram_messages.json",
+                                                           self._config.getfloat('System', 'messages_check'),
+                                                           self._logger)
 
         except ConfigParser.Error as e:
             self._logger.error('Fail to read configuration file with error %s.Module unload' % e)
@@ -118,19 +139,15 @@ class TelegramBot:
             self._logger.warning('Fail to start BOT. Error %s' % e)
             raise ImportError
 
-        self._bot_update.dispatcher.add_handler(telegram.ext.CommandHandler("start", self.start))
-        self._bot_update.dispatcher.add_handler(telegram.ext.CommandHandler("help", self.help))
-        self._bot_update.dispatcher.add_handler(telegram.ext.CommandHandler("get_weather", self.get_weather))
-        self._bot_update.dispatcher.add_handler(telegram.ext.CommandHandler("get_picture", self.get_picture))
-        self._bot_update.dispatcher.add_handler(telegram.ext.CommandHandler("say", self.say_text))
+        # Handlers executed by worker pool - slow command does not block update loop
+        for command, handler in (("start", self.start), ("help", self.help), ("get_weather", self.get_weather),
+                                 ("get_picture", self.get_picture), ("say", self.say_text), ("stats", self.stats)):
+            self._bot_update.dispatcher.add_handler(telegram.ext.CommandHandler(command,
+                                                                                self._pooled(command, handler)))
 
         # Unknown command
         self._bot_update.dispatcher.add_handler(
-            telegram.ext.MessageHandler(telegram.ext.Filters.text, self.text_handler))
-
-        # Unknown command
-        self._bot_update.dispatcher.add_handler(
-            telegram.ext.MessageHandler(telegram.ext.Filters.text, self.text_handler))
+            telegram.ext.MessageHandler(telegram.ext.Filters.text, self._pooled('text', self.text_handler)))
 
         ## @brief Path to temp folder
         self._temp_folder = self._config.get('System', 'temp_folder')
@@ -141,8 +158,12 @@ class TelegramBot:
                 self._logger.error('Fail to temporary folder with error %s.Module unload' % e)
                 raise ImportError
 
-        ## @brief Security camera instance
-        self._camera = picamera.PiCamera()
+        ## @brief User sessions (authorization, dialog state) - kept between restarts
+        self._sessions = session_store.SessionStore(session_file, flush_interval=session_flush, logger=self._logger)
+
+        ## @brief Security camera - kept open, pictures encoded in memory
+        self._camera = camera.CameraPipeline(camera.FakeCamera() if camera_source == 'fake' else picamera.PiCamera(),
+                                             self._camera_angle, camera_quality, camera_max_age, self._logger)
 
         self._logger.debug("Starting periodic update thread")
         try:
@@ -154,12 +175,19 @@ class TelegramBot:
         threading.Thread(target=self._activity_update).start()
 
         self._logger.info('Telegram bot module ready')
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
         
     ## @brief Stop module
     ## @details Stop all module thread and sub-programs
     def __del__(self):
         self._logger.info('Stop Telegram module')
         self._bot_update.stop()
+        self._workers.stop()
+        self._logger.debug('Handler statistics %s' % self._workers.statistics())
+        self._logger.debug('Camera statistics %s' % self._camera.statistics())
+        self._camera.close()
+        self._sessions.close()
+        self._logger.debug('Session statistics %s' % self._sessions.statistics())
 
     ## @brief Update GUI tray according user activity
     ## @details Receive event flag and set/clear telegram icon in GUI tray
@@ -172,6 +200,34 @@ class TelegramBot:
             else:
                 dispatcher.send(signal='GuiNotification', source=self._notify_gui_status, icon_path="")
 
+    ## @brief Create pooled handler
+    ## @details Returned handler queue original handler in worker pool keyed by chat
+    ## @param name Command name - used for concurrency limits and statistics
+    ## @param handler Handler function
+    ## @return Handler function for dispatcher
+    def _pooled(self, name, handler):
+        def submit(bot, update):
+            if not self._workers.submit(update.effective_chat.id, name, handler, bot, update):
+                self._logger.warning('Handler queue full - %s from %s rejected' % (name, update.effective_chat.id))
+                update.message.reply_text("I'm busy right now, please try again in a few seconds")
+        return submit
+
+    ## @brief Event wrapper of stats command
+    ## @details Send handler queue depth and latency report
+    ## @param bot Bot object
+    ## @param update Chat update object
+    def stats(self, bot, update):
+        self._activity_event.set()
+        if not self.if_authorized(update.effective_user.id, update):
+            return
+        statistics = self._workers.statistics()
+        lines = ['Queued %d, rejected %d, workers %d' % (statistics['pending'], statistics['rejected'],
+                                                         statistics['workers'])]
+        lines.extend('%s: running %d, count %d, avg %.2fs, max %.2fs, wait %.2fs' %
+                     (name, statistics['running'].get(name, 0), item['count'], item['average'], item['maximum'],
+                      item['wait']) for name, item in sorted(statistics['latency'].items()))
+        update.message.reply_text('\n'.join(lines))
+
     ## @brief Event wrapper of start command
     ## @details Send welcome text and create/reset user instance
     ## @param bot Bot object
@@ -179,21 +235,19 @@ class TelegramBot:
     def start(self, bot, update):
         self._activity_event.set()
         if 6 <= datetime.datetime.now().hour < 12:
-            message = random.choice(self.response['welcome_morning'])
+            message = self.response.choice('welcome_morning')
         elif 12 <= datetime.datetime.now().hour < 18:
-            message = random.choice(self.response['welcome_afternoon'])
+            message = self.response.choice('welcome_afternoon')
         elif 18 <= datetime.datetime.now().hour < 18:
-            message = random.choice(self.response['welcome_evening'])
+            message = self.response.choice('welcome_evening')
         else:
-            message = random.choice(self.response['welcome_night'])
+            message = self.response.choice('welcome_night')
         update.message.reply_text(message)
-        if update.effective_user.id not in self._user_status:
+        if self._sessions.create(update.effective_user.id):
             # new user
             self._logger.info("New user login - Name %s, ID-%s" % (update.effective_user.full_name,
                                                                    update.effective_user.id))
-            self._user_status[update.effective_user.id] = {"authorized": False,
-                                                           "active_state":None}
-            update.message.reply_text(random.choice(self.response['authorization_require']))
+            update.message.reply_text(self.response.choice('authorization_require'))
 
     ## @brief Event wrapper of help command
     ## @details Send welcome help text
@@ -201,18 +255,19 @@ class TelegramBot:
     ## @param update Chat update object
     def help(self, bot, update):
         self._activity_event.set()
-        update.message.reply_text("Supported command /get_picture and /get_weather")
+        update.message.reply_text("Supported command /get_picture, /get_weather, /say and /stats")
 
     ## @brief Check user authorization
     ## @details Check if user pass authorization process
     ## @return True/False according user status
     def if_authorized(self, user_id, update):
-        if user_id in self._user_status and self._user_status[user_id]["authorized"]:
+        session = self._sessions.get(user_id)
+        if session is not None and session.authorized:
             self._logger.debug('User %s authorized' % user_id)
             return True
         else:
             self._logger.debug('User %s NOT authorized' % user_id)
-            update.message.reply_text(random.choice(self.response['authorization_require']))
+            update.message.reply_text(self.response.choice('authorization_require'))
             return False
 
     ## @brief Event wrapper user text messages
@@ -227,45 +282,45 @@ class TelegramBot:
     ## see TTS
     def text_handler(self, bot, update):
         self._activity_event.set()
-        if update.effective_user.id not in self._user_status:
+        session = self._sessions.get(update.effective_user.id)
+        if session is None:
             # new user
             self._logger.info("New user login - Name %s, ID-%s" % (update.effective_user.full_name,
                                                                    update.effective_user.id))
-            self._user_status[str(update.effective_user.id)] = {"authorized": False,
-                                                                "active_state": self.authorize}
-            update.message.reply_text(random.choice(self.response['authorization_require']))
-        elif not self._user_status[update.effective_user.id]["authorized"]:
+            self._sessions.create(update.effective_user.id)
+            update.message.reply_text(self.response.choice('authorization_require'))
+        elif not session.authorized:
             # Check password
             if str(update.message.text).replace(' ', '') == self._authorization_password:
                 self._logger.info('User %s (id-%s) pass authorization process' % (update.effective_user.full_name,
                                                                                   update.effective_user.id))
-                update.message.reply_text(random.choice(self.response['authorization_successful']))
-                self._user_status[update.effective_user.id]["authorized"] = True
+                update.message.reply_text(self.response.choice('authorization_successful'))
+                self._sessions.update(update.effective_user.id, authorized=True)
             else:
                 self._logger.info('User %s (id-%s) fail to pass authorization process' %
                                   (update.effective_user.full_name, update.effective_user.id))
-                update.message.reply_text(random.choice(self.response['authorization_fail']))
-        elif self._user_status[update.effective_user.id]["active_state"] == "city_name":
+                update.message.reply_text(self.response.choice('authorization_fail'))
+        elif session.active_state == "city_name":
             custom_keyboard = [['Today'], ['Tomorrow'], []]
             reply_markup = telegram.ReplyKeyboardMarkup(custom_keyboard)
             update.message.reply_text(text="Select when forecast is needed", reply_markup=reply_markup)
-            self._user_status[update.effective_user.id]["active_state"] = "weather_time"
-            self._user_status[update.effective_user.id]["weather_city"] = update.message.text
-        elif self._user_status[update.effective_user.id]["active_state"] == "weather_time":
+            self._sessions.update(update.effective_user.id, active_state="weather_time",
+                                  weather_city=update.message.text)
+        elif session.active_state == "weather_time":
             reply_markup = telegram.ReplyKeyboardRemove()
             update.message.reply_text(text="Few seconds - getting forecast. City %s for %s" %
-                                           (self._user_status[update.effective_user.id]["weather_city"],
+                                           (session.weather_city,
                                             update.message.text), reply_markup=reply_markup)
             if str(update.message.text) == "Tomorrow":
                 dispatcher.send(signal='WeatherRequest',
                                 callback=self._weather_update, custom_object=update, request_time='tomorrow',
-                                request_city=self._user_status[update.effective_user.id]["weather_city"])
+                                request_city=session.weather_city)
             else:
                 dispatcher.send(signal='WeatherRequest',
                                 callback=self._weather_update, custom_object=update, request_time='today',
-                                request_city=self._user_status[update.effective_user.id]["weather_city"])
-            self._user_status[update.effective_user.id]["active_state"] = None
-        elif self._user_status[update.effective_user.id]["active_state"] == "say_text":
+                                request_city=session.weather_city)
+            self._sessions.update(update.effective_user.id, active_state=None)
+        elif session.active_state == "say_text":
             dispatcher.send(signal='SayText', text=update.message.text)
         else:
             print update.message.text
@@ -279,7 +334,7 @@ class TelegramBot:
         if not self.if_authorized(update.effective_user.id, update):
             return
         update.message.reply_text("What do you want that I say ?")
-        self._user_status[update.effective_user.id]["active_state"] = "say_text"
+        self._sessions.update(update.effective_user.id, active_state="say_text")
 
     ## @brief Event wrapper for get_picture command
     ## @details Receive command and send picture from security camera
@@ -290,16 +345,13 @@ class TelegramBot:
         if not self.if_authorized(update.effective_user.id, update):
             return
         dispatcher.send(signal='GuiNotification', source=self._camera_gui_status, icon_path="camera.png")
-        self._camera.capture(os.path.join(self._temp_folder, "raw.jpg"))
-        raw_pic = Image.open(os.path.join(self._temp_folder, "raw.jpg"))
-        post_img = raw_pic.rotate(self._camera_angle, expand=True)
-        draw = ImageDraw.Draw(post_img)
-        font = ImageFont.load_default()
-        draw.text((0, 0), str(datetime.datetime.now()), (255, 255, 255), font=font)
-
-        post_img.save(os.path.join(self._temp_folder, "process.jpg"))
-        bot.send_photo(chat_id=update.message.chat_id, photo=open(os.path.join(self._temp_folder, "process.jpg"), 'rb'))
-        dispatcher.send(signal='GuiNotification', source=self._camera_gui_status, icon_path="")
+        try:
+            bot.send_photo(chat_id=update.message.chat_id, photo=self._camera.photo())
+        except IOError as e:
+            self._logger.warning('Fail to get picture with error %s' % e)
+            update.message.reply_text("Sorry, camera is not available")
+        finally:
+            dispatcher.send(signal='GuiNotification', source=self._camera_gui_status, icon_path="")
 
     ## @brief Event wrapper for get_weather command
     ## @details Receive command and request weather forecast
@@ -311,7 +363,7 @@ class TelegramBot:
         if not self.if_authorized(update.effective_user.id, update):
             return
         update.message.reply_text("Where you want know the weather? Write down a city name")
-        self._user_status[update.effective_user.id]["active_state"] = "city_name"
+        self._sessions.update(update.effective_user.id, active_state="city_name")
 
     ## @brief Event wrapper for unknow command
     ## @details Receive command and response to user
@@ -330,19 +382,6 @@ class TelegramBot:
     ## @param icon Path to weather icon - Ignored
     def _weather_update(self, custom, description, temp, wind, icon):
         if description == "Error":
-
-            custom.message.reply_text(emojize(":sob: Sorry, we have some error getting weather", use_aliases=True))
+            custom.message.reply_text(self.response.choice('weather_error'))
         else:
-            if "clear" in str(description).lower():
-                custom.message.reply_text(emojize(":sunny: Weather is %s with temperature %02.1fC and %s" %
-                                                  (description, temp, wind), use_aliases=True))
-            elif "cloud" in str(description).lower():
-                custom.message.reply_text(emojize(":cloud: Weather is %s with temperature %02.1fC and %s" %
-                                                  (description, temp, wind), use_aliases=True))
-            elif "rain" in str(description).lower():
-                custom.message.reply_text(emojize(":umbrella: Weather is %s with temperature %02.1fC and %s" %
-                                                  (description, temp, wind)))
-            else:
-                custom.message.reply_text(emojize(":earth_africa: Weather is %s with temperature %02.1fC and %s" %
-                                                  (description, temp, wind), use_aliases=True))
-
+            custom.message.reply_text(self.response.weather(description, temp, wind))
@@ -7,15 +7,22 @@
 ## @verbinclude ./configuration/tts.conf
 #
 import ConfigParser
+import json
 import logging
-import subprocess
 import os
-import hashlib
-from time import time
+import threading
 from pydispatch import dispatcher
 import random
 from uuid import uuid4
 
+from core import tts_cache
+from core import tts_engine
+
+## @brief Synthesis priority of warmup requests - served after all user requests
+WARMUP_PRIORITY = 10
+## @brief Warmup state file - cache keys of rendered responses
+WARMUP_STATE = 'responses.json'
+
 ## @class TTS
 ## @brief Test To Speech abstraction
 ## @details Allow interface with TTS engine
@@ -25,6 +32,12 @@ class TTS:
     version = '1.0.0.1'
     ## @brief Short plugin description
     description = 'Python wrapper for TTS - festeval'
+    ## @brief Signals served by plugin - loader manifest
+    provides = ('SayText', 'SayResponse')
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ('PlayFile',)
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief Create TTS interface instance
     ## @details Create and initialize instance, initialize festival engine
@@ -69,24 +82,65 @@ class TTS:
         try:
             ## @brief TTS engine inialize command
             self.tts_command = self._config.get('TTS', 'command')
+            engine = self._config.get('TTS', 'engine')
+            workers = self._config.getint('TTS', 'workers')
+            if engine == 'festival_server':
+                server_command = self._config.get('TTS', 'server_command')
+                base_port = self._config.getint('TTS', 'base_port')
+                voice = self._config.get('TTS', 'voice')
+                engines = [tts_engine.FestivalServer(server_command, base_port + index, voice, self._logger)
+                           for index in range(workers)]
+                ## @brief Engine settings that change synthesized audio - part of cache key
+                self._engine_settings = (engine, voice)
+            elif engine == 'text2wave':
+                engines = [tts_engine.Text2Wave(self.tts_command, self._logger) for _ in range(workers)]
+                self._engine_settings = (engine, self.tts_command)
+            else:
+                self._logger.error('Unknown TTS engine %s.Module unload' % engine)
+                raise ImportError
         except ConfigParser.Error as e:
             self._logger.error('Fail to load tts configuration with error %s.Module unload' % e)
             raise ImportError
+        ## @brief Pool of warm synthesis engines
+        self._pool = tts_engine.SynthesisPool(engines, self._logger)
         # Cache
-        ## @brief cached text list
-        self._cached_text = list()
         try:
             ## @brief configuration - True if cache enabled
             self._use_cache = self._config.getboolean('Cache', 'Allow')
             ## @brief Maximum cache size
             self._cache_size = self._config.getint('Cache', 'MaxItems')
+            ## @brief Maximum cache size in bytes
+            self._cache_bytes = self._config.getint('Cache', 'MaxBytes')
             ## @brief Configuration if True cached will be cleared on exit
             self._clear_on_exit = self._config.getboolean('Cache', 'ClearOnExit')
+            ## @brief Configuration if True configured responses pre-rendered after start
+            self._warmup_enabled = self._config.getboolean('Cache', 'Warmup')
         except ConfigParser.Error as e:
             self._logger.error('Fail read cache settings with error %s. Using default.' % e)
             self._use_cache = True
             self._cache_size = 10
+            self._cache_bytes = 20000000
             self._clear_on_exit = True
+            self._warmup_enabled = True
+        try:
+            cache_flush = self._config.getfloat('Cache', 'FlushInterval')
+        except ConfigParser.Error as e:
+            self._logger.error('Fail read cache flush interval with error %s. Using default.' % e)
+            cache_flush = 30.0
+        ## @brief Persistent wave file cache
+        self._cache = tts_cache.SpeechCache(self._cache_folder, self._cache_size, self._cache_bytes, self._logger,
+                                            flush_interval=cache_flush)
+        try:
+            ## @brief Split text into sentences and overlap synthesis with playback
+            self._split_text = self._config.getboolean('Streaming', 'SplitSentences')
+            ## @brief Maximum sentence length - longer sentences split on clauses
+            self._max_chunk = self._config.getint('Streaming', 'MaxChunk')
+        except ConfigParser.Error as e:
+            self._logger.error('Fail read streaming settings with error %s. Using default.' % e)
+            self._split_text = True
+            self._max_chunk = 120
+        ## @brief Shutdown event - stop warmup
+        self._exit_flag = threading.Event()
         # Register for incoming events
         try:
             dispatcher.connect(self.text2wav, signal='SayText', sender=dispatcher.Any)
@@ -99,95 +153,143 @@ class TTS:
             self._logger.error('Fail to subscribe on "SayResponse" event with error %s.Module unload' % e)
             raise ImportError
         self._logger.info('TTS module ready')
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
+        if self._use_cache and self._warmup_enabled:
+            threading.Thread(target=self._warmup, name='TtsWarmup').start()
 
     ## @brief Stop module
     ## @details Stop all module thread and sub-programs
     def __del__(self):
+        self._exit_flag.set()
+        self._pool.stop()
+        self._logger.debug('Synthesis statistics %s' % self._pool.statistics())
+        self._logger.debug('Cache statistics %s' % self._cache.statistics())
         if self._clear_on_exit and self._use_cache:
             self._logger.debug('Removing cache')
-            for cache_file in self._cached_text:
-                #  Remove old items if any
-                try:
-                    self._logger.debug('Removing %s.wav' % cache_file)
-                    os.remove(os.path.join(self._cache_folder, cache_file + '.wav'))
-                except OSError as e:
-                    self._logger.warning('Fail to remove old cached item with error %s' % e)
-
-                try:
-                    self._logger.debug('Removing %s.txt' % cache_file)
-                    os.remove(os.path.join(self._cache_folder, cache_file + '.txt'))
-                except OSError as e:
-                    self._logger.warning('Fail to remove old cached item with error %s' % e)
+            self._cache.clear()
+        else:
+            self._cache.flush()
 
         self._logger.debug('TTS module released')
 
     ## @brief Event SayText wrapper
-    ## details Receive text and convert it to wave file
+    ## details Receive text, split it into sentences and convert them to wave files.
+    # All sentences queued for synthesis at once, each sentence played as soon as ready,
+    # so playback of sentence overlap synthesis of next one. Callback carried by empty clip queued
+    # after last sentence - called when all played sentences finished, even if last sentence failed
     ## @param sender Message origin
     ## @param text Text to convert
-    ## @param callback Callback function.Optional.Default - None
+    ## @param callback Callback function, called after last sentence played.Optional.Default - None
     def text2wav(self, sender, text, callback=None):
         self._logger.debug('Received text "%s" from module:%s' % (text, sender))
-        text_hash = hashlib.sha1(text).hexdigest()
-        wave_file = os.path.join(self._cache_folder, text_hash + '.wav')
-        text_file = os.path.join(self._cache_folder, text_hash + '.txt')
+        chunks = tts_engine.split_sentences(text, self._max_chunk) if self._split_text else [text]
+        dispatcher.send(signal='SpeechSynthesize', status=True)
+        dispatcher.send(signal='GuiNotification', source=self._gui_synthesis_status_uuid, icon_path="synthesis.png")
+        try:
+            pending = [self._prepare(chunk) for chunk in chunks]
+            queued = False
+            for index, (key, wave_file, request) in enumerate(pending):
+                if request is None:
+                    dispatcher.send(signal='PlayFile', filename=wave_file)
+                else:
+                    wave = self._store(key, request, chunks[index])
+                    if wave is None:
+                        continue
+                    # Synthesized audio already in memory - played without file round trip
+                    dispatcher.send(signal='PlayFile', buffer=wave)
+                queued = True
+            if not queued:
+                self._fail(callback)
+            elif callback is not None:
+                dispatcher.send(signal='PlayFile', buffer='', callback=callback)
+        finally:
+            dispatcher.send(signal='SpeechSynthesize', status=False)
+            dispatcher.send(signal='GuiNotification', source=self._gui_synthesis_status_uuid, icon_path="")
 
+    ## @brief Find cached wave file or queue synthesis
+    ## @param text Text to convert
+    ## @return Tuple of cache key, cached wave file path (or None) and SynthesisRequest (None if cached file found)
+    def _prepare(self, text):
+        key = tts_cache.make_key(text, *self._engine_settings)
         if self._use_cache:
-            if os.path.isfile(wave_file):
+            wave_file = self._cache.lookup(key)
+            if wave_file is not None:
                 self._logger.debug('Cached text found')
-                # Item will be re inserted at end
-                try:
-                    self._cached_text.remove(text_hash)
-                except ValueError:
-                    self._logger.info('Unlisted cache file found')
-            else:
-                self._logger.debug('Cache miss')
-                while len(self._cached_text) > self._cache_size:
-                    #  Remove old items if any
-                    try:
-                        self._logger.debug('Removing old item %s' % self._cached_text[0])
-                        os.remove(os.path.join(self._cache_folder, self._cached_text[0] + '.wav'))
-                        os.remove(os.path.join(self._cache_folder, self._cached_text[0] + '.txt'))
-                    except IOError as e:
-                        self._logger.warning('Fail to remove old cached item with error %s' % e)
-                    self._cached_text = self._cached_text[1:]
-                self._synthesize(text_file, wave_file, text)
+                return key, wave_file, None
+            self._logger.debug('Cache miss')
+        self._logger.debug('Synthesize text "%s"' % text)
+        return key, None, self._pool.submit(text)
 
-            self._cached_text.append(text_hash)
-        else:
-            self._synthesize(text_hash, wave_file, text)
+    ## @brief Report synthesis failure
+    ## @details Nothing queued for playback - callback called immediately, so caller not blocked
+    ## @param callback Callback function or None
+    def _fail(self, callback):
+        if callable(callback):
+            callback()
 
-        dispatcher.send(signal='PlayFile', filename=wave_file, callback=callback)
+    ## @brief Store synthesis result
+    ## details Wait for synthesis pool and store wave data in cache
+    ## @param key Cache key
+    ## @param request Synthesis request
+    ## @param text Source text
+    ## @return Wave data or None if synthesis failed
+    def _store(self, key, request, text):
+        try:
+            wave = request.result()
+        except tts_engine.SynthesisError as e:
+            self._logger.error('Fail to communicate with TTS engine.Error : %s' % e)
+            return None
+        if self._use_cache:
+            try:
+                self._cache.store(key, wave, text)
+            except IOError as e:
+                self._logger.error('Fail create speech file.Error : %s' % e)
+        return wave
 
-    ## @brief TTS engine wrapper
-    ## details Convert text to wave file
-    ## @param text_file Path to text file
-    ## @param wave_file Path where store wave file
-    ## @param text Text to be converted
-    def _synthesize(self, text_file, wave_file, text):
-        dispatcher.send(signal='SpeechSynthesize', status=True)
-        dispatcher.send(signal='GuiNotification', source=self._gui_synthesis_status_uuid, icon_path="synthesis.png")
-        self._logger.debug('Synthesize text "%s" using text file %s into wave file %s' %
-                           (text, text_file, wave_file))
-        # Write new text file
+    ## @brief Pre-render configured responses
+    ## @details Every response variant synthesized into cache at low priority. Request queued only when
+    # synthesis worker idle, so user requests never wait for warmup. Variants rendered before but removed
+    # or changed in configuration file removed from cache.
+    ## @warning This function should not be called from outside
+    def _warmup(self):
+        state_file = os.path.join(self._cache_folder, WARMUP_STATE)
         try:
-            f = open(text_file, 'w')
-            f.write(text)
-            f.close()
-        except IOError as e:
-            self._logger.error('Fail create speech file.Error : %s' % e)
-            dispatcher.send(signal='SpeechSynthesize', status=False)
-        # Synthesize new wave file
+            with open(state_file) as f:
+                previous = set(json.load(f))
+        except (IOError, ValueError):
+            previous = set()
+        current = []
+        jobs = []
+        for name, value in self._config.items('Response'):
+            for variant in value.split(';'):
+                if not variant.strip():
+                    continue
+                for chunk in tts_engine.split_sentences(variant, self._max_chunk) if self._split_text else [variant]:
+                    key = tts_cache.make_key(chunk, *self._engine_settings)
+                    current.append(key)
+                    if not self._cache.contains(key):
+                        jobs.append((key, chunk))
+        stale = previous.difference(current)
+        for key in stale:
+            self._cache.remove(key)
+        self._logger.info('Warmup started - %d responses to render, %d changed responses removed' %
+                          (len(jobs), len(stale)))
+        for index, (key, chunk) in enumerate(jobs):
+            while self._pool.idle() < 1 and not self._exit_flag.is_set():
+                self._exit_flag.wait(0.2)
+            if self._exit_flag.is_set():
+                self._logger.info('Warmup stopped at %d/%d' % (index, len(jobs)))
+                return
+            request = self._pool.submit(chunk, priority=WARMUP_PRIORITY)
+            if self._store(key, request, chunk) is not None:
+                self._logger.debug('Warmup %d/%d - "%s" rendered in %.3f sec' %
+                                   (index + 1, len(jobs), chunk, request.synthesis_time))
         try:
-            self._logger.debug('Start voice synthesis')
-            start_time = time()
-            subprocess.call(['text2wave', str(text_file), '-o', str(wave_file)])
-            self._logger.debug('Voice synthesis complete. Synthesis time %s sec' % (time() - start_time))
-        except OSError as e:
-            self._logger.error('Fail to communicate with TTS engine.Error : %s' % e)
-        finally:
-            dispatcher.send(signal='SpeechSynthesize', status=False)
-            dispatcher.send(signal='GuiNotification', source=self._gui_synthesis_status_uuid, icon_path="")
+            with open(state_file, 'w') as f:
+                json.dump(current, f)
+        except IOError as e:
+            self._logger.warning('Fail to save warmup state with error %s' % e)
+        self._logger.info('Warmup complete - %d responses rendered' % len(jobs))
 
     ## @brief SayResponce event wrapper
     ## details Fetch system response from config file and convert it to speech
@@ -195,8 +297,8 @@ class TTS:
     def response(self, response):
         try:
             response = self._config.get('Response', response)
-        except ConfigParser as e:
+        except ConfigParser.Error as e:
             self._logger.warning('Fail to retrieve response %s with error %s' % (response, e))
-        
+            return
         dispatcher.send(signal='SayText', text=random.choice(response.split(';')))
 
@@ -11,13 +11,19 @@ import os
 import threading
 import urllib
 import time
-from bisect import bisect_left
 import dateutil.parser
 from uuid import uuid4
 
 import keyring
 from pydispatch import dispatcher
 
+from core import forecast_store
+from core import http_client
+from core import city_tracker
+from core import icon_cache
+from core import rate_limit
+from core import weather_cache
+
 
 ## @class Weather
 ## @brief Interaction with OPenWeatherMap
@@ -28,6 +34,12 @@ class Weather:
     version = '1.0.0.0'
     ## @brief  Short plugin description
     description = 'Weather module'
+    ## @brief Signals served by plugin - loader manifest
+    provides = ('SpeechRecognize', 'WeatherRequest')
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ('SayText', 'SpeechAccepted', 'RestartInteraction')
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief Create Weather interface instance
     ## @details Create and initialize instance, initialize weather fetching
@@ -46,8 +58,6 @@ class Weather:
     def __init__(self):
         ## @brief Shutdown event - notify to thread exit
         self._shutdown = threading.Event()
-        ## @brief weather data cache
-        self._weather_data = []
         ## @brief Unique id to GUI tray
         self._gui_status = str(uuid4())
         try:
@@ -96,12 +106,51 @@ class Weather:
             self._units = self._config.get('General', 'units')
             ## @brief Configuration - If True save raw JSON in cache folder
             self._dump_json = self._config.getboolean('Debug', 'save_json')
+            try:
+                ## @brief Shared cache of downloaded weather data
+                self._weather_cache = weather_cache.WeatherCache(
+                    {'find': self._config.getint('Cache', 'current_ttl'),
+                     'forecast': self._config.getint('Cache', 'forecast_ttl')},
+                    self._config.getint('Cache', 'stale_ttl'), logger=self._logger)
+            except ConfigParser.Error as e:
+                self._logger.warning('Fail to read cache settings with error %s. Using default.' % e)
+                self._weather_cache = weather_cache.WeatherCache({'find': 600, 'forecast': 3600}, 3 * 60 * 60,
+                                                                 logger=self._logger)
+            ## @brief Parsed forecast series shared by all forecast requests
+            self._forecast_store = forecast_store.ForecastStore()
             if not os.path.exists(self._temp_folder):
                 try:
                     os.makedirs(self._temp_folder)
                 except IOError as e:
                     self._logger.error('Fail to temporary folder with error %s.Module unload' % e)
                     raise ImportError
+            try:
+                ## @brief Keep-alive HTTP client shared by weather and icon requests
+                self._http_client = http_client.HttpClient(self._config.getfloat('HTTP', 'timeout'),
+                                                           self._config.getint('HTTP', 'pool_size'),
+                                                           logger=self._logger)
+            except ConfigParser.Error as e:
+                self._logger.warning('Fail to read HTTP settings with error %s. Using default.' % e)
+                self._http_client = http_client.HttpClient(logger=self._logger)
+            ## @brief Content addressed icon store
+            self._icon_cache = icon_cache.IconCache(self._temp_folder, self._http_client, self._logger)
+            try:
+                ## @brief Configuration - If True frequently requested cities refreshed in background
+                self._tracking = self._config.getboolean('Tracking', 'enabled')
+                ## @brief Background refresh interval in seconds
+                self._refresh_interval = self._config.getint('Tracking', 'refresh_interval')
+                ## @brief Maximum cities in one group request
+                self._batch_size = min(20, self._config.getint('Tracking', 'batch_size'))
+                ## @brief Frequently requested cities registry
+                self._tracker = city_tracker.CityTracker(self._config.getint('Tracking', 'max_cities'),
+                                                         self._config.getfloat('Tracking', 'min_requests'))
+                ## @brief Background refresh request budget
+                self._budget = rate_limit.TokenBucket(self._config.getfloat('Tracking', 'requests_per_minute') / 60,
+                                                      self._config.getint('Tracking', 'burst'))
+            except ConfigParser.Error as e:
+                self._logger.warning('Fail to read tracking settings with error %s. Tracking disabled.' % e)
+                self._tracking = False
+                self._tracker = None
         except ConfigParser.Error as e:
             self._logger.error('Fail to read configuration file with error %s.Module unload' % e)
             raise ImportError
@@ -119,13 +168,24 @@ class Weather:
             threading.Thread(target=self.periodic_update).start()
         except OSError as e:
             self._logger.warning('Fail to start periodic update thread with error %s' % e)
+        if self._tracking:
+            try:
+                threading.Thread(target=self._refresh_tracked, name='WeatherTracking').start()
+            except OSError as e:
+                self._logger.warning('Fail to start tracked cities refresh thread with error %s' % e)
 
         self._logger.info('Weather module ready')
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
 
     ## @brief Stop module
     ## @details Stop all module thread and sub-programs
     def __del__(self):
         self._shutdown.set()
+        self._logger.debug('Weather cache statistics %s' % self._weather_cache.statistics())
+        self._logger.debug('HTTP statistics %s' % self._http_client.statistics())
+        if self._tracker is not None:
+            self._logger.debug('Tracked cities statistics %s' % self._tracker.statistics())
+        self._http_client.close()
         self._logger.info('Weather module shutdown')
 
     ## @brief Periodic update thread
@@ -137,28 +197,66 @@ class Weather:
     ## @see guiPlugin
     def periodic_update(self):
         self._logger.debug("Periodic update start started")
-        weather_data = WeatherData(self.api_key, self._logger)
-        weather_data.auto_update = False
-        weather_data.units = self._units
-        weather_data.icon_folder = self._temp_folder
-        weather_data.city_name = self._main_city
+        weather_data = self._weather_data(self._main_city)
         time.sleep(15)
         while True:
             self._logger.debug("Requesting periodic update for city %s" % weather_data.city_name)
             dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="weather_none.png")
-            weather_data.update()
-            dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="")
-            dispatcher.send(signal='WeatherUpdate',
-                            description=weather_data.short_description,
-                            temp=weather_data.temp,
-                            wind=weather_data.wind_description,
-                            icon=weather_data.icon
-                            )
+            try:
+                weather_data.update()
+            except IOError as e:
+                self._logger.warning('Periodic update failed with error %s' % e)
+            else:
+                dispatcher.send(signal='WeatherUpdate',
+                                description=weather_data.short_description,
+                                temp=weather_data.temp,
+                                wind=weather_data.wind_description,
+                                icon=weather_data.icon
+                                )
+            finally:
+                dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="")
+            self._weather_cache.prune()
             self._shutdown.wait(self._update_interval * 60 * 60)
             if self._shutdown.isSet():
                 self._logger.debug("Shutdown flag set  - exit from update thread")
                 return
 
+    ## @brief Tracked cities refresh thread
+    ## @details Current weather of tracked cities that expire before next round downloaded by group requests
+    # (up to 20 cities per request) and stored in weather cache. Number of requests limited by budget -
+    # cities that not fit budget postponed to next round.
+    ## @warning This function should not be called from outside
+    def _refresh_tracked(self):
+        weather_data = self._weather_data(self._main_city)
+        while True:
+            self._shutdown.wait(self._refresh_interval)
+            if self._shutdown.isSet():
+                self._logger.debug("Shutdown flag set  - exit from tracking thread")
+                return
+            due = dict()
+            for (city_key, units), city_id in self._tracker.tracked():
+                remaining = self._weather_cache.remaining((city_key, 'find', units))
+                if remaining is None or remaining < self._refresh_interval:
+                    due.setdefault(units, []).append((city_key, city_id))
+            for units, cities in due.items():
+                weather_data.units = units
+                for start in range(0, len(cities), self._batch_size):
+                    batch = cities[start:start + self._batch_size]
+                    if not self._budget.consume():
+                        self._logger.debug('Refresh budget exhausted - %d cities postponed' % (len(cities) - start))
+                        break
+                    try:
+                        items = weather_data.group(sorted(set(city_id for _, city_id in batch)))
+                    except IOError as e:
+                        self._logger.warning('Group refresh failed with error %s' % e)
+                        continue
+                    by_id = dict((item.get('id'), item) for item in items)
+                    for city_key, city_id in batch:
+                        if city_id in by_id:
+                            self._weather_cache.put((city_key, 'find', units),
+                                                    {'cod': '200', 'count': 1, 'list': [by_id[city_id]]})
+            self._logger.debug('Tracked cities statistics %s' % self._tracker.statistics())
+
     ## @brief Event wrapper for SpeechRecognize
     ## @details Check if user request for weather forecast
     ## @param entities - Dictionary with text parts
@@ -194,18 +292,19 @@ class Weather:
             city = self._main_city
 
         # time
+        day = None
         if 'datetime' in entities and entities['datetime'][0]['confidence'] > 0.5:
             unix_time = time.mktime(dateutil.parser.parse(str(entities['datetime'][0]['value'])).timetuple())
             self._logger.debug('Time requested - %i' % unix_time)
+            if entities['datetime'][0].get('grain') == 'day':
+                # Whole day requested (today, tomorrow) - described at midday, precipitation checked all day
+                day = (unix_time, unix_time + 24 * 60 * 60)
+                unix_time += 12 * 60 * 60
         else:
             unix_time = time.time()
             self._logger.debug('Using current time - %i' % unix_time)
 
-        weather_data = WeatherData(self.api_key, self._logger)
-        weather_data.auto_update = False
-        weather_data.units = self._units
-        weather_data.icon_folder = self._temp_folder
-        weather_data.city_name = city
+        weather_data = self._weather_data(city)
         weather_data.request_time = unix_time
         dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="weather_none.png")
         try:
@@ -214,12 +313,18 @@ class Weather:
             dispatcher.send(signal='SayText', text="Sorry, can't receive weather data")
         else:
             if entities['weather'][0]['value'] in ['rain', 'umbrella']:
-                if weather_data.rain is not None:
+                expected = weather_data.expected(day[0], day[1], 'rain') if day is not None else None
+                if expected is None:
+                    expected = weather_data.rain is not None
+                if expected:
                     response = "Yes, it look like. " + weather_data.description
                 else:
                     response = "No, it not look like." + weather_data.description
             elif entities['weather'][0]['value'] in ['show', 'blizzard']:
-                if weather_data.show is not None:
+                expected = weather_data.expected(day[0], day[1], 'snow') if day is not None else None
+                if expected is None:
+                    expected = weather_data.show is not None
+                if expected:
                     response = "Yes, it look like. " + weather_data.description
                 else:
                     response = "No, it not look like." + weather_data.description
@@ -237,14 +342,10 @@ class Weather:
     ## @param request_time Unix time for forecast. Optional. Default - now
     ## @param request_city Optional.Default - default city
     def custom_request(self, callback, custom_object=None, request_time=None, request_city=None):
-        weather_data = WeatherData(self.api_key, self._logger)
-        weather_data.auto_update = False
-        weather_data.units = self._units
-        weather_data.icon_folder = self._temp_folder
         # City
         if request_city is None:
             request_city = self._main_city
-        weather_data.city_name = request_city
+        weather_data = self._weather_data(request_city)
         # Time
         weather_time = time.time()
         if request_city is None:
@@ -263,14 +364,35 @@ class Weather:
                      temp='',
                      wind='',
                      icon='')
+        else:
+            callback(custom=custom_object,
+                     description=weather_data.short_description,
+                     temp=weather_data.temp,
+                     wind=weather_data.wind_description,
+                     icon=weather_data.icon)
         finally:
             dispatcher.send(signal='GuiNotification', source=self._gui_status, icon_path="")
 
-        callback(custom=custom_object,
-                 description=weather_data.short_description,
-                 temp=weather_data.temp,
-                 wind=weather_data.wind_description,
-                 icon=weather_data.icon)
+    ## @brief Create weather data instance
+    ## @details Instance configured with plugin settings and shared weather cache
+    ## @param city City name
+    ## @return WeatherData instance
+    def _weather_data(self, city):
+        weather_data = WeatherData(self.api_key, self._logger)
+        weather_data.auto_update = False
+        weather_data.units = self._units
+        weather_data.icon_folder = self._temp_folder
+        if self._base_url is not None and self._base_url != weather_data.base_url:
+            weather_data.base_url = self._base_url
+        if self._icon_url is not None and self._icon_url != weather_data.icon_url:
+            weather_data.icon_url = self._icon_url
+        weather_data.cache = self._weather_cache
+        weather_data.forecast_store = self._forecast_store
+        weather_data.http_client = self._http_client
+        weather_data.icon_cache = self._icon_cache
+        weather_data.tracker = self._tracker
+        weather_data.city_name = city
+        return weather_data
 
     ## @brief Restart user interaction
     ## @details After request process restart hot-word detection process
@@ -330,73 +452,46 @@ class WeatherData(object):
         self._icon_url = "http://openweathermap.org/img/w/"
         ## @brief Icon store folder
         self._icon_folder = ""
+        ## @brief Shared weather cache. None - always download
+        self._cache = None
+        ## @brief Shared forecast store. None - forecast parsed for each update
+        self._forecast_store = None
+        ## @brief Forecast of last update - (ForecastStore, key). None - current weather
+        self._forecast = None
+        ## @brief Shared HTTP client. None - urllib used
+        self._http_client = None
+        ## @brief Shared icon cache. None - icon downloaded into icon folder on every update
+        self._icon_cache = None
+        ## @brief Shared tracked cities registry. None - requests not tracked
+        self._tracker = None
 
     ## @brief Start weather fetching
     ## @details Connect to OpenWeatherMap site and download weather data
     def update(self):
         if self._city_name is None:
             return
-        # construct url
-        if (self._requested_time is None) or (abs(time.time() - self._requested_time) < 3 * 60 * 60):
-            # request current weather
-            request_url = self._base_url + "find?q=%s" % self._city_name
-            forecast = False
+        # request current weather if requested time close to now, otherwise forecast
+        forecast = not ((self._requested_time is None) or (abs(time.time() - self._requested_time) < 3 * 60 * 60))
+        endpoint = 'forecast' if forecast else 'find'
+        city_key = self._city_name.strip().lower()
+        if self._tracker is not None and not forecast:
+            remaining = self._cache.remaining((city_key, endpoint, self.units)) if self._cache is not None else None
+            self._tracker.record((city_key, self.units), remaining is not None and remaining > 0)
+        if self._cache is not None:
+            weather_json = self._cache.get((city_key, endpoint, self.units), lambda: self._download(endpoint))
         else:
-            # request forecast weather
-            request_url = self._base_url + "forecast?q=%s" % self._city_name
-            forecast = True
-        if self._units is not None:
-            request_url = request_url + "&units=%s" % self._units
-        request_url = request_url + "&appid=%s" % self._api_key
-        # download
-        try:
-            self._logger.debug("Requesting json. Forecast mode - %s" % forecast)
-            response_json = urllib.urlopen(request_url)
-        except IOError as e:
-            raise IOError('Fail to download JSON with error %s' % e)
-
-        weather_json = json.loads(response_json.read())
+            weather_json = self._download(endpoint)
+        if self._tracker is not None and not forecast and weather_json.get('list'):
+            self._tracker.learn((city_key, self.units), weather_json['list'][0].get('id'))
         # Parse
-        if str(weather_json['cod']) != "200":
-            raise IOError("Fail to retrieve json with error code %s - request string %s" % (str(weather_json['cod']),
-                                                                                            request_url))
-        else:
-            self._logger.debug("Weather data receive")
         if forecast:
-            forecast_time = []
-            for single_forecast in weather_json['list']:
-                # collect all forecast times
-                forecast_time.append(single_forecast['dt'])
-
-            pos = bisect_left(forecast_time, self._requested_time)
-            if pos == 0:
-                index = 0
-            elif pos == len(forecast_time):
-                index = len(forecast_time) - 1
-            else:
-                before = forecast_time[pos - 1]
-                after = forecast_time[pos]
-                if after - self._requested_time < self._requested_time - before:
-                    index = pos
-                else:
-                    index = pos - 1
-
-            self.weather_data = dict(
-                title=str(weather_json['list'][index]['weather'][0]['main']),
-                description=str(weather_json['list'][index]['weather'][0]['description']),
-                icon=str(weather_json['list'][index]['weather'][0]['icon']),
-                temp=weather_json['list'][index]['main']['temp'],
-                temp_max=weather_json['list'][index]['main'].get('temp_max', None),
-                temp_min=weather_json['list'][index]['main'].get('temp_min', None),
-                pressure=weather_json['list'][index]['main']['pressure'],
-                humidity=weather_json['list'][index]['main']['humidity'],
-                wind_speed=weather_json['list'][index]['wind'].get('speed', None),
-                wind_direction=weather_json['list'][index]['wind'].get('deg', None),
-                rain=None,
-                snow=None,
-                clouds=weather_json['list'][index]['clouds'].get('all', None),
-                timestamp=int(weather_json['list'][index]['dt'])
-            )
+            key = (self._city_name.strip().lower(), self.units)
+            store = self._forecast_store if self._forecast_store is not None else forecast_store.ForecastStore()
+            weather_data = store.at(key, self._requested_time, weather_json)
+            if weather_data is None:
+                raise IOError('Empty forecast received')
+            self._forecast = (store, key)
+            self.weather_data = weather_data
             self._city_name = weather_json['city']['name']
         else:
             index = 0
@@ -417,8 +512,14 @@ class WeatherData(object):
                 timestamp=int(weather_json['list'][index]['dt'])
             )
             self._city_name = weather_json['list'][0]['name']
+            self._forecast = None
 
-        if os.path.isdir(self.icon_folder):
+        if self._icon_cache is not None:
+            try:
+                self.weather_data['icon'] = self._icon_cache.path(self.weather_data['icon'], self.icon_url)
+            except (IOError, OSError) as e:
+                self._logger.warning('Fail to get icon with error %s' % e)
+        elif os.path.isdir(self.icon_folder):
             try:
                 urllib.urlretrieve(self.icon_url + self.weather_data['icon'] + ".png",
                                    os.path.join(self.icon_folder, self.weather_data['icon'] + ".png"))
@@ -427,6 +528,85 @@ class WeatherData(object):
             else:
                 self.weather_data['icon'] = os.path.join(self.icon_folder, self.weather_data['icon'] + ".png")
 
+    ## @brief Download current weather of several cities by one request
+    ## @param city_ids List of OpenWeatherMap city ids (up to 20)
+    ## @return List of city weather in find endpoint format
+    ## @exception IOError Download failed or error code received
+    def group(self, city_ids):
+        return self._download('group', 'id=%s' % ','.join(str(city_id) for city_id in city_ids)).get('list', [])
+
+    ## @brief Download weather JSON
+    ## @param endpoint API endpoint - find (current weather), forecast or group
+    ## @param query Query string. Default - query by city name
+    ## @return Parsed JSON
+    ## @exception IOError Download failed or error code received
+    def _download(self, endpoint, query=None):
+        request_url = self._base_url + "%s?%s" % (endpoint, query or "q=%s" % self._city_name)
+        if self._units is not None:
+            request_url = request_url + "&units=%s" % self._units
+        request_url = request_url + "&appid=%s" % self._api_key
+        try:
+            self._logger.debug("Requesting json. Endpoint - %s" % endpoint)
+            if self._http_client is not None:
+                weather_json = json.loads(self._http_client.get(request_url).body)
+            else:
+                weather_json = json.loads(urllib.urlopen(request_url).read())
+        except IOError as e:
+            raise IOError('Fail to download JSON with error %s' % e)
+        except ValueError as e:
+            raise IOError('Fail to parse JSON with error %s' % e)
+        # group endpoint report no code on success
+        if str(weather_json.get('cod', 200)) != "200":
+            raise IOError("Fail to retrieve json with error code %s - request string %s" %
+                          (str(weather_json.get('cod')), request_url))
+        self._logger.debug("Weather data receive")
+        return weather_json
+
+    ## @brief Shared weather cache
+    @property
+    def cache(self):
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache):
+        self._cache = cache
+
+    ## @brief Shared forecast store
+    @property
+    def forecast_store(self):
+        return self._forecast_store
+
+    @forecast_store.setter
+    def forecast_store(self, store):
+        self._forecast_store = store
+
+    ## @brief Shared HTTP client
+    @property
+    def http_client(self):
+        return self._http_client
+
+    @http_client.setter
+    def http_client(self, client):
+        self._http_client = client
+
+    ## @brief Shared icon cache
+    @property
+    def icon_cache(self):
+        return self._icon_cache
+
+    @icon_cache.setter
+    def icon_cache(self, cache):
+        self._icon_cache = cache
+
+    ## @brief Shared tracked cities registry
+    @property
+    def tracker(self):
+        return self._tracker
+
+    @tracker.setter
+    def tracker(self, tracker):
+        self._tracker = tracker
+
     ## @brief Base URL
     @property
     def base_url(self):
@@ -567,6 +747,19 @@ class WeatherData(object):
     def show(self):
         return self.weather_data['snow']
 
+    ## @brief Check precipitation in time range
+    ## @details Answered from forecast series of last update
+    ## @param start Range start - Unix time
+    ## @param end Range end - Unix time
+    ## @param column rain or snow
+    ## @return True/False or None if last update was not forecast
+    ## @pre Valid only after update
+    def expected(self, start, end, column='rain'):
+        if self._forecast is None:
+            return None
+        store, key = self._forecast
+        return store.expected(key, start, end, column)
+
     ## @brief Cloud
     ## @pre Valid only after update
     @property
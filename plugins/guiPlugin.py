@@ -21,6 +21,7 @@ import facebook
 
 import wx
 
+from core import bus
 
 ## @class Gui
 ## @brief Main GUI
@@ -47,6 +48,8 @@ class Gui(wx.Frame):
         self._gui_update_lock = threading.Lock()
         ## @brief dictionary of notification icons and their owners
         self._notification_tray = {}
+        ## @brief dictionary of loaded tray bitmaps by icon path
+        self._notification_bitmaps = {}
         try:
             self._logger = logging.getLogger('moduleGui')
         except ConfigParser.NoSectionError as e:
@@ -78,6 +81,11 @@ class Gui(wx.Frame):
             self._ignore_albums.split(';')
 
             self._animation_active = self._config.getboolean('General', 'animation')
+            try:
+                ## @brief Tray update frame interval - notifications of same source inside frame are merged
+                self._notification_interval = self._config.getfloat('General', 'notification_interval')
+            except ConfigParser.Error:
+                self._notification_interval = 0.05
 
             self._temp_folder = self._config.get('General', 'temp_folder')
             if not os.path.exists(self._temp_folder):
@@ -120,11 +128,16 @@ class Gui(wx.Frame):
         # end wxGlade
         # Microphone activity
         self._logger.debug('Registering on events')
+        # GUI only display data - all events delivered from bus queues, senders never wait GUI
         try:
-            dispatcher.connect(self._notification, signal='GuiNotification', sender=dispatcher.Any)
-            dispatcher.connect(self._system_response_text, signal='SayText', sender=dispatcher.Any)
-            dispatcher.connect(self._user_request_text, signal='SpeechRecognize', sender=dispatcher.Any)
-            dispatcher.connect(self._weather_display, signal='WeatherUpdate', sender=dispatcher.Any)
+            # Only latest icon per source reach GUI thread, repeated icons are dropped
+            bus.connect(self._notification, signal='GuiNotification', asynchronous=True, queue_size=50,
+                        overflow=bus.COALESCE, coalesce_key=lambda named: named.get('source'),
+                        coalesce_interval=self._notification_interval, suppress_unchanged=True)
+            bus.connect(self._system_response_text, signal='SayText', asynchronous=True, queue_size=5)
+            bus.connect(self._user_request_text, signal='SpeechRecognize', asynchronous=True, queue_size=5)
+            bus.connect(self._weather_display, signal='WeatherUpdate', asynchronous=True, queue_size=1,
+                        overflow=bus.COALESCE)
         except dispatcher.DispatcherTypeError as e:
             self._logger.error('Fail to subscribe on event with error %s.Module unload' % e)
             raise ImportError
@@ -260,8 +273,18 @@ class Gui(wx.Frame):
         time.sleep(self._clear_delay)
         wx.CallAfter(self.safe_update, func, data)
 
+    ## @brief Tray bitmap
+    ## @details Bitmaps loaded from disk once and reused
+    ## @param icon_path - Relative path of icon for tray
+    ## @return wx.Bitmap instance
+    def _tray_bitmap(self, icon_path):
+        if icon_path not in self._notification_bitmaps:
+            self._notification_bitmaps[icon_path] = wx.Bitmap(os.path.join('./plugins/Icons/', icon_path),
+                                                              wx.BITMAP_TYPE_ANY)
+        return self._notification_bitmaps[icon_path]
+
     ## @brief Wrapper for tray update
-    ## @details Thread safe tray update
+    ## @details Thread safe tray update. Called from event bus queue - notifications already coalesced per source
     ## @param source - Unique id of caller
     ## @param icon_path - Relative path of icon for tray
     def _notification(self, source, icon_path):
@@ -269,21 +292,24 @@ class Gui(wx.Frame):
             if icon_path == '':
                 self._logger.debug('Removing notification from %s' % source)
                 wx.CallAfter(self.safe_update, self._notification_tray[source].SetBitmap,
-                             wx.Bitmap('./plugins/Icons/empty.png', wx.BITMAP_TYPE_ANY))
+                             self._tray_bitmap('empty.png'))
                 self._notification_slots.insert(0, self._notification_tray[source])
                 del self._notification_tray[source]
             else:
                 self._logger.debug('Updating notification tray - source %s, icon - %s' % (source, icon_path))
                 wx.CallAfter(self.safe_update, self._notification_tray[source].SetBitmap,
-                             wx.Bitmap(os.path.join('./plugins/Icons/', icon_path), wx.BITMAP_TYPE_ANY))
+                             self._tray_bitmap(icon_path))
         else:
+            if icon_path == '':
+                # Nothing to remove
+                return
             if len(self._notification_slots) == 0:
                 self._logger.warning('No free notification slots')
                 return
             self._notification_tray[source] = self._notification_slots[0]
             self._notification_slots = self._notification_slots[1:]
             wx.CallAfter(self.safe_update, self._notification_tray[source].SetBitmap,
-                         wx.Bitmap(os.path.join('./plugins/Icons/', icon_path), wx.BITMAP_TYPE_ANY))
+                         self._tray_bitmap(icon_path))
 
     ## @brief Main picture animation
     ## @details Create slow change effect of main picture
@@ -394,9 +420,15 @@ class GuiPlugin:
     version = '1.0.0.0'
     ## @brief Plugin description
     description = 'GUI'
+    ## @brief Signals served by plugin - loader manifest
+    provides = ('GuiNotification', 'WeatherUpdate')
+    ## @brief Signals required before plugin start - loader manifest
+    consumes = ()
+    ## @brief Plugin send PluginReady event when ready
+    report_ready = True
 
     ## @brief Start GUI
-    ## @details Start GUI initialization in thread
+    ## @details Start GUI initialization in thread. PluginReady event sent when GUI frame shown
     def __init__(self):
         threading.Thread(target=self._gui_thread).start()
 
@@ -410,4 +442,5 @@ class GuiPlugin:
         t = threading.Thread(target=gui.MainLoop)
         t.setDaemon(1)
         t.start()
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
 
@@ -17,6 +17,9 @@ import time
 class Spy:
     version = '1.0.0.0'
     description = 'Network scanner'
+    provides = ('GetActiveUser',)
+    consumes = ()
+    report_ready = True
 
     def __init__(self):
         self._gui_status = str(uuid4())
@@ -64,6 +67,7 @@ class Spy:
         
         self._logger.info('Starting passive scan')
         threading.Thread(target=self._scan_network).start()
+        dispatcher.send(signal='PluginReady', name=self.__class__.__name__)
 
     def __del__(self):
         self._logger.info('Shutdown')